@@ -15,6 +15,7 @@ from .models import (
     ProductImage,
     Conversation,
     Message,
+    Job,
 )
 
 
@@ -167,6 +168,13 @@ class ConversationAdmin(admin.ModelAdmin):
     search_fields = ('order__id',)
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('locked_by', 'locked_until', 'last_error', 'created_at', 'finished_at')
+
+
 # Register remaining models safely (skip if already registered)
 for mdl in (Order, EmailVerification, Favorite, Review, ProductImage, Message):
     try:
@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class SeafoodConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'seafood'
\ No newline at end of file
+    name = 'seafood'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
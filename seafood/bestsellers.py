@@ -0,0 +1,104 @@
+"""
+Best-seller ranking ("Хіти продажу").
+
+ProductSalesRank holds per-product sales (grams, revenue, orders) over a
+sliding window of BESTSELLERS_WINDOW_DAYS, aggregated from OrderItem.
+
+  - refresh_rankings() rebuilds the table from scratch; run it periodically
+    (`manage.py refresh_bestsellers`, e.g. nightly from cron) so sales that
+    fell out of the window stop counting.
+  - record_order(order) adds one new order as it is placed (seafood.orders), so the
+    ranking reacts immediately without a full rebuild.
+
+Readers get a ready-ranked list with one indexed query (top_products).
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, Sum, Value, When
+from django.utils import timezone
+
+from .catalog import HITS_VERSION_KEY, bump_catalog_version, bump_version
+from .models import OrderItem, ProductSalesRank, SeafoodProduct
+
+logger = logging.getLogger(__name__)
+
+# ORDER BY matching the seafood_sales_rank_idx index
+RANK_ORDERING = ('-sales_rank__revenue', '-sales_rank__quantity_g', 'id')
+
+
+def window_start():
+    days = getattr(settings, 'BESTSELLERS_WINDOW_DAYS', 90)
+    return timezone.now() - timedelta(days=days)
+
+
+def refresh_rankings():
+    """Rebuild ProductSalesRank from the OrderItems in the window; returns the number of ranked products."""
+    rows = (
+        OrderItem.objects
+        .filter(order__created_at__gte=window_start(), product__isnull=False)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity_g'), revenue=Sum('total_price'), orders=Count('order_id', distinct=True))
+    )
+    ranks = [
+        ProductSalesRank(
+            product_id=row['product_id'],
+            quantity_g=row['quantity'] or 0,
+            revenue=row['revenue'] or 0,
+            order_count=row['orders'],
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        ProductSalesRank.objects.all().delete()
+        ProductSalesRank.objects.bulk_create(ranks)
+        # ?filter=hits catalog pages are cached under the catalog version
+        transaction.on_commit(bump_catalog_version)
+    return len(ranks)
+
+
+def _per_product(rows, key):
+    return Case(
+        *[When(product_id=product_id, then=Value(int(row[key] or 0))) for product_id, row in rows.items()],
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+
+
+def record_order(order):
+    """
+    Add the items of a freshly created order to the ranking. Three
+    statements whatever the number of products: the aggregate, an insert of
+    the missing rank rows and one UPDATE adding to all of them.
+    """
+    rows = {
+        row['product_id']: row
+        for row in order.items.filter(product__isnull=False)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity_g'), revenue=Sum('total_price'))
+    }
+    if not rows:
+        return
+    # rows a concurrent order creates first are left alone and added to below
+    ProductSalesRank.objects.bulk_create(
+        [ProductSalesRank(product_id=product_id) for product_id in rows], ignore_conflicts=True,
+    )
+    ProductSalesRank.objects.filter(product_id__in=rows).update(
+        quantity_g=F('quantity_g') + _per_product(rows, 'quantity'),
+        revenue=F('revenue') + _per_product(rows, 'revenue'),
+        order_count=F('order_count') + 1,
+        updated_at=timezone.now(),
+    )
+    transaction.on_commit(lambda: bump_version(HITS_VERSION_KEY))
+
+
+def top_products(limit=10):
+    """Best sellers, best first (one query over the rank index)."""
+    return list(
+        SeafoodProduct.objects
+        .filter(sales_rank__revenue__gt=0)
+        .order_by(*RANK_ORDERING)[:limit]
+    )
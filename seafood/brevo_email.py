@@ -2,18 +2,310 @@
 Brevo (SendinBlue) email integration utility module.
 Provides functions to send emails via Brevo Transactional Email API.
 No SDK dependency - uses requests library directly.
+
+Messages go through an Outbox. `flush()` groups queued messages that share
+their content (subject, bodies, sender, tags, ...) and sends each group as
+ONE Brevo request. Each recipient becomes one entry in `messageVersions`,
+so recipients still get separate emails and don't see each other. Groups
+are split into requests of at most BREVO_BATCH_SIZE versions.
+
+All Brevo calls share one pooled requests.Session (keep-alive, one TLS
+handshake per process), and SMTP fallbacks share one persistent Django
+mail connection.
+
+A circuit breaker watches Brevo. After BREVO_BREAKER_THRESHOLD failed
+requests in a row it opens, and for BREVO_BREAKER_RESET_SECONDS messages go
+straight to SMTP without waiting on Brevo's timeout. After that one trial
+request decides whether it closes again. Whatever Brevo did not take in a
+flush is sent over SMTP in one batch at the end of that flush, rather than
+message by message as the failures happen.
+
+`send_email_via_brevo` is a one-message outbox. The job queue flushes
+whole batches (seafood.tasks).
 """
 
 from django.conf import settings
-from django.core.mail import send_mail as django_send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 import logging
+import threading
+import time
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, NamedTuple, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 # Brevo API endpoint for sending transactional emails
 BREVO_API_URL = 'https://api.brevo.com/v3/smtp/email'
+BREVO_TIMEOUT = 10
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET_SECONDS = 60
+
+
+class OutgoingEmail(NamedTuple):
+    recipient_email: str
+    recipient_name: str
+    subject: str
+    html_content: Optional[str]
+    text_content: Optional[str]
+    sender_email: str
+    sender_name: str
+    reply_to: Optional[str]
+    cc: Tuple[str, ...]
+    bcc: Tuple[str, ...]
+    tags: Tuple[str, ...]
+
+    def content_key(self):
+        """Everything but the recipient: messages with equal keys share one Brevo request."""
+        return self[2:]
+
+
+class CircuitBreaker:
+    """
+    Closed: requests go through. Open (after `threshold` consecutive
+    failures): requests are refused for `reset_after` seconds. Half-open:
+    one trial request is let through; its outcome closes or re-opens.
+    """
+
+    def __init__(self, threshold=None, reset_after=None):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def _threshold(self):
+        return self.threshold or getattr(settings, 'BREVO_BREAKER_THRESHOLD', DEFAULT_BREAKER_THRESHOLD)
+
+    def _reset_after(self):
+        return self.reset_after or getattr(settings, 'BREVO_BREAKER_RESET_SECONDS', DEFAULT_BREAKER_RESET_SECONDS)
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self._reset_after():
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self._threshold():
+                if self.opened_at is None:
+                    logger.warning(f'Brevo failed {self.failures} times in a row; sending over SMTP for now')
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+_session = None
+_smtp_connection = None
+
+
+def brevo_session():
+    """The process-wide pooled session for Brevo API calls."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        _session = session
+    return _session
+
+
+def _smtp():
+    """The persistent SMTP connection (opened on first use, reopened after errors)."""
+    global _smtp_connection
+    if _smtp_connection is None:
+        _smtp_connection = get_connection(fail_silently=False)
+        _smtp_connection.open()
+    return _smtp_connection
+
+
+def _drop_smtp():
+    global _smtp_connection
+    if _smtp_connection is not None:
+        try:
+            _smtp_connection.close()
+        except Exception:
+            pass
+        _smtp_connection = None
+
+
+class Outbox:
+    """Collects messages and sends them, coalesced, on flush()."""
+
+    def __init__(self):
+        self.messages: List[OutgoingEmail] = []
+
+    def add(
+        self,
+        subject: str,
+        recipient_email: str,
+        recipient_name: str = '',
+        html_content: Optional[str] = None,
+        text_content: Optional[str] = None,
+        sender_email: Optional[str] = None,
+        sender_name: Optional[str] = None,
+        reply_to: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+    ) -> int:
+        """Queue one message; returns its index in the list flush() returns."""
+        # Default to text_content if html_content is not provided
+        if not html_content and text_content:
+            html_content = text_content.replace('\n', '<br>')
+        self.messages.append(OutgoingEmail(
+            recipient_email=recipient_email,
+            recipient_name=recipient_name,
+            subject=subject,
+            html_content=html_content,
+            text_content=text_content,
+            sender_email=sender_email or getattr(settings, 'BREVO_SENDER_EMAIL', ''),
+            sender_name=sender_name or getattr(settings, 'BREVO_SENDER_NAME', 'VugriUkraine'),
+            reply_to=reply_to,
+            cc=tuple(cc or ()),
+            bcc=tuple(bcc or ()),
+            tags=tuple(tags or ()),
+        ))
+        return len(self.messages) - 1
+
+    def flush(self) -> List[bool]:
+        """Send everything queued; one True/False per message, in the order added."""
+        messages, self.messages = self.messages, []
+        results = [False] * len(messages)
+        api_key = getattr(settings, 'BREVO_API_KEY', '')
+        if not api_key:
+            logger.warning('Brevo API key is not configured; falling back to SMTP')
+
+        groups: Dict[tuple, List[int]] = {}
+        for index, message in enumerate(messages):
+            if not message.html_content and not message.text_content:
+                logger.error('Either html_content or text_content must be provided')
+                continue
+            if api_key and not message.sender_email:
+                logger.error('Brevo sender email is not configured')
+                continue
+            groups.setdefault(message.content_key(), []).append(index)
+
+        fallback = []
+        batch_size = getattr(settings, 'BREVO_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        for indexes in groups.values():
+            for start in range(0, len(indexes), batch_size):
+                chunk = indexes[start:start + batch_size]
+                if api_key and breaker.allow() and self._post(api_key, [messages[i] for i in chunk]):
+                    for i in chunk:
+                        results[i] = True
+                else:
+                    fallback.extend(chunk)
+
+        if fallback:
+            if api_key:
+                logger.warning(f'Falling back to SMTP for {len(fallback)} message(s)')
+            for i, sent in zip(fallback, _send_smtp([messages[i] for i in fallback])):
+                results[i] = sent
+        return results
+
+    def _post(self, api_key: str, chunk: List[OutgoingEmail]) -> bool:
+        first = chunk[0]
+        payload = {
+            'subject': first.subject,
+            'sender': {
+                'name': first.sender_name,
+                'email': first.sender_email,
+            },
+            'messageVersions': [
+                {'to': [{'name': m.recipient_name or m.recipient_email, 'email': m.recipient_email}]}
+                for m in chunk
+            ],
+        }
+        if first.html_content:
+            payload['htmlContent'] = first.html_content
+        if first.text_content:
+            payload['textContent'] = first.text_content
+        if first.reply_to:
+            payload['replyTo'] = {'email': first.reply_to}
+        if first.cc:
+            payload['cc'] = [{'email': email} for email in first.cc]
+        if first.bcc:
+            payload['bcc'] = [{'email': email} for email in first.bcc]
+        if first.tags:
+            payload['tags'] = list(first.tags)
+
+        try:
+            response = brevo_session().post(
+                getattr(settings, 'BREVO_API_URL', BREVO_API_URL),
+                headers={'api-key': api_key, 'Content-Type': 'application/json'},
+                json=payload,
+                timeout=getattr(settings, 'BREVO_TIMEOUT', BREVO_TIMEOUT),
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f'Network error sending email via Brevo: {str(e)}')
+            breaker.record_failure()
+            return False
+
+        if response.status_code in (200, 201):
+            breaker.record_success()
+            message_ids = response.json().get('messageIds', [])
+            logger.info(f'Email sent via Brevo to {len(chunk)} recipient(s). Message IDs: {message_ids}')
+            return True
+        logger.error(f'Brevo API error {response.status_code}: {response.text}')
+        breaker.record_failure()
+        return False
+
+
+def _smtp_message(message: OutgoingEmail, connection) -> EmailMultiAlternatives:
+    email = EmailMultiAlternatives(
+        message.subject,
+        message.text_content or '',
+        getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        [message.recipient_email],
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=[message.reply_to] if message.reply_to else None,
+        connection=connection,
+    )
+    if message.html_content:
+        email.attach_alternative(message.html_content, 'text/html')
+    return email
+
+
+def _send_smtp(messages: List[OutgoingEmail]) -> List[bool]:
+    """Send `messages` over the persistent SMTP connection, reconnecting once if it went stale."""
+    results = []
+    for message in messages:
+        sent = False
+        for attempt in (1, 2):
+            try:
+                connection = _smtp()
+                sent = bool(connection.send_messages([_smtp_message(message, connection)]))
+                break
+            except Exception as exc:
+                _drop_smtp()
+                if attempt == 2:
+                    logger.error(f'SMTP fallback failed: {exc}')
+        results.append(sent)
+    return results
 
 
 def send_email_via_brevo(
@@ -46,120 +338,14 @@ def send_email_via_brevo(
         tags: List of tags for email categorization
         
     Returns:
-        True if email was sent successfully, False otherwise
+        True if email was sent successfully (via Brevo or the SMTP fallback), False otherwise
     """
-    
-    api_key = getattr(settings, 'BREVO_API_KEY', '')
-    if not api_key:
-        logger.warning('Brevo API key is not configured; falling back to SMTP')
-        try:
-            django_send_mail(
-                subject,
-                text_content or '',
-                getattr(settings, 'DEFAULT_FROM_EMAIL', None),
-                [recipient_email],
-                html_message=html_content,
-                fail_silently=False,
-            )
-            return True
-        except Exception as exc:
-            logger.error(f'SMTP fallback failed: {exc}')
-            return False
-    
-    sender_email = sender_email or getattr(settings, 'BREVO_SENDER_EMAIL', '')
-    sender_name = sender_name or getattr(settings, 'BREVO_SENDER_NAME', 'VugriUkraine')
-    
-    if not sender_email:
-        logger.error('Brevo sender email is not configured')
-        return False
-    
-    if not html_content and not text_content:
-        logger.error('Either html_content or text_content must be provided')
-        return False
-    
-    # Default to text_content if html_content is not provided
-    if not html_content and text_content:
-        html_content = text_content.replace('\n', '<br>')
-    
-    try:
-        # Build email payload for Brevo API
-        payload = {
-            'subject': subject,
-            'sender': {
-                'name': sender_name,
-                'email': sender_email,
-            },
-            'to': [{
-                'name': recipient_name or recipient_email,
-                'email': recipient_email,
-            }],
-        }
-        
-        # Add content
-        if html_content:
-            payload['htmlContent'] = html_content
-        if text_content:
-            payload['textContent'] = text_content
-        
-        # Add optional fields
-        if reply_to:
-            payload['replyTo'] = {
-                'email': reply_to,
-            }
-        
-        if cc:
-            payload['cc'] = [{'email': email} for email in cc]
-        
-        if bcc:
-            payload['bcc'] = [{'email': email} for email in bcc]
-        
-        if tags:
-            payload['tags'] = tags
-        
-        # Set up headers with API key
-        headers = {
-            'api-key': api_key,
-            'Content-Type': 'application/json',
-        }
-        
-        # Send email via Brevo API
-        response = requests.post(
-            BREVO_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-        
-        # Check response status
-        if response.status_code in (200, 201):
-            response_data = response.json()
-            message_id = response_data.get('messageId', 'N/A')
-            logger.info(f'Email sent successfully to {recipient_email}. Message ID: {message_id}')
-            return True
-        else:
-            error_msg = response.text
-            logger.error(f'Brevo API error {response.status_code}: {error_msg}')
-            logger.warning('Falling back to SMTP after Brevo failure')
-            try:
-                django_send_mail(
-                    subject,
-                    text_content or '',
-                    getattr(settings, 'DEFAULT_FROM_EMAIL', None),
-                    [recipient_email],
-                    html_message=html_content,
-                    fail_silently=False,
-                )
-                return True
-            except Exception as exc:
-                logger.error(f'SMTP fallback failed: {exc}')
-                return False
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f'Network error sending email via Brevo: {str(e)}')
-        return False
-    except Exception as e:
-        logger.error(f'Error sending email via Brevo: {str(e)}')
-        return False
+    outbox = Outbox()
+    outbox.add(
+        subject, recipient_email, recipient_name, html_content, text_content,
+        sender_email, sender_name, reply_to, cc, bcc, tags,
+    )
+    return outbox.flush()[0]
 
 
 def send_verification_email(email: str, code: str) -> bool:
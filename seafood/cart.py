@@ -0,0 +1,154 @@
+"""
+Database-backed shopping cart.
+
+A signed-in user has one Cart row (Cart.user). An anonymous visitor gets
+one keyed by a random `session_key`, stored in the visitor's session under
+CART_SESSION_KEY; session data is copied across the key rotation at login,
+so the cart can still be found there. Each product is one CartItem row, and
+every mutation is a single-row statement:
+
+  - add is an F() increment, or an insert when the line is new. If a
+    concurrent request inserted it first, the insert falls back to the
+    increment.
+  - setting a quantity is one UPDATE, and removing is one DELETE.
+
+Two tabs adding at the same time are both counted, instead of one whole-
+session write overwriting the other.
+
+At login the anonymous cart is merged into the user's (seafood.signals). A
+cart left in the old `session['cart']` dict is imported on first use.
+
+Prices are never stored: `price` runs the cart through seafood.pricing.
+"""
+
+import secrets
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from . import pricing
+from .models import Cart, CartItem, SeafoodProduct
+
+CART_SESSION_KEY = 'cart_key'
+LEGACY_SESSION_KEY = 'cart'
+
+
+def get_cart(request, create=False):
+    """The request's Cart, created on demand when `create`; None if there is none yet."""
+    cart = getattr(request, '_cart', None)
+    if cart is not None:
+        return cart
+    legacy = request.session.get(LEGACY_SESSION_KEY)
+    create = create or bool(legacy)
+
+    if request.user.is_authenticated:
+        cart = Cart.objects.filter(user=request.user).first()
+        if cart is None and create:
+            cart, _created = Cart.objects.get_or_create(user=request.user)
+    else:
+        key = request.session.get(CART_SESSION_KEY)
+        cart = Cart.objects.filter(session_key=key).first() if key else None
+        if cart is None and create:
+            cart = Cart.objects.create(session_key=secrets.token_hex(16))
+            request.session[CART_SESSION_KEY] = cart.session_key
+
+    if legacy is not None:
+        if isinstance(legacy, dict):
+            _import_legacy(cart, legacy)
+        request.session.pop(LEGACY_SESSION_KEY, None)
+    request._cart = cart
+    return cart
+
+
+def legacy_product_id(key, item):
+    """Product id of an old session cart entry (keys are '<id>', 'u:<id>' or 'g:<id>:<units>')."""
+    if item.get('product_id'):
+        return int(item['product_id'])
+    parts = str(key).split(':')
+    raw = parts[1] if parts[0] in ('u', 'g') and len(parts) > 1 else parts[0]
+    try:
+        return int(raw)
+    except ValueError:
+        return None
+
+
+def _import_legacy(cart, legacy):
+    wanted = {}
+    for key, item in legacy.items():
+        if not isinstance(item, dict):
+            continue
+        product_id = legacy_product_id(key, item)
+        try:
+            quantity = int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            continue
+        if product_id and quantity > 0:
+            wanted[product_id] = wanted.get(product_id, 0) + quantity
+    existing = set(SeafoodProduct.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+    for product_id, quantity in wanted.items():
+        if product_id in existing:
+            add(cart, product_id, quantity)
+
+
+def _increment(cart, product_id, quantity):
+    return CartItem.objects.filter(cart=cart, product_id=product_id).update(quantity=F('quantity') + quantity)
+
+
+def add(cart, product_id, quantity=1):
+    """Add `quantity` steps of a product to the cart."""
+    if _increment(cart, product_id, quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # a concurrent request created the line first
+        _increment(cart, product_id, quantity)
+
+
+def set_quantity(cart, product_id, quantity):
+    """Set a line's quantity (0 or less removes it). False if the product is not in the cart."""
+    if quantity <= 0:
+        return remove(cart, product_id)
+    return bool(CartItem.objects.filter(cart=cart, product_id=product_id).update(quantity=quantity))
+
+
+def remove(cart, product_id):
+    return bool(CartItem.objects.filter(cart=cart, product_id=product_id).delete()[0])
+
+
+def clear(cart):
+    if cart is not None:
+        cart.items.all().delete()
+
+
+def count(cart):
+    """Total quantity in the cart (what the header badge shows)."""
+    if cart is None:
+        return 0
+    return cart.items.aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def merge(source, target):
+    """Move every line of `source` into `target` and delete `source`."""
+    for product_id, quantity in source.items.values_list('product_id', 'quantity'):
+        add(target, product_id, quantity)
+    source.delete()
+
+
+def merge_session_cart(request, user):
+    """At login: fold the anonymous cart of this session into `user`'s cart."""
+    key = request.session.pop(CART_SESSION_KEY, None)
+    anonymous = Cart.objects.filter(session_key=key, user__isnull=True).first() if key else None
+    if anonymous is None:
+        return
+    target, _created = Cart.objects.get_or_create(user=user)
+    with transaction.atomic():
+        merge(anonymous, target)
+    request._cart = target
+
+
+def price(cart):
+    """The cart priced by seafood.pricing (empty when there is no cart)."""
+    items = cart.items.values_list('product_id', 'quantity') if cart is not None else []
+    return pricing.price_items(items)
@@ -0,0 +1,284 @@
+"""
+Catalog query layer for the `/products/` page.
+
+Prepared product cards are cached per filter set and page under a global
+catalog version. Every change to products, categories or product images
+bumps the version (see `seafood.signals`), so stale entries are never read
+again and simply expire. ?filter=hits pages are also keyed on the
+best-seller version, which every new order bumps. A warm catalog page therefore costs no DB queries,
+and because the version lives in the shared cache backend, all gunicorn
+workers see the same invalidation.
+"""
+
+import hashlib
+import time
+from decimal import Decimal, InvalidOperation
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .images import attach_variants
+from .models import SeafoodProduct, Category
+from .pagination import keyset_page
+from .search import search_product_ids, tokens
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# bumped when a new order changes the best-seller ranking (seafood.bestsellers);
+# ?filter=hits pages depend on it as well as on the catalog version
+HITS_VERSION_KEY = 'bestsellers:version'
+
+# Used when the DB has no Category rows yet (kept from the original view).
+FALLBACK_CATEGORIES = [
+    "Ікра", "Печінка тріски", "В'ялена риба та ікра",
+    "Делікатеси", "М'ясо краба", "Креветки", "Морепродукти"
+]
+
+# Keyset orderings per ?sort value; each ends with a unique column so the
+# cursor is unambiguous. Price sorts use the stored `effective_price` column
+# (what the card shows), so per-unit and per-package products sort correctly
+# and use the (effective_price, id) index.
+SORT_ORDERING = {
+    'price_asc': ('effective_price', 'id'),
+    'price_desc': ('-effective_price', '-id'),
+    'name_asc': ('name', 'id'),
+    'name_desc': ('-name', '-id'),
+    'newest': ('-created_at', '-id'),
+    # stored rating_avg (see seafood.reviews); unrated products last
+    'rating': ('-rating_avg', '-review_count', 'id'),
+}
+DEFAULT_ORDERING = ('name', 'id')
+# ?q= without an explicit sort: best match first (see `_rank_by_relevance`)
+SEARCH_ORDERING = ('search_rank', 'id')
+# ?filter=hits without an explicit sort: best sellers first (seafood.bestsellers)
+HITS_ORDERING = ('-sales_revenue', '-sales_quantity', 'id')
+
+
+def _new_version():
+    # Millisecond timestamp: if the version key is evicted or the cache is
+    # flushed, the reseeded value can never collide with an older version.
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """
+    Current value of a version counter kept in the shared cache. Used for the
+    catalog and for other things pages are validated against (see
+    seafood.conditional).
+    """
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if cache.add(key, version, timeout=None):
+            # a fresh seed: anything may have changed up to now
+            cache.set(key + ':changed_at', time.time(), timeout=None)
+        else:
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    cache.set(key + ':changed_at', time.time(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def version_changed_at(key):
+    """Unix time `key` was last bumped or seeded, or None if unknown (evicted)."""
+    return cache.get(key + ':changed_at')
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return bump_version(CATALOG_VERSION_KEY)
+
+
+def catalog_cache_key(*parts):
+    """
+    Build a cache key bound to the current catalog version.
+    Parts come from query params (Cyrillic, spaces), so they are hashed to
+    keep the key safe for memcached.
+    """
+    raw = '|'.join(str(p) for p in parts)
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return 'catalog:v{}:{}'.format(get_catalog_version(), digest)
+
+
+def hits_version(hits):
+    """Best-seller version for a ?filter=hits page, None for any other; a cache key part."""
+    return get_version(HITS_VERSION_KEY) if hits else None
+
+
+def _image_ns(field_file, lqip=''):
+    if not field_file:
+        return None
+    try:
+        return SimpleNamespace(url=field_file.url, name=field_file.name, variants=None, lqip=lqip)
+    except Exception:
+        return None
+
+
+def product_card(p):
+    """
+    Flatten a SeafoodProduct into a picklable object with everything the
+    product cards need, so cached cards never touch the ORM again.
+    """
+    package_price = p.package_price
+    category = None
+    if p.category_id and p.category:
+        category = SimpleNamespace(id=p.category.id, name=p.category.name, slug=p.category.slug)
+
+    return SimpleNamespace(
+        id=p.id,
+        name=p.name,
+        description=p.description,
+        price_per_100g=p.price_per_100g,
+        image=_image_ns(p.image, p.image_lqip),
+        created_at=p.created_at,
+        youtube_url=p.youtube_url or '',
+        category=category,
+        in_stock=bool(p.in_stock),
+        package_size_grams=p.package_size_grams,
+        package_size=int(p.package_size_grams) if package_price is not None else None,
+        package_price=package_price,
+        package_price_display="{:.2f}".format(package_price) if package_price is not None else None,
+        sold_in_units=bool(p.sold_in_units),
+        price_per_unit=p.price_per_unit,
+        unit_label=p.unit_label,
+        effective_price=p.effective_price,
+        review_count=p.review_count,
+        rating_avg=p.rating_avg,
+        rating_percent=int(p.rating_avg * 20) if p.rating_avg is not None else 0,
+    )
+
+
+def parse_price(value):
+    """Parse a ?price_min / ?price_max query value; None if empty or invalid."""
+    try:
+        price = Decimal(str(value).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def _load_categories():
+    try:
+        categories = list(Category.objects.all().order_by('ordering', 'name'))
+    except Exception:
+        categories = []
+    return categories
+
+
+def get_categories():
+    """Category objects for the sidebar, or FALLBACK_CATEGORIES names if the DB has none."""
+    key = catalog_cache_key('categories')
+    categories = cache.get(key)
+    if categories is None:
+        categories = _load_categories() or list(FALLBACK_CATEGORIES)
+        cache.set(key, categories, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600))
+    return categories
+
+
+def normalize_query(q):
+    """Search text as it is matched, so equivalent queries share a cache entry."""
+    return ' '.join(tokens(q))
+
+
+def _rank_by_relevance(qs, ids):
+    # Relevance comes from the search backend as an ordered id list; expose
+    # the position as a column so keyset pagination can seek on it.
+    whens = [When(id=pk, then=Value(pos)) for pos, pk in enumerate(ids)]
+    return qs.annotate(search_rank=Case(*whens, output_field=IntegerField()))
+
+
+def using_category_model(categories=None):
+    categories = get_categories() if categories is None else categories
+    return bool(categories) and isinstance(categories[0], Category)
+
+
+def category_filter(selected_category):
+    """Q for products in a category (slug), or by name when the DB has no Category rows."""
+    if not using_category_model():
+        return Q(name__icontains=selected_category)
+    # Support both the M2M `categories` and the legacy FK `category`. The M2M
+    # side is a subquery rather than a join so rows are never duplicated.
+    through = SeafoodProduct.categories.through
+    m2m_ids = through.objects.filter(category__slug__iexact=selected_category).values('seafoodproduct_id')
+    return Q(pk__in=m2m_ids) | Q(category__slug__iexact=selected_category)
+
+
+def filter_products(qs, selected_category='', price_min=None, price_max=None, in_stock=False, search_ids=None,
+                    hits=False):
+    """
+    Apply the catalog filters. `search_ids` is the result of a ?q= search
+    (None when there is no query); `hits` keeps only ranked best sellers.
+    """
+    if hits:
+        qs = qs.filter(sales_rank__revenue__gt=0)
+    if search_ids is not None:
+        qs = qs.filter(id__in=search_ids) if search_ids else qs.none()
+    if selected_category:
+        qs = qs.filter(category_filter(selected_category))
+    if in_stock:
+        qs = qs.filter(in_stock=True)
+    if price_min is not None:
+        qs = qs.filter(effective_price__gte=price_min)
+    if price_max is not None:
+        qs = qs.filter(effective_price__lte=price_max)
+    return qs
+
+
+def build_catalog_page(selected_category='', sort='', price_min=None, price_max=None, cursor='', q='',
+                       in_stock=False, hits=False):
+    search_ids = search_product_ids(q) if q else None
+    qs = filter_products(
+        SeafoodProduct.objects.all(), selected_category, price_min, price_max, in_stock, search_ids, hits,
+    )
+
+    ordering = SORT_ORDERING.get(sort, DEFAULT_ORDERING)
+    if search_ids and sort not in SORT_ORDERING:
+        qs = _rank_by_relevance(qs, search_ids)
+        ordering = SEARCH_ORDERING
+    elif hits and sort not in SORT_ORDERING:
+        qs = qs.annotate(sales_revenue=F('sales_rank__revenue'), sales_quantity=F('sales_rank__quantity_g'))
+        ordering = HITS_ORDERING
+
+    products, next_cursor = keyset_page(
+        qs.select_related('category'),
+        ordering,
+        cursor,
+        getattr(settings, 'CATALOG_PAGE_SIZE', 24),
+        transform=product_card,
+    )
+    # responsive variants ride along in the cached cards (seafood.images)
+    attach_variants([p.image for p in products])
+    return {
+        'products': products,
+        'next_cursor': next_cursor,
+    }
+
+
+def get_catalog_page(selected_category='', sort='', price_min=None, price_max=None, cursor='', q='',
+                     in_stock=False, hits=False):
+    """
+    Return {'products': [cards], 'next_cursor': str|None} for one page of
+    the given filter, served from cache when the catalog has not changed.
+    """
+    q = normalize_query(q)
+    key = catalog_cache_key(
+        'page', selected_category.lower(), sort, price_min, price_max, cursor, q, in_stock, hits_version(hits),
+    )
+    page = cache.get(key)
+    if page is None:
+        page = build_catalog_page(selected_category, sort, price_min, price_max, cursor, q, in_stock, hits)
+        cache.set(key, page, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600))
+    return page
@@ -0,0 +1,146 @@
+"""
+Conditional GET (ETag / Last-Modified) for the homepage, catalog and
+product pages.
+
+Validators are built from version counters, never from the rendered page:
+  - the catalog version (seafood.catalog), bumped after every product,
+    category, image or review change and after ranking rebuilds;
+  - the best-seller version for the homepage hits carousel and ?filter=hits
+    catalog pages;
+  - the product's `updated_at` for product pages (one primary-key lookup,
+    no joins);
+  - a viewer tag: 'anon', or the user id plus a per-user version bumped when
+    that user's favorites, chats or account change. A hash of the CSRF
+    cookie is mixed in so a revalidated page never carries a stale token.
+
+Per-user page content (name in the header, favorites, chats) is therefore
+covered by one small tag instead of being hashed into the ETag. A repeat
+visit is answered with 304 before the view runs: no template render, no
+catalog query. Responses are `Cache-Control: private, no-cache` with
+`Vary: Cookie`, so shared caches never hand one visitor's page to another.
+"""
+
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .catalog import (
+    CATALOG_VERSION_KEY, HITS_VERSION_KEY, bump_version, get_catalog_version, get_version, hits_version,
+    version_changed_at,
+)
+from .models import SeafoodProduct
+
+VIEWER_VERSION_KEY = 'viewer:{}:version'
+
+
+def bump_viewer_version(user_id):
+    if user_id:
+        bump_version(VIEWER_VERSION_KEY.format(user_id))
+
+
+def _viewer_tag(request):
+    """Short tag for the per-user parts of a page, or None to skip validation."""
+    if len(get_messages(request)):
+        # flash messages are rendered once; never answer 304 over them
+        return None
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    user = request.user
+    who = 'anon'
+    if user.is_authenticated:
+        who = 'u{}.{}'.format(user.pk, get_version(VIEWER_VERSION_KEY.format(user.pk)))
+    return '{}.{}'.format(who, hashlib.md5(csrf.encode('utf-8')).hexdigest()[:8])
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _timestamp(*values):
+    """Latest of the given unix times / datetimes as an aware datetime, or None if any is unknown."""
+    result = None
+    for value in values:
+        if value is None:
+            return None
+        if not isinstance(value, datetime):
+            value = datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        result = value if result is None or value > result else result
+    return result
+
+
+def _changed_at(key):
+    get_version(key)  # seeds the counter (and its time) if it is missing
+    return version_changed_at(key)
+
+
+def product_updated_at(request, product_id):
+    """The product's `updated_at`, looked up once per request (ETag, Last-Modified and the page document)."""
+    cache_attr = '_product_updated_at_{}'.format(product_id)
+    if not hasattr(request, cache_attr):
+        updated_at = SeafoodProduct.objects.filter(pk=product_id).values_list('updated_at', flat=True).first()
+        setattr(request, cache_attr, updated_at)
+    return getattr(request, cache_attr)
+
+
+def _hits_filter(request):
+    return request.GET.get('filter', '') == 'hits'
+
+
+def catalog_etag(request, *args, **kwargs):
+    tag = _viewer_tag(request)
+    return _etag('catalog', get_catalog_version(), hits_version(_hits_filter(request)), tag) if tag else None
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    if _hits_filter(request):
+        return _timestamp(_changed_at(CATALOG_VERSION_KEY), _changed_at(HITS_VERSION_KEY))
+    return _timestamp(_changed_at(CATALOG_VERSION_KEY))
+
+
+def homepage_etag(request, *args, **kwargs):
+    tag = _viewer_tag(request)
+    return _etag('home', get_catalog_version(), get_version(HITS_VERSION_KEY), tag) if tag else None
+
+
+def homepage_last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return _timestamp(_changed_at(CATALOG_VERSION_KEY), _changed_at(HITS_VERSION_KEY))
+
+
+def product_etag(request, product_id, *args, **kwargs):
+    tag = _viewer_tag(request)
+    if not tag:
+        return None
+    return _etag('product', product_id, get_catalog_version(), product_updated_at(request, product_id), tag)
+
+
+def product_last_modified(request, product_id, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return _timestamp(product_updated_at(request, product_id), _changed_at(CATALOG_VERSION_KEY))
+
+
+def conditional_page(etag_func, last_modified_func=None):
+    """
+    `django.views.decorators.http.condition` plus the cache headers that
+    keep revalidated pages private to the visitor.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,134 @@
+"""
+Facet counts for the catalog sidebar.
+
+For the current filter set this returns:
+  - per-category product counts,
+  - how many of the matching products are in stock,
+  - a histogram of matching products over price buckets (effective_price).
+
+Facets are disjunctive: each one ignores its own filter (category counts
+ignore ?category, price buckets ignore ?price_min/?price_max, the in-stock
+count ignores ?in_stock), so a shopper sees what picking another value would
+give. Category counts come from one query with a correlated COUNT per
+category; totals, in-stock and price buckets from one conditional aggregate.
+The result is cached under the catalog version like the catalog pages.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .catalog import (
+    catalog_cache_key, filter_products, get_categories, hits_version, normalize_query, using_category_model,
+)
+from .models import SeafoodProduct, Category
+from .search import search_product_ids
+
+# Upper bounds (UAH) of the price buckets; the last bucket is open-ended.
+DEFAULT_PRICE_BUCKETS = (200, 500, 1000, 2000)
+_CENT = Decimal('0.01')
+
+
+class _CountDistinct(Func):
+    # Plain COUNT in a correlated subquery; not an aggregate, so Django adds
+    # no GROUP BY and the subquery yields exactly one row per category.
+    function = 'COUNT'
+    template = '%(function)s(DISTINCT %(expressions)s)'
+    output_field = IntegerField()
+
+
+def price_buckets():
+    """[(min, max)] in UAH; max is None for the last bucket. Bounds are inclusive."""
+    bounds = [Decimal(b) for b in getattr(settings, 'CATALOG_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)]
+    buckets = []
+    low = Decimal('0')
+    for high in bounds:
+        buckets.append((low, high - _CENT))
+        low = high
+    buckets.append((low, None))
+    return buckets
+
+
+def _count(condition):
+    return Count('id', filter=condition) if condition else Count('id')
+
+
+def _price_q(low, high):
+    q = Q(effective_price__gte=low)
+    if high is not None:
+        q &= Q(effective_price__lte=high)
+    return q
+
+
+def _category_counts(base, categories):
+    if using_category_model(categories):
+        per_category = (
+            base.filter(Q(categories=OuterRef('pk')) | Q(category=OuterRef('pk')))
+            .order_by()
+            .annotate(n=_CountDistinct('id'))
+            .values('n')
+        )
+        rows = (
+            Category.objects
+            .annotate(product_count=Coalesce(Subquery(per_category, output_field=IntegerField()), 0))
+            .order_by('ordering', 'name')
+            .values('slug', 'name', 'product_count')
+        )
+        return [{'slug': r['slug'], 'name': r['name'], 'count': r['product_count']} for r in rows]
+
+    # No Category rows: the fallback names are matched against product names
+    counts = base.aggregate(**{
+        f'c{i}': Count('id', filter=Q(name__icontains=name)) for i, name in enumerate(categories)
+    })
+    return [{'slug': name, 'name': name, 'count': counts[f'c{i}']} for i, name in enumerate(categories)]
+
+
+def compute_facets(selected_category='', price_min=None, price_max=None, q='', in_stock=False, hits=False):
+    categories = get_categories()
+    search_ids = search_product_ids(q) if q else None
+    products = SeafoodProduct.objects.all()
+
+    # every filter except the category one
+    category_base = filter_products(products, '', price_min, price_max, in_stock, search_ids, hits)
+    # every filter except price and stock; those become conditional counts
+    base = filter_products(products, selected_category, None, None, False, search_ids, hits)
+
+    price_q = Q()
+    if price_min is not None:
+        price_q &= Q(effective_price__gte=price_min)
+    if price_max is not None:
+        price_q &= Q(effective_price__lte=price_max)
+    stock_q = Q(in_stock=True) if in_stock else Q()
+
+    buckets = price_buckets()
+    aggregates = {
+        'total_count': _count(price_q & stock_q),
+        'in_stock_count': _count(price_q & Q(in_stock=True)),
+    }
+    for i, (low, high) in enumerate(buckets):
+        aggregates[f'bucket_{i}'] = _count(_price_q(low, high) & stock_q)
+    counts = base.aggregate(**aggregates)
+
+    return {
+        'total': counts['total_count'],
+        'in_stock': counts['in_stock_count'],
+        'categories': _category_counts(category_base, categories),
+        'price_buckets': [
+            {'min': low, 'max': high, 'count': counts[f'bucket_{i}']}
+            for i, (low, high) in enumerate(buckets)
+        ],
+    }
+
+
+def get_facets(selected_category='', price_min=None, price_max=None, q='', in_stock=False, hits=False):
+    """Cached compute_facets(); invalidated by catalog version bumps."""
+    q = normalize_query(q)
+    key = catalog_cache_key('facets', selected_category.lower(), price_min, price_max, q, in_stock, hits_version(hits))
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(selected_category, price_min, price_max, q, in_stock, hits)
+        cache.set(key, facets, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600))
+    return facets
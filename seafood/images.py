@@ -0,0 +1,292 @@
+"""
+Responsive image derivatives for uploaded product images.
+
+Every uploaded image (SeafoodProduct.image, ProductImage.image) gets
+fixed-width copies, `thumb`, `card` and `full`, each in WebP and JPEG,
+stored under `derivatives/` next to the original's path and recorded in
+ImageDerivative (keyed by the original's storage name). Originals are never
+upscaled: a variant wider than the original is skipped once one copy at the
+original width exists. EXIF orientation is applied and metadata dropped.
+
+Each image also gets an LQIP, a ~16px-wide blurred WebP inlined as a data
+URI (a few hundred bytes), stored in `image_lqip` on the rows that use it and
+painted as the <img> background until the real file arrives.
+
+Generation runs in the `images.derive` job (seafood.tasks), which
+seafood.signals queues in the transaction that saves the image, so uploads
+never wait for it and a failed worker doesn't lose it. When a row's image
+is replaced or the row is deleted, the old image's derivatives are deleted
+as soon as no row uses it any more. Templates render the variants with the
+`{% picture %}` tag (seafood.templatetags.image_tags), and cached catalog
+cards carry them via `attach_variants`.
+
+An image that can't be decoded (corrupt, unsupported) is remembered in the
+cache under its storage name, and saving its rows queues no more jobs for
+it. A new upload has a new name and is tried again.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageFilter, ImageOps
+
+from .models import ImageDerivative, ProductImage, SeafoodProduct
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+FAILED_KEY = 'images:failed:{}'
+DEFAULT_VARIANT_WIDTHS = {'thumb': 160, 'card': 480, 'full': 1200}
+LQIP_WIDTH = 16
+LQIP_QUALITY = 30
+# models whose `image` field gets an `image_lqip`
+LQIP_MODELS = (SeafoodProduct, ProductImage)
+# format -> (Pillow format, file extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_widths():
+    """[(variant, width)] narrowest first."""
+    widths = getattr(settings, 'IMAGE_VARIANT_WIDTHS', DEFAULT_VARIANT_WIDTHS)
+    return sorted(widths.items(), key=lambda item: item[1])
+
+
+def derivative_name(source, variant, fmt):
+    stem = os.path.splitext(source)[0]
+    return '{}/{}.{}.{}'.format(DERIVATIVES_DIR, stem, variant, FORMATS[fmt][1])
+
+
+def open_image(storage, name):
+    """Decoded Pillow image with EXIF orientation applied."""
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def resize_to_width(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode(image, fmt, **options):
+    """Re-encode `image` as `fmt` (see FORMATS) without metadata; returns bytes."""
+    pil_format, _ext, defaults = FORMATS[fmt]
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if fmt == 'jpeg':
+        if has_alpha:
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    else:
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **dict(defaults, **options))
+    return buffer.getvalue()
+
+
+def write_derivatives(source, image, storage=None):
+    """
+    Write every variant of `image` (the decoded `source`) to storage; returns
+    unsaved ImageDerivative rows. Touches no database, so it can run in a
+    worker process (see the optimize_media command).
+    """
+    storage = storage or default_storage
+    rows = []
+    done_widths = set()
+    for variant, width in variant_widths():
+        resized = resize_to_width(image, width)
+        if resized.width in done_widths:
+            continue  # original narrower than this variant; a copy at its width exists
+        done_widths.add(resized.width)
+        for fmt in FORMATS:
+            name = derivative_name(source, variant, fmt)
+            data = encode(resized, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(data))
+            rows.append(ImageDerivative(
+                source=source, variant=variant, format=fmt, name=name,
+                width=resized.width, height=resized.height, size=len(data),
+            ))
+    return rows
+
+
+def record_derivatives(source, rows, storage=None):
+    """Replace the ImageDerivative rows of `source`, deleting files no longer in `rows`."""
+    storage = storage or default_storage
+    kept = {row.name for row in rows}
+    with transaction.atomic():
+        stale = ImageDerivative.objects.filter(source=source)
+        for name in stale.exclude(name__in=kept).values_list('name', flat=True):
+            storage.delete(name)
+        stale.delete()
+        ImageDerivative.objects.bulk_create(rows)
+
+
+def delete_derivatives(source, storage=None):
+    """Delete the ImageDerivative rows and files of `source`; returns how many there were."""
+    storage = storage or default_storage
+    rows = ImageDerivative.objects.filter(source=source)
+    names = list(rows.values_list('name', flat=True))
+    for name in names:
+        storage.delete(name)
+    rows.delete()
+    return len(names)
+
+
+def in_use(source):
+    """True if some product or gallery row still shows the image `source`."""
+    return any(model.objects.filter(image=source).exists() for model in LQIP_MODELS)
+
+
+def drop_unused_derivatives(source, storage=None):
+    """Delete the derivatives of `source` unless a row still uses it; returns how many were deleted."""
+    if not source or in_use(source):
+        return 0
+    return delete_derivatives(source, storage)
+
+
+def generate_derivatives(source, storage=None):
+    """(Re)create every variant of the stored image `source`; returns the ImageDerivative rows."""
+    storage = storage or default_storage
+    rows = write_derivatives(source, open_image(storage, source), storage)
+    record_derivatives(source, rows, storage)
+    return rows
+
+
+def _failed_key(source):
+    # names can be long and non-ASCII; keep the cache key short and safe
+    return FAILED_KEY.format(hashlib.md5(source.encode('utf-8')).hexdigest())
+
+
+def mark_failed(source):
+    cache.set(_failed_key(source), True, timeout=None)
+
+
+def has_failed(source):
+    """True if deriving `source` failed before; its rows then queue no new images.derive job."""
+    return bool(source) and cache.get(_failed_key(source), False)
+
+
+def ensure_derivatives(source, storage=None):
+    """
+    Generate the variants of `source` unless they exist. Returns True if
+    anything was generated. Unreadable images are logged and skipped.
+    """
+    if not source or ImageDerivative.objects.filter(source=source).exists():
+        return False
+    try:
+        return bool(generate_derivatives(source, storage))
+    except Exception:
+        logger.warning('Could not generate derivatives for %s', source, exc_info=True)
+        mark_failed(source)
+        return False
+
+
+def make_lqip(image):
+    """data: URI of a tiny blurred WebP preview of `image`."""
+    preview = image.copy()
+    preview.thumbnail((LQIP_WIDTH, LQIP_WIDTH * 4))
+    preview = preview.filter(ImageFilter.GaussianBlur(0.6))
+    data = encode(preview, 'webp', quality=LQIP_QUALITY, method=6)
+    return 'data:image/webp;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def missing_lqip_sources():
+    """Storage names of images some row still has no LQIP for."""
+    sources = set()
+    for model in LQIP_MODELS:
+        sources |= set(
+            model.objects.filter(image_lqip='').exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True)
+        )
+    return sources
+
+
+def touch_products(source):
+    """Move `updated_at` of the products showing `source` (as their image or in the gallery)."""
+    gallery = ProductImage.objects.filter(image=source).values('product_id')
+    return SeafoodProduct.objects.filter(Q(image=source) | Q(pk__in=gallery)).update(updated_at=timezone.now())
+
+
+def record_lqip(source, lqip):
+    """Store `lqip` on every row using `source`; returns the number of rows updated."""
+    return sum(model.objects.filter(image=source).update(image_lqip=lqip) for model in LQIP_MODELS)
+
+
+def ensure_lqip(source, storage=None):
+    """Compute the LQIP of `source` for rows that lack it. Returns True if any row was updated."""
+    storage = storage or default_storage
+    if not source or not any(
+        model.objects.filter(image=source, image_lqip='').exists() for model in LQIP_MODELS
+    ):
+        return False
+    try:
+        return bool(record_lqip(source, make_lqip(open_image(storage, source))))
+    except Exception:
+        logger.warning('Could not compute the LQIP of %s', source, exc_info=True)
+        mark_failed(source)
+        return False
+
+
+def variants_for(sources, storage=None):
+    """
+    {source: {format: [{url, width, height, variant}] narrowest first}} for
+    the given storage names, in one query. Sources without derivatives are
+    left out.
+    """
+    storage = storage or default_storage
+    result = {}
+    rows = (
+        ImageDerivative.objects
+        .filter(source__in={s for s in sources if s})
+        .order_by('source', 'format', 'width')
+        .values_list('source', 'format', 'variant', 'name', 'width', 'height')
+    )
+    for source, fmt, variant, name, width, height in rows:
+        result.setdefault(source, {}).setdefault(fmt, []).append({
+            'url': storage.url(name), 'width': width, 'height': height, 'variant': variant,
+        })
+    return result
+
+
+def attach_variants(images):
+    """
+    Set `.variants` on image namespaces that have a storage `name` (e.g. the
+    ones in catalog cards), so templates render srcsets without queries.
+    """
+    images = [im for im in images if im is not None and getattr(im, 'name', None)]
+    found = variants_for([im.name for im in images])
+    for im in images:
+        im.variants = found.get(im.name)
+    return images
+
+
+def pick(variants, fmt, variant):
+    """The entry of `variant` in `fmt`, or the widest one below it, or None."""
+    entries = (variants or {}).get(fmt) or []
+    names = [v for v, _w in variant_widths()]
+    wanted = names.index(variant) if variant in names else len(names) - 1
+    best = None
+    for entry in entries:
+        if entry['variant'] in names and names.index(entry['variant']) <= wanted:
+            best = entry
+    return best or (entries[0] if entries else None)
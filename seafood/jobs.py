@@ -0,0 +1,188 @@
+"""
+Durable background jobs.
+
+Request handlers call `enqueue(name, **payload)` instead of doing slow work
+(sending email) inline. The job is a Job row written in the caller's
+transaction, so it is committed together with the data it refers to, or
+rolled back with it. Nothing can run it before that commit, and no job is
+lost between the commit and the enqueue.
+
+`manage.py run_jobs` runs the queue. A worker claims a batch of due jobs
+by taking a lease: status 'running', `locked_by` itself and `locked_until`
+now + JOBS_LEASE_SECONDS.
+
+  - On backends with SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL,
+    MySQL 8, Oracle), concurrent workers skip each other's rows.
+  - On SQLite, each row is claimed with a conditional UPDATE that only
+    matches while the row is still claimable. Of two workers racing for the
+    same job, exactly one updates it.
+
+A job whose lease expired (its worker died mid-run) is claimable again.
+A failed job is retried with exponential backoff (JOBS_RETRY_BASE_SECONDS,
+doubling, capped at JOBS_RETRY_MAX_SECONDS). After `max_attempts` it stays
+'failed', with the last traceback in `last_error`.
+
+Jobs are functions registered with `@task('name')` (see seafood.tasks).
+Their keyword arguments are the JSON payload, so pass ids and plain values,
+never model instances. A `@task('name', batch=True)` function instead gets
+the payloads of every job of that name in a claimed batch at once, e.g. to
+send them in one request. It returns one result per payload: None for done,
+an exception for a failure. Each job is then retried on its own.
+"""
+
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_SECONDS = 30
+DEFAULT_RETRY_MAX_SECONDS = 60 * 60
+DEFAULT_KEEP_DAYS = 7
+
+_tasks = {}
+_batch_tasks = set()
+
+
+def task(name, batch=False):
+    """Register the decorated function as the job `name` (see the module docstring for `batch`)."""
+    def register(func):
+        _tasks[name] = func
+        if batch:
+            _batch_tasks.add(name)
+        else:
+            _batch_tasks.discard(name)
+        return func
+    return register
+
+
+def enqueue(name, run_at=None, max_attempts=None, **payload):
+    """Queue job `name` with keyword arguments `payload`; returns the Job."""
+    if name not in _tasks:
+        raise LookupError('Unknown job {!r}'.format(name))
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+    )
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _claimable(now):
+    return Job.objects.filter(
+        Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+    )
+
+
+def claim(worker, limit=10):
+    """Lease up to `limit` due jobs to `worker`; returns them, oldest first."""
+    now = timezone.now()
+    lease = {
+        'status': Job.RUNNING,
+        'locked_by': worker,
+        'locked_until': now + timedelta(seconds=getattr(settings, 'JOBS_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)),
+        'attempts': F('attempts') + 1,
+    }
+    due = _claimable(now).order_by('run_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**lease)
+    else:
+        # no row locks: claim row by row, each UPDATE only matching a still-claimable row
+        ids = [pk for pk in due.values_list('pk', flat=True)[:limit] if _claimable(now).filter(pk=pk).update(**lease)]
+    return list(Job.objects.filter(pk__in=ids, locked_by=worker).order_by('run_at', 'id'))
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt number `attempts + 1`."""
+    base = getattr(settings, 'JOBS_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS)
+    cap = getattr(settings, 'JOBS_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS)
+    delay = min(base * 2 ** max(attempts - 1, 0), cap)
+    # jitter, so jobs that failed together don't all retry together
+    return delay + random.uniform(0, delay / 10)
+
+
+def _record(job, error=None):
+    """Store the outcome of a run: done, or (with `error`, a formatted traceback) retry or failed."""
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=Job.RUNNING)
+    now = timezone.now()
+    if error is None:
+        mine.update(status=Job.DONE, locked_until=None, finished_at=now)
+    elif job.attempts >= job.max_attempts:
+        logger.error('Job %s (%s) failed for good after %s attempts:\n%s', job.pk, job.name, job.attempts, error)
+        mine.update(status=Job.FAILED, locked_until=None, finished_at=now, last_error=error)
+    else:
+        logger.warning('Job %s (%s) failed, attempt %s of %s:\n%s', job.pk, job.name, job.attempts, job.max_attempts, error)
+        mine.update(
+            status=Job.PENDING, locked_until=None, last_error=error,
+            run_at=now + timedelta(seconds=retry_delay(job.attempts)),
+        )
+
+
+def run(job):
+    """Run a claimed job and record the outcome. True if it succeeded."""
+    try:
+        func = _tasks.get(job.name)
+        if func is None:
+            raise LookupError('Unknown job {!r}'.format(job.name))
+        if job.name in _batch_tasks:
+            error = func([job.payload])[0]
+            if error is not None:
+                raise error
+        else:
+            func(**job.payload)
+    except Exception:
+        _record(job, traceback.format_exc())
+        return False
+    _record(job)
+    return True
+
+
+def run_batch(jobs):
+    """Run claimed jobs of one batch task with a single call."""
+    try:
+        results = _tasks[jobs[0].name]([job.payload for job in jobs])
+    except Exception:
+        results = [traceback.format_exc()] * len(jobs)
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            result = ''.join(traceback.format_exception(result))
+        _record(job, result)
+
+
+def run_due(worker=None, limit=10):
+    """Claim and run one batch; returns the number of jobs run."""
+    jobs = claim(worker or worker_name(), limit)
+    batches = {}
+    for job in jobs:
+        if job.name in _batch_tasks:
+            batches.setdefault(job.name, []).append(job)
+        else:
+            run(job)
+    for batch in batches.values():
+        run_batch(batch)
+    return len(jobs)
+
+
+def purge_finished(days=None):
+    """Delete jobs that succeeded more than `days` (JOBS_KEEP_DAYS) ago; failed jobs are kept."""
+    days = getattr(settings, 'JOBS_KEEP_DAYS', DEFAULT_KEEP_DAYS) if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()[0]
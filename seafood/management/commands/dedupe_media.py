@@ -0,0 +1,142 @@
+# seafood/management/commands/dedupe_media.py
+import hashlib
+import os
+import shutil
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from seafood.catalog import bump_catalog_version
+from seafood.images import touch_products
+from seafood.models import ImageDerivative, ProductImage, SeafoodProduct, StoredBlob
+from seafood.storage import BLOB_PREFIX, blob_name, upload_storage
+
+IMAGE_MODELS = (SeafoodProduct, ProductImage)
+
+
+def _digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Move product images into content-addressed blobs (see seafood.storage): rows that point at "
+        "identical files end up sharing one blob, and the redundant copies are deleted. Run with --dry-run first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', default=None,
+                            help='MEDIA_ROOT folder to scan; repeatable (default: products)')
+        parser.add_argument('--keep-files', action='store_true', help='Remap rows but leave the old files in place')
+        parser.add_argument('--dry-run', action='store_true', help='Show the plan without changing anything')
+
+    def handle(self, *args, **options):
+        media_root = os.path.abspath(str(settings.MEDIA_ROOT))
+        storage = upload_storage()
+        dry = options['dry_run']
+
+        # content hash of every file in the scanned folders
+        digests = {}
+        for folder in options['path'] or ['products']:
+            if folder.strip('/').startswith(BLOB_PREFIX):
+                continue
+            for dirpath, _dirnames, filenames in os.walk(os.path.join(media_root, folder)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    digests[os.path.relpath(path, media_root).replace(os.sep, '/')] = _digest(path)
+
+        # image field values that are not blobs yet, grouped by content
+        groups = defaultdict(set)
+        for model in IMAGE_MODELS:
+            for name in model.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True):
+                if storage.is_blob(name):
+                    continue
+                digest = digests.get(name)
+                if digest is None and os.path.exists(os.path.join(media_root, name)):
+                    digest = digests[name] = _digest(os.path.join(media_root, name))
+                if digest is None:
+                    self.stderr.write(f"Missing file, left as is: {name}")
+                    continue
+                groups[digest].add(name)
+
+        remapped = 0
+        for digest, names in sorted(groups.items()):
+            blob = StoredBlob.objects.filter(digest=digest).first()
+            target = blob.name if blob else blob_name(digest, sorted(names)[0])
+            self.stdout.write(f"{', '.join(sorted(names))} -> {target}")
+            if dry:
+                continue
+            with transaction.atomic():
+                if not storage.exists(target):
+                    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                    shutil.copy2(os.path.join(media_root, sorted(names)[0]), storage.path(target))
+                if blob is None:
+                    blob = StoredBlob.objects.create(
+                        digest=digest, name=target, size=os.path.getsize(storage.path(target)),
+                    )
+                references = 0
+                for model in IMAGE_MODELS:
+                    references += model.objects.filter(image__in=names).update(image=target)
+                StoredBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + references)
+                touch_products(target)
+                remapped += references
+                self._move_derivatives(names, target)
+
+        # every scanned file whose content now lives in a blob is redundant
+        stored = set(StoredBlob.objects.filter(digest__in=set(digests.values())).values_list('digest', flat=True))
+        redundant = [name for name, digest in digests.items() if digest in stored or (dry and digest in groups)]
+        freed = sum(os.path.getsize(os.path.join(media_root, name)) for name in redundant)
+        if not dry and not options['keep_files']:
+            for name in redundant:
+                os.remove(os.path.join(media_root, name))
+        orphans = self._recount_blobs(storage, dry)
+        if remapped:
+            bump_catalog_version()
+
+        verb = 'would be' if dry else ('kept' if options['keep_files'] else 'deleted')
+        self.stdout.write(self.style.SUCCESS(
+            f"Pointed {remapped} image fields at {len(groups)} blobs; "
+            f"{len(redundant)} redundant files ({freed / 1024:.1f} KB) {verb}; "
+            f"{orphans} unreferenced blobs {'to remove' if dry else 'removed'}."
+        ))
+
+    def _move_derivatives(self, names, target):
+        """Reuse the derivatives of one old name for the blob; drop the rest."""
+        if ImageDerivative.objects.filter(source=target).exists():
+            keep = None
+        else:
+            keep = next((n for n in sorted(names) if ImageDerivative.objects.filter(source=n).exists()), None)
+        if keep:
+            ImageDerivative.objects.filter(source=keep).update(source=target)
+        stale = ImageDerivative.objects.filter(source__in=names)
+        for name in stale.values_list('name', flat=True):
+            default_storage.delete(name)
+        stale.delete()
+
+
+    def _recount_blobs(self, storage, dry):
+        """Reset every blob's refcount to the rows actually using it; remove unused blobs."""
+        counts = defaultdict(int)
+        for model in IMAGE_MODELS:
+            for name in model.objects.filter(image__startswith=BLOB_PREFIX + '/').values_list('image', flat=True):
+                counts[name] += 1
+        orphans = 0
+        for blob in StoredBlob.objects.all():
+            actual = counts.get(blob.name, 0)
+            if actual:
+                if (actual != blob.refcount or blob.pending) and not dry:
+                    StoredBlob.objects.filter(pk=blob.pk).update(refcount=actual, pending=0)
+                continue
+            orphans += 1
+            if not dry:
+                blob.delete()
+                storage.delete(blob.name)
+        return orphans
@@ -0,0 +1,210 @@
+# seafood/management/commands/optimize_media.py
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from seafood import jobs, tasks
+from seafood.catalog import bump_catalog_version
+from seafood.images import (
+    make_lqip, missing_lqip_sources, record_derivatives, record_lqip, touch_products, write_derivatives,
+)
+from seafood.models import ImageDerivative, ProductImage, SeafoodProduct
+from seafood.storage import BLOB_PREFIX
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# generated files and payment evidence are never re-encoded. Nor are
+# content-addressed blobs (seafood.storage): their bytes must keep matching
+# their digest, and they are served as immutable
+DEFAULT_EXCLUDES = ('derivatives', 'receipts', BLOB_PREFIX)
+# a re-encode must save at least this share of bytes to replace the original
+MIN_SAVING = 0.05
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _reencode(image, fmt, quality):
+    """`image` in its own format without EXIF; the ICC profile is kept so colors don't shift."""
+    buffer = io.BytesIO()
+    options = {}
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    if fmt == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True, **options)
+    elif fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True, **options)
+    else:
+        image.save(buffer, 'WEBP', quality=quality, method=6, **options)
+    return buffer.getvalue()
+
+
+def _optimize_file(task):
+    """
+    Worker: recompress one file in place and, if asked, write its
+    derivatives and compute its LQIP. Returns a summary dict; the parent
+    process records derivative rows and LQIPs.
+    """
+    name, path, data_hash, make_derivatives, needs_lqip, quality, dry_run = task
+    result = {
+        'name': name, 'hash': data_hash, 'before': 0, 'after': 0, 'derivatives': None, 'lqip': None, 'error': None,
+    }
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        result['before'] = result['after'] = len(data)
+        image = Image.open(io.BytesIO(data))
+        fmt = image.format
+        had_exif = bool(image.info.get('exif'))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+
+        if fmt in ('JPEG', 'PNG', 'WEBP'):
+            optimized = _reencode(image, fmt, quality)
+            # keep the original unless re-encoding pays off or strips metadata
+            if len(optimized) < len(data) * (1 - MIN_SAVING) or (had_exif and len(optimized) <= len(data)):
+                result['after'] = len(optimized)
+                result['hash'] = _sha256(optimized)
+                if not dry_run:
+                    tmp_path = path + '.optimizing'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(optimized)
+                    os.replace(tmp_path, path)
+
+        if make_derivatives and not dry_run:
+            result['derivatives'] = write_derivatives(name, image)
+        if needs_lqip and not dry_run:
+            result['lqip'] = make_lqip(image)
+    except Exception as exc:
+        result['error'] = f'{type(exc).__name__}: {exc}'
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompress images under MEDIA_ROOT in parallel (EXIF stripped, tuned quality) and generate "
+        "missing responsive derivatives and LQIPs. Files whose content hash is in the manifest are skipped. "
+        "Blobs are never re-encoded; the images.derive job is queued for blobs that lack derivatives or LQIPs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--quality', type=int, default=82, help='JPEG/WebP quality (default: 82)')
+        parser.add_argument('--manifest', default=None, help='Manifest path (default: MEDIA_MANIFEST setting)')
+        parser.add_argument('--exclude', action='append', default=None,
+                            help=f"Top-level MEDIA_ROOT folder to skip; repeatable (default: {', '.join(DEFAULT_EXCLUDES)})")
+        parser.add_argument('--force', action='store_true', help='Ignore the manifest and process every file')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        media_root = os.path.abspath(str(settings.MEDIA_ROOT))
+        manifest_path = options['manifest'] or getattr(
+            settings, 'MEDIA_MANIFEST', os.path.join(str(settings.BASE_DIR), 'media-manifest.json')
+        )
+        excludes = set(options['exclude'] or DEFAULT_EXCLUDES)
+        if BLOB_PREFIX not in excludes:
+            raise CommandError(
+                f"'{BLOB_PREFIX}' must stay excluded: re-encoding a content-addressed blob in place breaks its digest."
+            )
+        manifest = {} if options['force'] else self._load_manifest(manifest_path)
+        done_hashes = {entry['hash'] for entry in manifest.values()}
+
+        # uploads that pages show but that have no derivatives yet
+        referenced = set(SeafoodProduct.objects.exclude(image='').values_list('image', flat=True))
+        referenced |= set(ProductImage.objects.exclude(image='').values_list('image', flat=True))
+        missing = referenced - set(ImageDerivative.objects.values_list('source', flat=True).distinct())
+        missing_lqip = missing_lqip_sources()
+        queued = self._queue_blob_derivatives(missing | missing_lqip, options['dry_run'])
+
+        tasks = []
+        skipped = 0
+        for name, path in self._walk(media_root, excludes):
+            stat = os.stat(path)
+            entry = manifest.get(name)
+            needs_work = name in missing or name in missing_lqip
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime and not needs_work:
+                skipped += 1
+                continue
+            with open(path, 'rb') as f:
+                data_hash = _sha256(f.read())
+            if data_hash in done_hashes and not needs_work:
+                # already optimized (possibly under another name); just remember it
+                manifest[name] = {'hash': data_hash, 'size': stat.st_size, 'mtime': stat.st_mtime}
+                skipped += 1
+                continue
+            tasks.append((
+                name, path, data_hash, name in missing, name in missing_lqip, options['quality'], options['dry_run'],
+            ))
+
+        saved = processed = derived = failed = 0
+        # each worker sets Django up itself so the pool also works with the spawn start method
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for result in pool.map(_optimize_file, tasks, chunksize=4):
+                if result['error']:
+                    failed += 1
+                    self.stderr.write(f"{result['name']}: {result['error']}")
+                    continue
+                processed += 1
+                saved += result['before'] - result['after']
+                if result['derivatives']:
+                    record_derivatives(result['name'], result['derivatives'])
+                if result['lqip']:
+                    record_lqip(result['name'], result['lqip'])
+                if result['derivatives'] or result['lqip']:
+                    touch_products(result['name'])
+                    derived += 1
+                if not options['dry_run']:
+                    path = os.path.join(media_root, result['name'])
+                    stat = os.stat(path)
+                    manifest[result['name']] = {'hash': result['hash'], 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+        if not options['dry_run']:
+            self._save_manifest(manifest_path, manifest)
+        if derived:
+            bump_catalog_version()
+
+        verb = 'Would save' if options['dry_run'] else 'Saved'
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} files ({skipped} unchanged, {failed} failed), derivatives/LQIPs for {derived}, "
+            f"{queued} blobs queued for derivatives. {verb} {saved / 1024:.1f} KB."
+        ))
+
+    def _queue_blob_derivatives(self, sources, dry_run):
+        """Queue images.derive for the blobs among `sources`; returns how many."""
+        blobs = sorted(name for name in sources if name.startswith(BLOB_PREFIX + '/'))
+        if not dry_run:
+            with transaction.atomic():
+                for name in blobs:
+                    jobs.enqueue(tasks.DERIVE_IMAGE, source=name)
+        return len(blobs)
+
+    def _walk(self, media_root, excludes):
+        """(storage name, absolute path) of every image under MEDIA_ROOT outside `excludes`."""
+        for dirpath, dirnames, filenames in os.walk(media_root):
+            if dirpath == media_root:
+                dirnames[:] = [d for d in dirnames if d not in excludes]
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, media_root).replace(os.sep, '/'), path
+
+    def _load_manifest(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f).get('files', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, path, files):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': files}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
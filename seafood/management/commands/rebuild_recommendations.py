@@ -0,0 +1,15 @@
+# seafood/management/commands/rebuild_recommendations.py
+from django.core.management.base import BaseCommand
+
+from seafood.recommendations import rebuild_neighbors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the \"bought together\" top-K neighbor table from order items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None, help='Neighbors kept per product (default: RECOMMENDATIONS_TOP_K)')
+
+    def handle(self, *args, **options):
+        count = rebuild_neighbors(options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} neighbor rows."))
@@ -0,0 +1,12 @@
+# seafood/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from seafood.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index (documents + FTS5 table on SQLite)."
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products."))
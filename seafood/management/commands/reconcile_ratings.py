@@ -0,0 +1,12 @@
+# seafood/management/commands/reconcile_ratings.py
+from django.core.management.base import BaseCommand
+
+from seafood.reviews import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = "Recount review_count / rating_sum on products from the Review table."
+
+    def handle(self, *args, **options):
+        fixed = reconcile_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Fixed rating counters on {fixed} products."))
@@ -0,0 +1,12 @@
+# seafood/management/commands/refresh_bestsellers.py
+from django.core.management.base import BaseCommand
+
+from seafood.bestsellers import refresh_rankings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the best-seller ranking from order items in the BESTSELLERS_WINDOW_DAYS window."
+
+    def handle(self, *args, **options):
+        count = refresh_rankings()
+        self.stdout.write(self.style.SUCCESS(f"Ranked {count} products."))
@@ -0,0 +1,17 @@
+# seafood/management/commands/reprocess_receipts.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from seafood import jobs, tasks
+from seafood.receipts import unprocessed
+
+
+class Command(BaseCommand):
+    help = "Queue the downscaling job for every chat receipt that has no processed image yet."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ids = list(unprocessed().values_list('pk', flat=True))
+            for message_id in ids:
+                jobs.enqueue(tasks.PROCESS_RECEIPT, message_id=message_id)
+        self.stdout.write(self.style.SUCCESS(f"Queued {len(ids)} receipts for processing."))
@@ -0,0 +1,46 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from seafood import jobs
+
+# finished jobs are purged at most this often while the queue is idle
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (emails etc., see seafood.jobs) until stopped, or once with --once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the due jobs, then exit.')
+        parser.add_argument('--batch', type=int, default=10, help='Jobs claimed per round.')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        self.stopping = False
+        if not options['once']:
+            # finish the job at hand on SIGTERM/SIGINT instead of abandoning it mid-run
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        total = 0
+        last_purge = 0.0
+        while not self.stopping:
+            close_old_connections()
+            count = jobs.run_due(worker, options['batch'])
+            total += count
+            if count:
+                continue
+            if options['once']:
+                break
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                jobs.purge_finished()
+                last_purge = time.monotonic()
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {total} jobs."))
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,174 @@
+"""
+Permission-checked delivery of MEDIA_ROOT files.
+
+`serve_media` answers /media/<path>. It decides who may see a file and
+which cache headers it gets, and usually leaves the bytes to the front
+proxy:
+
+  - `receipts/` (payment evidence) is private. Only staff and the
+    participants of the message's conversation may see it; everyone else
+    gets a 404, so receipt names don't leak.
+  - everything else (product images and their derivatives) is public.
+  - content-addressed files (`blobs/`, see seafood.storage) and their
+    derivatives never change under the same name, so they get a year of
+    `immutable` caching. Other public files get an hour.
+
+With MEDIA_ACCEL = 'nginx', the response carries only headers plus
+`X-Accel-Redirect: <MEDIA_ACCEL_PREFIX><path>`, and nginx sends the file from
+an `internal` location:
+
+    location /protected-media/ { internal; alias /path/to/media/; }
+
+With MEDIA_ACCEL = 'sendfile' (Apache mod_xsendfile, lighttpd), it carries
+`X-Sendfile: <absolute path>` instead. Without a proxy the file is streamed
+from Python with conditional GET and single byte-range support, so
+resumable downloads and media seeking still work.
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+from .models import Message
+from .storage import BLOB_PREFIX
+
+PRIVATE_PREFIX = 'receipts/'
+IMMUTABLE_PREFIXES = (BLOB_PREFIX + '/', 'derivatives/' + BLOB_PREFIX + '/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+PUBLIC_MAX_AGE = 60 * 60
+PRIVATE_MAX_AGE = 60 * 60
+DEFAULT_ACCEL_PREFIX = '/protected-media/'
+STREAM_BLOCK_SIZE = 64 * 1024
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def can_view(user, name):
+    """Whether `user` may see media file `name`."""
+    if not name.startswith(PRIVATE_PREFIX):
+        return True
+    if not user.is_authenticated:
+        return False
+    if user.is_staff:
+        return True
+    return Message.objects.filter(Q(image=name) | Q(original_image=name), conversation__participants=user).exists()
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single `bytes=` range within `size`;
+    None to send the whole file (no, malformed or multi-range header);
+    'unsatisfiable' for a range entirely past the end.
+    """
+    match = _RANGE.match((header or '').strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return 'unsatisfiable'
+    if end < start:
+        return None
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _accel_response(name, path):
+    mode = getattr(settings, 'MEDIA_ACCEL', '')
+    if mode == 'nginx':
+        response = HttpResponse()
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', DEFAULT_ACCEL_PREFIX)
+        response['X-Accel-Redirect'] = prefix + quote(name)
+        return response
+    if mode == 'sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return response
+    return None
+
+
+def _python_response(request, path, size):
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range is not None and request.headers.get('If-Range'):
+        # resume only if the client holds the current version
+        if_range = request.headers['If-Range']
+        last_modified = int(os.path.getmtime(path))
+        if if_range != _etag(size, last_modified) and parse_http_date_safe(if_range) != last_modified:
+            byte_range = None
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'))
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(_read_range(path, start, length), status=206)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    return response
+
+
+def _etag(size, mtime):
+    return '"{:x}-{:x}"'.format(size, int(mtime))
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    try:
+        full_path = safe_join(str(settings.MEDIA_ROOT), path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    # decide on the normalized name: "./receipts/x" or "products/../receipts/x" is "receipts/x"
+    name = os.path.relpath(full_path, os.path.abspath(str(settings.MEDIA_ROOT))).replace(os.sep, '/')
+    if not os.path.isfile(full_path) or not can_view(request.user, name):
+        raise Http404('Not found')
+
+    stat = os.stat(full_path)
+    etag = _etag(stat.st_size, stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _accel_response(name, full_path) or _python_response(request, full_path, stat.st_size)
+
+    if response.status_code in (200, 206):
+        # as stored: a .gz upload is a gzip file, not a gzip-encoded response
+        response['Content-Type'] = mimetypes.guess_type(full_path, strict=False)[0] or 'application/octet-stream'
+        response.headers.pop('Content-Encoding', None)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['X-Content-Type-Options'] = 'nosniff'
+    if name.startswith(PRIVATE_PREFIX):
+        patch_cache_control(response, private=True, max_age=PRIVATE_MAX_AGE)
+        patch_vary_headers(response, ('Cookie',))
+    elif name.startswith(IMMUTABLE_PREFIXES):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PUBLIC_MAX_AGE)
+    return response
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:36
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0021_alter_callbackrequest_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='effective_price',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(sold_in_units=True, then=models.F('price_per_unit')), models.When(package_size_grams__isnull=False, then=models.Case(models.When(package_size_grams__isnull=False, price_per_100g__isnull=False, then=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price_per_100g'), '*', models.F('package_size_grams')), '*', models.Value(Decimal('0.01'))), 2)), default=None, output_field=models.DecimalField(decimal_places=2, max_digits=12))), default=models.F('price_per_100g'), output_field=models.DecimalField(decimal_places=2, max_digits=12)), output_field=models.DecimalField(decimal_places=2, max_digits=12)),
+        ),
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='package_price',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(package_size_grams__isnull=False, price_per_100g__isnull=False, then=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price_per_100g'), '*', models.F('package_size_grams')), '*', models.Value(Decimal('0.01'))), 2)), default=None, output_field=models.DecimalField(decimal_places=2, max_digits=12)), output_field=models.DecimalField(decimal_places=2, max_digits=12)),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='name',
+            field=models.CharField(max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='phone',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='preferred_time',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='callbackrequest',
+            name='processed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='seafoodproduct',
+            index=models.Index(fields=['effective_price', 'id'], name='seafood_product_eff_price_idx'),
+        ),
+    ]
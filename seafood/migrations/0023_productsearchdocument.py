@@ -0,0 +1,109 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:40
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of seafood.search as of this migration, so later changes to
+# the app module can't change what this migration does.
+FTS_TABLE = 'seafood_product_fts'
+DOCUMENT_TABLE = 'seafood_productsearchdocument'
+
+CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'h', 'ґ': 'g', 'д': 'd', 'е': 'e',
+    'є': 'ie', 'ж': 'zh', 'з': 'z', 'и': 'y', 'і': 'i', 'ї': 'i', 'й': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ь': '', 'ю': 'iu', 'я': 'ia',
+    'ы': 'y', 'э': 'e', 'ё': 'io', 'ъ': '',
+}
+_APOSTROPHES = re.compile(r"['’ʼʹ`]")
+_WORD = re.compile(r'\w+')
+_CYRILLIC = re.compile(r'[Ѐ-ӿ]')
+
+
+def index_text(text):
+    """Casefolded words without apostrophes, plus the Latin spelling of every Cyrillic word."""
+    words = _WORD.findall(_APOSTROPHES.sub('', (text or '').casefold()))
+    extra = [''.join(CYR_TO_LAT.get(ch, ch) for ch in w) for w in words if _CYRILLIC.search(w)]
+    return ' '.join(dict.fromkeys(words + extra))
+
+
+def document_fields(name, description='', category_names=()):
+    body = ' '.join([description or ''] + [c for c in category_names if c])
+    return index_text(name), index_text(body)
+
+
+def create_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        # Python builds without FTS5 fall back to substring search (seafood.search)
+        try:
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f'USING fts5(name, body, tokenize="unicode61 remove_diacritics 0")'
+            )
+        except Exception:
+            pass
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS seafood_search_tsv_idx ON {DOCUMENT_TABLE} USING GIN ("
+            f"(setweight(to_tsvector('simple', name), 'A') || "
+            f"setweight(to_tsvector('simple', body), 'B')))"
+        )
+
+
+def drop_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS seafood_search_tsv_idx')
+
+
+def index_existing_products(apps, schema_editor):
+    SeafoodProduct = apps.get_model('seafood', 'SeafoodProduct')
+    ProductSearchDocument = apps.get_model('seafood', 'ProductSearchDocument')
+    connection = schema_editor.connection
+    has_fts = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+    docs = []
+    for product in SeafoodProduct.objects.select_related('category').prefetch_related('categories'):
+        names = {c.name for c in product.categories.all()}
+        if product.category_id:
+            names.add(product.category.name)
+        name, body = document_fields(product.name, product.description, sorted(names))
+        docs.append(ProductSearchDocument(product_id=product.pk, name=name, body=body))
+        if has_fts:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, body) VALUES (%s, %s, %s)',
+                    [product.pk, name, body],
+                )
+    ProductSearchDocument.objects.bulk_create(docs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0022_seafoodproduct_computed_prices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='seafood.seafoodproduct')),
+                ('name', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Пошуковий документ',
+                'verbose_name_plural': 'Пошукові документи',
+            },
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
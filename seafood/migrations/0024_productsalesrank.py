@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:44
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0023_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesRank',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_rank', serialize=False, to='seafood.seafoodproduct')),
+                ('quantity_g', models.PositiveBigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Рейтинг продажів',
+                'verbose_name_plural': 'Рейтинг продажів',
+                'indexes': [models.Index(fields=['-revenue', '-quantity_g', 'product'], name='seafood_sales_rank_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0024_productsalesrank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('rank', models.PositiveSmallIntegerField(default=0)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='seafood.seafoodproduct')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='seafood.seafoodproduct')),
+            ],
+            options={
+                'verbose_name': 'Супутній товар',
+                'verbose_name_plural': 'Супутні товари',
+                'ordering': ['product', 'rank'],
+                'indexes': [models.Index(fields=['product', 'rank'], name='seafood_neighbor_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'neighbor'), name='seafood_neighbor_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:48
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    SeafoodProduct = apps.get_model('seafood', 'SeafoodProduct')
+    Review = apps.get_model('seafood', 'Review')
+    rows = Review.objects.values('product_id').annotate(n=models.Count('id'), total=models.Sum('rating'))
+    for row in rows:
+        SeafoodProduct.objects.filter(pk=row['product_id']).update(review_count=row['n'], rating_sum=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0025_productneighbor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='rating_avg',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(review_count__gt=0, then=django.db.models.functions.math.Round(models.ExpressionWrapper(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_sum'), '*', models.Value(Decimal('0.01'))), '*', models.Value(100)), '/', models.F('review_count')), output_field=models.DecimalField(decimal_places=2, max_digits=5)), 2)), default=None, output_field=models.DecimalField(decimal_places=2, max_digits=3)), output_field=models.DecimalField(decimal_places=2, max_digits=3)),
+        ),
+        migrations.AddIndex(
+            model_name='seafoodproduct',
+            index=models.Index(fields=['-rating_avg', '-review_count', 'id'], name='seafood_product_rating_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
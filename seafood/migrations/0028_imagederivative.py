@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0027_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=255)),
+                ('variant', models.CharField(choices=[('thumb', 'Thumb'), ('card', 'Card'), ('full', 'Full')], max_length=10)),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('name', models.CharField(max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField(default=0, help_text='Bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Похідне зображення',
+                'verbose_name_plural': 'Похідні зображення',
+                'constraints': [models.UniqueConstraint(fields=('source', 'variant', 'format'), name='seafood_derivative_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:00
+
+import seafood.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0028_imagederivative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Файл (за вмістом)',
+                'verbose_name_plural': 'Файли (за вмістом)',
+            },
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=seafood.storage.upload_storage, upload_to='products/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='seafoodproduct',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=seafood.storage.upload_storage, upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0029_storedblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='image_lqip',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seafoodproduct',
+            name='image_lqip',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0030_image_lqip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='original_image',
+            field=models.ImageField(blank=True, null=True, upload_to='receipts/originals/%Y/%m/'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:16
+
+from decimal import Decimal
+
+import seafood.money
+from django.db import migrations, models
+from django.db.models.functions import Round
+
+# (model, field) pairs that change from hryvnias in a DecimalField to kopiyky
+MONEY_FIELDS = (
+    ('Order', 'total_price'),
+    ('OrderItem', 'unit_price'),
+    ('OrderItem', 'total_price'),
+    ('ProductSalesRank', 'revenue'),
+)
+
+
+def hryvnias_to_kopiyky(apps, schema_editor):
+    # runs while the columns are still decimal. SQLite multiplies them as floats
+    # (0.29 * 100 = 28.999...), so round before the cast to an integer column
+    for model_name, field in MONEY_FIELDS:
+        apps.get_model('seafood', model_name).objects.update(**{field: Round(models.F(field) * 100)})
+
+
+def kopiyky_to_hryvnias(apps, schema_editor):
+    # reversed after the columns are decimal again
+    for model_name, field in MONEY_FIELDS:
+        model = apps.get_model('seafood', model_name)
+        for pk, value in model.objects.values_list('pk', field).iterator():
+            model.objects.filter(pk=pk).update(**{field: Decimal(int(value or 0)).scaleb(-2)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0032_cart'),
+    ]
+
+    operations = [
+        migrations.RunPython(hryvnias_to_kopiyky, kopiyky_to_hryvnias),
+        migrations.AlterField(
+            model_name='order',
+            name='total_price',
+            field=seafood.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='total_price',
+            field=seafood.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='unit_price',
+            field=seafood.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='productsalesrank',
+            name='revenue',
+            field=seafood.money.MoneyField(default=0),
+        ),
+    ]
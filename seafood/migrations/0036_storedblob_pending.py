@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seafood', '0035_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='pending',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
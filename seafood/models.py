@@ -5,12 +5,16 @@ from decimal import Decimal, ROUND_HALF_UP
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 
+from .money import Money, MoneyField
+from .storage import upload_storage
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=110, unique=True, blank=True)
     description = models.TextField(blank=True)
     ordering = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['ordering', 'name']
@@ -33,14 +37,39 @@ class Category(models.Model):
 
 
 from django.db import models
+from django.db.models.functions import Round
 from django.utils import timezone
 
+
+def _package_price_expr():
+    """price_per_100g * package_size_grams / 100, rounded to 2 decimal places."""
+    return models.Case(
+        models.When(
+            package_size_grams__isnull=False,
+            price_per_100g__isnull=False,
+            then=Round(
+                # multiply by 0.01 rather than divide by 100: SQLite would
+                # do integer division when both operands are whole numbers
+                models.F('price_per_100g') * models.F('package_size_grams') * models.Value(Decimal('0.01')),
+                2,
+            ),
+        ),
+        default=None,
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
 class SeafoodProduct(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     price_per_100g = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
-    image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image = models.ImageField(upload_to='products/', storage=upload_storage, blank=True, null=True)
+    # tiny blurred WebP data URI shown while the image loads (seafood.images)
+    image_lqip = models.TextField(blank=True, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
+    # Also touched by review / image changes (seafood.reviews, seafood.signals)
+    # so it stands for "the product page changed".
+    updated_at = models.DateTimeField(auto_now=True)
     youtube_url = models.URLField(blank=True, null=True)
 
     # Legacy single-category FK (kept for compatibility during transition).
@@ -84,10 +113,61 @@ class SeafoodProduct(models.Model):
         help_text="Напис у шаблоні для одиниці (наприклад 'шт', 'банка')"
     )
 
+    # Computed by the database from the fields above (see _package_price_expr).
+    # Price of one package, NULL unless sold by package.
+    package_price = models.GeneratedField(
+        expression=_package_price_expr(),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
+    # Price of the smallest sellable step: 1 unit, 1 package or 100 g.
+    # This is what cards display, so catalog sorting/filtering uses it.
+    effective_price = models.GeneratedField(
+        expression=models.Case(
+            models.When(sold_in_units=True, then=models.F('price_per_unit')),
+            models.When(package_size_grams__isnull=False, then=_package_price_expr()),
+            default=models.F('price_per_100g'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
+
+    # Review aggregates, kept in step with Review rows by seafood.reviews
+    # (F() updates) and `manage.py reconcile_ratings`.
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    # Average rating (e.g. 4.67), NULL while there are no reviews.
+    rating_avg = models.GeneratedField(
+        expression=models.Case(
+            models.When(
+                review_count__gt=0,
+                then=Round(
+                    models.ExpressionWrapper(
+                        # SQLite stores 1.00 as the integer 1 and would divide
+                        # integers; going through 0.01 keeps the value fractional
+                        models.F('rating_sum') * models.Value(Decimal('0.01')) * models.Value(100)
+                        / models.F('review_count'),
+                        output_field=models.DecimalField(max_digits=5, decimal_places=2),
+                    ),
+                    2,
+                ),
+            ),
+            default=None,
+            output_field=models.DecimalField(max_digits=3, decimal_places=2),
+        ),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+        db_persist=True,
+    )
+
     class Meta:
         verbose_name = "Продукт"
         verbose_name_plural = "Продукти"
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['effective_price', 'id'], name='seafood_product_eff_price_idx'),
+            models.Index(fields=['-rating_avg', '-review_count', 'id'], name='seafood_product_rating_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -113,7 +193,11 @@ class SeafoodProduct(models.Model):
         """
         Returns Decimal package price (price for one package) or None.
         Requires price_per_100g to be set.
+        Uses the stored `package_price` column when it is loaded.
         """
+        stored = self.__dict__.get('package_price')
+        if stored is not None:
+            return stored
         try:
             if self.package_size_grams and self.price_per_100g is not None:
                 price100 = Decimal(str(self.price_per_100g or '0'))
@@ -162,7 +246,7 @@ class Order(models.Model):
     branch = models.CharField(max_length=150, blank=True)
 
     quantity_g = models.PositiveIntegerField(default=100)
-    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_price = MoneyField(default=0)  # kopiyky
 
     status = models.CharField(max_length=30, default='created')
 
@@ -185,6 +269,8 @@ class Order(models.Model):
     payment_confirmed_at = models.DateTimeField(null=True, blank=True)
 
     created_at = models.DateTimeField(default=timezone.now)
+    # the checkout form's one-time token (seafood.orders); a replayed POST finds this order
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
@@ -196,14 +282,10 @@ class Order(models.Model):
         return f"Order#{self.id} {self.full_name} {prod_name}"
 
     def recalc_totals(self):
-        items = self.items.all()
-        total_qty = 0
-        total_sum = Decimal('0.00')
-        for it in items:
-            total_qty += int(it.quantity_g or 0)
-            total_sum += (it.total_price or Decimal('0.00'))
-        self.quantity_g = total_qty or self.quantity_g
-        self.total_price = total_sum
+        """Quantity and total from one aggregate over the items."""
+        totals = self.items.aggregate(quantity=models.Sum('quantity_g'), total=models.Sum('total_price'))
+        self.quantity_g = totals['quantity'] or self.quantity_g
+        self.total_price = totals['total'] or Money(0)
         self.save(update_fields=['quantity_g', 'total_price'])
 
 
@@ -211,8 +293,8 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(SeafoodProduct, null=True, blank=True, on_delete=models.SET_NULL, related_name='order_items')
     quantity_g = models.PositiveIntegerField(default=100)   # grams
-    unit_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))  # price per 100g
-    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    unit_price = MoneyField(default=0)  # kopiyky per 100g
+    total_price = MoneyField(default=0)  # kopiyky
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -223,14 +305,69 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"OrderItem #{self.id} for Order #{self.order_id}"
 
+    def compute_total(self):
+        """Set total_price from unit_price and quantity_g (bulk_create skips save())."""
+        self.unit_price = Money.of(self.unit_price)
+        self.total_price = self.unit_price.scale(int(self.quantity_g or 0), 100)
+
     def save(self, *args, **kwargs):
-        try:
-            self.total_price = (Decimal(self.unit_price) * Decimal(self.quantity_g)) / Decimal('100')
-        except Exception:
-            self.total_price = Decimal('0.00')
+        self.compute_total()
         super().save(*args, **kwargs)
 
 
+class ProductSalesRank(models.Model):
+    """
+    Sales of a product over the best-seller window (see seafood.bestsellers).
+    Rebuilt periodically from OrderItem and bumped after every order.
+    """
+    product = models.OneToOneField(
+        SeafoodProduct,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='sales_rank'
+    )
+    quantity_g = models.PositiveBigIntegerField(default=0)
+    revenue = MoneyField(default=0)  # kopiyky
+    order_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-revenue', '-quantity_g', 'product'], name='seafood_sales_rank_idx'),
+        ]
+        verbose_name = 'Рейтинг продажів'
+        verbose_name_plural = 'Рейтинг продажів'
+
+    def __str__(self):
+        return f'Sales of product #{self.product_id}: {self.revenue}'
+
+
+class ProductNeighbor(models.Model):
+    """
+    Precomputed "bought together" row: one of the top-K co-purchased products
+    of `product` (see seafood.recommendations).
+    """
+    product = models.ForeignKey(SeafoodProduct, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(SeafoodProduct, on_delete=models.CASCADE, related_name='neighbor_of')
+    orders = models.PositiveIntegerField(default=0)  # orders containing both products
+    score = models.FloatField(default=0)
+    rank = models.PositiveSmallIntegerField(default=0)  # 0 = best
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'neighbor'], name='seafood_neighbor_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='seafood_neighbor_rank_idx'),
+        ]
+        verbose_name = 'Супутній товар'
+        verbose_name_plural = 'Супутні товари'
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.neighbor_id} ({self.score:.3f})'
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='favorites')
     product = models.ForeignKey(SeafoodProduct, on_delete=models.CASCADE, related_name='favorited_by')
@@ -246,6 +383,48 @@ class Favorite(models.Model):
         return f'{self.user} — {self.product}'
 
 
+class Cart(models.Model):
+    """
+    A shopping cart: one per signed-in user, or one per anonymous session,
+    identified by a key kept in that session (see seafood.cart).
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='cart'
+    )
+    session_key = models.CharField(max_length=40, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Кошик'
+        verbose_name_plural = 'Кошики'
+
+    def __str__(self):
+        return f'Cart #{self.pk} ({self.user or self.session_key})'
+
+
+class CartItem(models.Model):
+    """
+    One cart line. `quantity` counts packages for packaged products, units
+    for products sold in units and 100 g portions otherwise; prices always
+    come from the product.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(SeafoodProduct, on_delete=models.CASCADE, related_name='cart_items')
+    quantity = models.PositiveIntegerField(default=1)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['added_at', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='seafood_cartitem_unique'),
+        ]
+        verbose_name = 'Позиція кошика'
+        verbose_name_plural = 'Позиції кошика'
+
+    def __str__(self):
+        return f'{self.product_id} × {self.quantity}'
+
+
 class Review(models.Model):
     RATING_CHOICES = [(i, str(i)) for i in range(1, 6)]
 
@@ -266,10 +445,12 @@ class Review(models.Model):
 
 class ProductImage(models.Model):
     product = models.ForeignKey(SeafoodProduct, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/%Y/%m/')
+    image = models.ImageField(upload_to='products/%Y/%m/', storage=upload_storage)
+    image_lqip = models.TextField(blank=True, editable=False)
     alt = models.CharField(max_length=200, blank=True)
     is_main = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-is_main', 'created_at']
@@ -280,6 +461,80 @@ class ProductImage(models.Model):
         return f'{self.product} — image #{self.id}'
 
 
+class StoredBlob(models.Model):
+    """
+    One content-addressed upload (see seafood.storage) and the number of
+    ImageField values that point at it.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    # references taken by uploads (in refcount) that no row has claimed yet
+    pending = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Файл (за вмістом)'
+        verbose_name_plural = 'Файли (за вмістом)'
+
+    def __str__(self):
+        return f'{self.name} ×{self.refcount}'
+
+
+class ImageDerivative(models.Model):
+    """
+    A resized, re-encoded copy of an uploaded image (see seafood.images).
+    Keyed by the storage name of the original, so product and gallery images
+    share one table.
+    """
+    VARIANT_CHOICES = [('thumb', 'Thumb'), ('card', 'Card'), ('full', 'Full')]
+    FORMAT_CHOICES = [('webp', 'WebP'), ('jpeg', 'JPEG')]
+
+    source = models.CharField(max_length=255, db_index=True)
+    variant = models.CharField(max_length=10, choices=VARIANT_CHOICES)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    name = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField(default=0, help_text='Bytes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'variant', 'format'], name='seafood_derivative_unique'),
+        ]
+        verbose_name = 'Похідне зображення'
+        verbose_name_plural = 'Похідні зображення'
+
+    def __str__(self):
+        return f'{self.source} [{self.variant}.{self.format}]'
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Normalized search text of a product (see seafood.search). On SQLite it is
+    mirrored into the `seafood_product_fts` FTS5 table; on PostgreSQL it is
+    searched through a GIN tsvector index.
+    """
+    product = models.OneToOneField(
+        SeafoodProduct,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document'
+    )
+    name = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Пошуковий документ'
+        verbose_name_plural = 'Пошукові документи'
+
+    def __str__(self):
+        return f'Search document for product #{self.product_id}'
+
+
 class Conversation(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='conversations')
     order = models.OneToOneField(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='conversation')
@@ -302,7 +557,10 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
 
+    # downscaled JPEG shown in the chat; written from original_image by seafood.receipts
     image = models.ImageField(upload_to='receipts/%Y/%m/', blank=True, null=True)
+    # the receipt as uploaded, kept aside for staff
+    original_image = models.ImageField(upload_to='receipts/originals/%Y/%m/', blank=True, null=True)
 
     class Meta:
         ordering = ['created_at']
@@ -337,4 +595,35 @@ class CallbackRequest(models.Model):
         verbose_name_plural = 'Запити зворотного зв\'язку'
 
     def __str__(self):
-        return f'Callback Request #{self.id} — {self.name} ({self.phone})'
\ No newline at end of file
+        return f'Callback Request #{self.id} — {self.name} ({self.phone})'
+
+class Job(models.Model):
+    """
+    A unit of background work (see seafood.jobs), run by `manage.py run_jobs`.
+    A worker holds a claimed job until `locked_until`; a job whose lease ran
+    out (the worker died) can be claimed again.
+    """
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Очікує'), (RUNNING, 'Виконується'), (DONE, 'Виконано'), (FAILED, 'Помилка')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='seafood_job_queue_idx'),
+        ]
+        verbose_name = 'Фонове завдання'
+        verbose_name_plural = 'Фонові завдання'
+
+    def __str__(self):
+        return f'Job #{self.id} {self.name} [{self.status}]'
@@ -0,0 +1,125 @@
+"""
+Money as an integer number of kopiyky.
+
+`Money` is an `int` subclass: 1234.56 грн is Money(123456). Adding,
+subtracting and multiplying by a quantity stay in integers, and the result is
+still Money. The database stores plain BIGINTs (MoneyField), and a Stripe
+`unit_amount` is simply `int(money)`.
+
+Rounding happens in two places only:
+
+  - `Money.of()` turns a hryvnia amount (Decimal, str, float) into kopiyky,
+    half up;
+  - `Money.scale()` takes a fraction of an amount (e.g. 250 g at a price per
+    100 g), half up.
+
+`str(money)` is the plain "1234.56" that templates and messages print, and
+`format(money, '.2f')` formats the hryvnia value, not the kopiyky.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+MINOR_UNITS = 100
+
+
+class Money(int):
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, value):
+        """
+        Money from a hryvnia amount ('12.50', Decimal('12.5'), 12.5).
+        Money passes through, and a plain int is taken as kopiyky.
+        """
+        if value is None or value == '':
+            return cls(0)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value if isinstance(value, cls) else cls(value)
+        amount = Decimal(str(value).strip().replace(',', '.'))
+        return cls((amount * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+    def scale(self, numerator, denominator):
+        """self * numerator / denominator, rounded half up to a whole kopiyka."""
+        quotient, remainder = divmod(int(self) * numerator, denominator)
+        if 2 * remainder >= denominator:
+            quotient += 1
+        return Money(quotient)
+
+    def to_decimal(self):
+        return Decimal(int(self)).scaleb(-2)
+
+    def __add__(self, other):
+        if isinstance(other, int):
+            return Money(int(self) + int(other))
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, int):
+            return Money(int(self) - int(other))
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, int):
+            return Money(int(other) - int(self))
+        return NotImplemented
+
+    def __mul__(self, other):
+        # money * quantity; money * money has no meaning
+        if isinstance(other, int) and not isinstance(other, Money):
+            return Money(int(self) * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __str__(self):
+        sign = '-' if self < 0 else ''
+        hryvnias, kopiyky = divmod(abs(int(self)), MINOR_UNITS)
+        return '{}{}.{:02d}'.format(sign, hryvnias, kopiyky)
+
+    def __format__(self, spec):
+        return format(self.to_decimal(), spec) if spec else str(self)
+
+    def __repr__(self):
+        return 'Money({})'.format(int(self))
+
+
+class MoneyField(models.BigIntegerField):
+    """An amount in kopiyky, read back as Money and edited in forms as hryvnias."""
+
+    description = 'Amount of money in minor units (kopiyky)'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Money(value)
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            return Money.of(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        value = super(models.IntegerField, self).get_prep_value(value)
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return int(self.to_python(value))
+
+    def formfield(self, **kwargs):
+        return super(models.IntegerField, self).formfield(**{
+            'form_class': forms.DecimalField,
+            'max_digits': 14,
+            'decimal_places': 2,
+            **kwargs,
+        })
@@ -0,0 +1,164 @@
+"""
+Order placement.
+
+`place_order` writes a checkout in one transaction, and the number of
+queries does not grow with the number of lines:
+
+  - the Order row, then every OrderItem in one bulk_create. bulk_create
+    skips save(), so line totals come from OrderItem.compute_total first;
+  - the order's quantity and total from one aggregate over its items
+    (Order.recalc_totals);
+  - the best-seller ranking in set-based statements (seafood.bestsellers);
+  - the order chat: the conversation, both participants in one add(), and
+    the opening messages in one bulk_create.
+
+If any of it fails, nothing of the order is left behind. Notification
+emails are the caller's business, once the order exists.
+
+Every checkout form carries a one-time `submission_key`, stored as
+Order.idempotency_key under a unique constraint. A double-tap or a proxy
+retry posts the same key again, and `submitted_order` finds the order
+already placed for it instead of placing a second one. Two copies racing
+each other collide on the constraint, and the loser looks the winner up.
+"""
+
+import logging
+import secrets
+from typing import NamedTuple
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import pricing
+from .bestsellers import record_order
+from .models import Conversation, Message, Order, OrderItem, SeafoodProduct
+from .money import Money
+
+logger = logging.getLogger(__name__)
+
+SELLER_USERNAME = 'VugriUa'
+SELLER_EMAIL = 'vugriua@example.com'
+PAYMENT_DETAILS = 'ФОП Шовка Юрій Васильович: IBAN UA733220010000026009350109011'
+SUBMISSION_KEY_FIELD = 'submission_key'
+
+
+class OrderLine(NamedTuple):
+    product: SeafoodProduct
+    grams: int
+    unit_price: Money         # per 100 g, as OrderItem records it
+
+
+class PlacedOrder(NamedTuple):
+    order: Order
+    items: list               # the OrderItems, products attached
+    conversation: Conversation
+    seller: object            # the shop account (get_seller)
+
+    def item_lines(self):
+        """'- <product>: <grams> г — <total> грн' per item, for the chat and emails."""
+        return [
+            '- {}: {} г — {} грн'.format(item.product.name if item.product else '(товар)', item.quantity_g, item.total_price)
+            for item in self.items
+        ]
+
+
+def lines_from_cart(priced):
+    """OrderLines for a seafood.pricing.PricedCart."""
+    lines = []
+    for line in priced.lines:
+        if line.mode == pricing.UNIT:
+            # OrderItem prices per 100 g: one unit is recorded as a 100 g step
+            lines.append(OrderLine(line.product, pricing.GRAMS_PER_PORTION * line.quantity, line.step_price))
+        else:
+            lines.append(OrderLine(line.product, line.grams, Money.of(line.product.price_per_100g)))
+    return lines
+
+
+def new_submission_key():
+    """A fresh one-time key for a checkout form."""
+    return secrets.token_urlsafe(24)
+
+
+def submission_key(request):
+    """The posted submission key, or None when it is missing or malformed."""
+    key = request.POST.get(SUBMISSION_KEY_FIELD, '').strip()
+    max_length = Order._meta.get_field('idempotency_key').max_length
+    return key if 0 < len(key) <= max_length else None
+
+
+def submitted_order(key):
+    """Id of the order already placed with submission key `key`, or None."""
+    if not key:
+        return None
+    return Order.objects.filter(idempotency_key=key).values_list('pk', flat=True).first()
+
+
+def get_seller():
+    """The shop's account that answers order chats, created on first use."""
+    User = get_user_model()
+    seller = User.objects.filter(username=SELLER_USERNAME).first()
+    if seller is None:
+        seller = User.objects.create(
+            username=SELLER_USERNAME, email=SELLER_EMAIL, is_active=True, password=make_password(None),
+        )
+    return seller
+
+
+def _opening_messages(order, conversation, sender, items_text, email):
+    texts = [
+        f"Нове замовлення #{order.id}\n"
+        f"Позиції:\n{items_text}\n\n"
+        f"Клієнт: {order.full_name}\n"
+        f"Телефон: {order.phone}\n"
+        f"Місто: {order.city}\n"
+        f"Адреса/Відділення: {order.branch}\n"
+        f"Email: {email}\n"
+        f"Оплата: {order.get_payment_method_display() if order.payment_method else 'не вказано'}\n"
+    ]
+    if order.payment_method == 'card':
+        texts.append(
+            f"Вітаю!\n\n"
+            f"1) Зайдіть у свій банк або мобільний додаток.\n"
+            f"2) Перекажіть кошти на {PAYMENT_DETAILS}\n"
+            f"   Сума: {order.total_price}\n"
+            f"3) Зробіть фото квитанції та натисніть «Оплачено» в чаті або прикріпіть файл у повідомленні.\n\n"
+            f"Після отримання квитанції ми перевіримо оплату та підтвердимо."
+        )
+    return [Message(conversation=conversation, sender=sender, text=text) for text in texts]
+
+
+def place_order(lines, email='', **fields):
+    """
+    Create the order for `lines` (OrderLines) with the Order `fields` (user,
+    full_name, phone, idempotency_key, ...), its items, the best-seller
+    update and the order chat, all in one transaction. Returns a
+    PlacedOrder; IntegrityError if the idempotency key was used already.
+    """
+    with transaction.atomic():
+        seller = get_seller()
+        order = Order.objects.create(
+            product=lines[0].product if lines else None,
+            quantity_g=sum(line.grams for line in lines) or 100,
+            **fields,
+        )
+        items = []
+        for line in lines:
+            item = OrderItem(order=order, product=line.product, quantity_g=line.grams, unit_price=line.unit_price)
+            item.compute_total()
+            items.append(item)
+        OrderItem.objects.bulk_create(items)
+        order.recalc_totals()
+
+        try:
+            with transaction.atomic():
+                record_order(order)
+        except Exception:
+            # the ranking catches up at the next refresh_rankings()
+            logger.warning('Could not record order %s in the best-seller ranking', order.pk, exc_info=True)
+
+        conversation = Conversation.objects.create(order=order)
+        conversation.participants.add(*[user for user in (order.user, seller) if user is not None])
+        placed = PlacedOrder(order, items, conversation, seller)
+        Message.objects.bulk_create(_opening_messages(order, conversation, seller, '\n'.join(placed.item_lines()), email))
+    return placed
@@ -0,0 +1,114 @@
+"""
+Keyset (seek) pagination helpers.
+
+A page is addressed by an opaque cursor holding the sort-column values of
+the last row already shown. The next page is fetched with a WHERE clause on
+those values instead of OFFSET, so every page costs the same index range
+scan no matter how deep the shopper scrolls.
+
+`ordering` is a tuple of model field (or non-NULL annotation) names,
+optionally prefixed with '-', that must end with a unique column (normally
+'id'). NULLs always sort last.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+
+
+def encode_cursor(values):
+    raw = json.dumps([None if v is None else str(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, length):
+    """Return the list of cursor values, or None if the token is missing or malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _split(field):
+    return (field[1:], True) if field.startswith('-') else (field, False)
+
+
+def _nullable(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # annotations (e.g. the search rank) are never NULL
+        return False
+    # generated columns (e.g. effective_price) can be NULL whatever `null` says
+    return field.null or getattr(field, 'generated', False)
+
+
+def order_by_expressions(model, ordering):
+    exprs = []
+    for field in ordering:
+        name, desc = _split(field)
+        if _nullable(model, name):
+            exprs.append(F(name).desc(nulls_last=True) if desc else F(name).asc(nulls_last=True))
+        else:
+            exprs.append(F(name).desc() if desc else F(name).asc())
+    return exprs
+
+
+def _after(name, desc, value):
+    """Rows strictly after `value` in a single column (NULLs sort last)."""
+    if value is None:
+        return None
+    cmp = Q(**{f'{name}__lt' if desc else f'{name}__gt': value})
+    return cmp | Q(**{f'{name}__isnull': True})
+
+
+def _equal(name, value):
+    if value is None:
+        return Q(**{f'{name}__isnull': True})
+    return Q(**{name: value})
+
+
+def keyset_filter(ordering, values):
+    """
+    Lexicographic "row > cursor" predicate:
+      c1 > v1 OR (c1 = v1 AND c2 > v2) OR ...
+    """
+    result = None
+    prefix = Q()
+    for field, value in zip(ordering, values):
+        name, desc = _split(field)
+        after = _after(name, desc, value)
+        if after is not None:
+            term = prefix & after
+            result = term if result is None else result | term
+        prefix &= _equal(name, value)
+    return result if result is not None else Q(pk__in=[])
+
+
+def keyset_page(qs, ordering, cursor, page_size, transform=None):
+    """
+    Return (rows, next_cursor). `transform` maps each model instance to the
+    object handed to templates; cursor values are read from the instance.
+    """
+    values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        qs = qs.filter(keyset_filter(ordering, values))
+    qs = qs.order_by(*order_by_expressions(qs.model, ordering))
+
+    rows = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, _split(f)[0]) for f in ordering])
+    if transform is not None:
+        rows = [transform(r) for r in rows]
+    return rows, next_cursor
@@ -0,0 +1,99 @@
+"""
+Cart pricing.
+
+`price_items` prices a whole cart in one pass. It loads every referenced
+product with a single `in_bulk()` query and turns each (product id,
+quantity) pair into a PricedLine in the mode the product is sold in:
+
+  - unit: `quantity` units at `price_per_unit`;
+  - package: `quantity` packages at the package price;
+  - weight: `quantity` 100 g portions at `price_per_100g`.
+
+Amounts are seafood.money.Money (integer kopiyky). A catalog price is
+converted once, by `Money.of()`; the line and cart totals after that are
+integer arithmetic.
+
+Totals come back per currency. The cart page, checkout, Stripe checkout and
+order submission all price through here, so they always agree. That includes
+the single-product checkout without a cart, whose `quantity` is read by
+`parse_quantity` exactly like a cart quantity.
+"""
+
+from typing import NamedTuple, Optional
+
+from .models import SeafoodProduct
+from .money import Money
+
+CURRENCY = 'UAH'
+UNIT, PACKAGE, WEIGHT = 'unit', 'package', 'weight'
+GRAMS_PER_PORTION = 100
+
+
+class PricedLine(NamedTuple):
+    product: SeafoodProduct
+    quantity: int
+    mode: str                 # UNIT, PACKAGE or WEIGHT
+    step_price: Money         # price of one unit / package / 100 g
+    grams: Optional[int]      # None for products sold in units
+    total: Money
+    currency: str = CURRENCY
+
+    @property
+    def product_id(self):
+        return self.product.pk
+
+    @property
+    def unit_label(self):
+        if self.mode == UNIT:
+            return self.product.unit_label or 'шт'
+        if self.mode == PACKAGE:
+            return '{} г'.format(self.product.package_size_grams)
+        return '100 г'
+
+
+class PricedCart(NamedTuple):
+    lines: list
+    totals: dict              # currency -> Money
+    count: int                # sum of quantities
+
+    def totals_display(self):
+        return {currency: str(amount) for currency, amount in self.totals.items()}
+
+
+def parse_quantity(value, default=1):
+    """A submitted quantity of steps (units, packages or 100 g portions): at least 1, `default` if unreadable."""
+    try:
+        return max(1, int(float(value)))
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+def price_line(product, quantity):
+    """PricedLine for `quantity` steps of `product`."""
+    if product.sold_in_units:
+        mode, step_price, grams = UNIT, Money.of(product.price_per_unit), None
+    elif product.package_size_grams:
+        size = product.package_size_grams
+        mode, step_price, grams = PACKAGE, Money.of(product.price_per_100g).scale(size, GRAMS_PER_PORTION), size * quantity
+    else:
+        mode, step_price, grams = WEIGHT, Money.of(product.price_per_100g), GRAMS_PER_PORTION * quantity
+    return PricedLine(product, quantity, mode, step_price, grams, step_price * quantity)
+
+
+def price_items(items):
+    """
+    Price (product id, quantity) pairs. Missing products and non-positive
+    quantities are dropped; the order of `items` is kept.
+    """
+    items = [(int(product_id), int(quantity)) for product_id, quantity in items if int(quantity) > 0]
+    products = SeafoodProduct.objects.in_bulk([product_id for product_id, _quantity in items])
+    lines = []
+    totals = {}
+    for product_id, quantity in items:
+        product = products.get(product_id)
+        if product is None:
+            continue
+        line = price_line(product, quantity)
+        lines.append(line)
+        totals[line.currency] = totals.get(line.currency, Money(0)) + line.total
+    return PricedCart(lines, totals, sum(line.quantity for line in lines))
@@ -0,0 +1,201 @@
+"""
+Precomputed product page ("detail document") for `product_details`.
+
+Everything the product page shows that is the same for every visitor is
+built once per product into a plain, picklable dict: the flattened product
+(prices, package and unit display), its categories, the gallery (images,
+then the YouTube video), the parsed YouTube id, the rating summary and the
+first page of reviews.
+
+Documents are cached per product under the product's `updated_at`, so a
+change elsewhere in the shop leaves them alone. Everything a document shows
+moves that timestamp: saving the product, its gallery, category
+assignments, renamed categories, reviews (seafood.reviews) and freshly
+generated image variants (seafood.signals, seafood.tasks). The "bought
+together" strip shows other products, so it is cached separately under the
+catalog version. A warm product page costs the `updated_at` lookup (shared
+with the ETag), two cache reads and the visitor's favorite lookup.
+"""
+
+import re
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.templatetags.static import static
+from django.urls import reverse
+
+from . import reviews
+from .catalog import catalog_cache_key, product_card
+from .images import attach_variants, pick, variants_for
+from .models import SeafoodProduct
+from .recommendations import bought_together
+
+PLACEHOLDER_IMAGE = 'images/png/placeholder.png'
+VIDEO_THUMB = 'images/thumbs/video_placeholder.png'
+BOUGHT_TOGETHER_LIMIT = 6
+
+# Same patterns as the gallery script in product_details.html
+_YOUTUBE_ID_PATTERNS = [
+    re.compile(r'(?:v=)([0-9A-Za-z_-]{11})'),
+    re.compile(r'(?:embed/)([0-9A-Za-z_-]{11})'),
+    re.compile(r'(?:youtu\.be/)([0-9A-Za-z_-]{11})'),
+    re.compile(r'(?:shorts/)([0-9A-Za-z_-]{11})'),
+]
+
+
+def youtube_id(url):
+    """The 11-character video id of a YouTube URL, or None."""
+    for pattern in _YOUTUBE_ID_PATTERNS:
+        match = pattern.search(url or '')
+        if match:
+            return match.group(1)
+    return None
+
+
+def reviews_page_url(product_id, next_cursor, view_name='product_reviews'):
+    """
+    URL of the next page of reviews: the product_reviews fragment by default,
+    or with view_name='product_details' the product page showing that page
+    (the no-JS link).
+    """
+    if not next_cursor:
+        return None
+    return reverse(view_name, args=[product_id]) + '?' + urlencode({'cursor': next_cursor})
+
+
+def _file_url(field_file):
+    try:
+        return field_file.url if field_file else None
+    except Exception:
+        return None
+
+
+def _thumb_url(url, variants):
+    thumb = pick(variants, 'webp', 'thumb') or pick(variants, 'jpeg', 'thumb')
+    return thumb['url'] if thumb else url
+
+
+def gallery(name, image_urls, youtube_url=''):
+    """
+    Gallery entries {url, alt, is_main, is_video, thumb_url, variants, lqip, embed_url},
+    main image first. `image_urls` is [(url, alt, is_main, variants, lqip)];
+    a placeholder is used when it is empty. The video goes last unless
+    nothing is marked main.
+    """
+    images = [
+        {
+            'url': url, 'alt': alt or name, 'is_main': is_main, 'is_video': False,
+            'thumb_url': _thumb_url(url, variants), 'variants': variants, 'lqip': lqip,
+        }
+        for url, alt, is_main, variants, lqip in image_urls
+    ] or [{
+        'url': static(PLACEHOLDER_IMAGE), 'alt': name, 'is_main': True, 'is_video': False,
+        'thumb_url': static(PLACEHOLDER_IMAGE),
+    }]
+
+    if youtube_url:
+        video_id = youtube_id(youtube_url)
+        images.append({
+            'url': youtube_url,
+            'alt': 'video',
+            'is_main': not any(im['is_main'] for im in images),
+            'is_video': True,
+            'thumb_url': static(VIDEO_THUMB),
+            'embed_url': f'https://www.youtube.com/embed/{video_id}?rel=0&modestbranding=1' if video_id else None,
+        })
+
+    # stable sort: the first main entry leads, the rest keep their order
+    main = next((i for i, im in enumerate(images) if im['is_main']), 0)
+    images.insert(0, images.pop(main))
+    return images
+
+
+def _categories(product):
+    categories = {c.pk: c for c in product.categories.all()}
+    if product.category_id and product.category_id not in categories:
+        categories[product.category_id] = product.category
+    return [
+        {'name': c.name, 'slug': c.slug}
+        for c in sorted(categories.values(), key=lambda c: (c.ordering, c.name))
+    ]
+
+
+def build_document(product):
+    """The detail document for a SeafoodProduct (see module docstring)."""
+    card = product_card(product)
+    card.price_per_100g = str(product.price_per_100g)
+    card.image = card.image or SimpleNamespace(url=static(PLACEHOLDER_IMAGE))
+    card.youtube_id = youtube_id(card.youtube_url)
+    card.categories = _categories(product)
+
+    gallery_images = list(product.images.all())  # model ordering already puts is_main first
+    variants = variants_for([im.image.name for im in gallery_images] + [product.image.name])
+    image_urls = [
+        (_file_url(im.image) or static(PLACEHOLDER_IMAGE), im.alt, bool(im.is_main), variants.get(im.image.name),
+         im.image_lqip)
+        for im in gallery_images
+    ]
+    if not image_urls:
+        image_urls = [(card.image.url, product.name, True, variants.get(product.image.name), product.image_lqip)]
+    card.image.variants = variants.get(product.image.name)
+
+    first_reviews, next_cursor = reviews.review_page(product.pk)
+    return {
+        'product': card,
+        'images': gallery(product.name, image_urls, card.youtube_url),
+        'youtube_url': card.youtube_url or None,
+        'youtube_id': card.youtube_id,
+        'package_size': card.package_size,
+        'package_price': card.package_price_display,
+        'review_count': product.review_count,
+        'average_rating': float(product.rating_avg) if product.rating_avg is not None else None,
+        'reviews': list(first_reviews),
+        'reviews_next_url': reviews_page_url(product.pk, next_cursor),
+        'reviews_next_page_url': reviews_page_url(product.pk, next_cursor, 'product_details'),
+    }
+
+
+def product_updated_at(product_id):
+    return SeafoodProduct.objects.filter(pk=product_id).values_list('updated_at', flat=True).first()
+
+
+def document_key(product_id, updated_at):
+    return 'product_page:{}:{}'.format(product_id, updated_at.isoformat())
+
+
+def get_document(product_id, updated_at=None):
+    """
+    Cached build_document() for a product id, or None if there is no such
+    product. `updated_at` is the product's, when the caller has it already.
+    """
+    updated_at = updated_at or product_updated_at(product_id)
+    if updated_at is None:
+        return None
+    key = document_key(product_id, updated_at)
+    document = cache.get(key)
+    if document is None:
+        product = (
+            SeafoodProduct.objects
+            .select_related('category')
+            .prefetch_related('categories', 'images')
+            .filter(pk=product_id)
+            .first()
+        )
+        if product is None:
+            return None
+        document = build_document(product)
+        cache.set(key, document, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600))
+    return document
+
+
+def get_bought_together(product_id):
+    """Product cards of the "bought together" strip, cached under the catalog version."""
+    key = catalog_cache_key('bought_together', product_id)
+    together = cache.get(key)
+    if together is None:
+        together = [product_card(p) for p in bought_together([product_id], limit=BOUGHT_TOGETHER_LIMIT)]
+        attach_variants([p.image for p in together])
+        cache.set(key, together, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600))
+    return together
@@ -0,0 +1,181 @@
+"""
+Payment receipt uploads in the order chat.
+
+A receipt arrives through ReceiptUploadHandler, which chat_view installs for
+its own request. The handler streams the `receipt` field to a temporary file
+on disk (never into memory) and checks it while the chunks come in. The
+request's Content-Length and the running byte count are checked against
+RECEIPT_MAX_UPLOAD_SIZE. The first bytes must be a JPEG, PNG or WebP
+signature, and once the header is readable the pixel count must stay under
+RECEIPT_MAX_PIXELS. A failed check skips the rest of the file without storing
+it and leaves the reason in `request.receipt_error`.
+
+The accepted file is stored untouched in Message.original_image, kept aside
+for staff. The `receipts.process` job (seafood.tasks), queued in the same
+transaction as the message, writes a downscaled, re-encoded JPEG to
+Message.image (at most RECEIPT_MAX_SIDE px, EXIF dropped), and the chat
+shows that JPEG. A failed run is retried by the queue, and
+`manage.py reprocess_receipts` queues every receipt still without its JPEG.
+"""
+
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers, TemporaryFileUploadHandler
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import Message
+
+RECEIPT_FIELD = 'receipt'
+DEFAULT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+DEFAULT_MAX_PIXELS = 40_000_000
+DEFAULT_MAX_SIDE = 1600
+# multipart framing and the other form fields on top of the file itself
+BODY_SLACK = 64 * 1024
+# the image header is looked for in this many leading bytes
+HEAD_BYTES = 256 * 1024
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+
+def max_upload_size():
+    return getattr(settings, 'RECEIPT_MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+
+def max_pixels():
+    return getattr(settings, 'RECEIPT_MAX_PIXELS', DEFAULT_MAX_PIXELS)
+
+
+def sniff(head):
+    """Pillow format name from the file signature in `head`, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def _too_large_message():
+    return 'Файл завеликий (максимум {} МБ).'.format(max_upload_size() // (1024 * 1024))
+
+
+class ReceiptUploadHandler(TemporaryFileUploadHandler):
+    """Streams the `receipt` file to disk and enforces the receipt limits chunk by chunk."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.body_too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # known before a single byte is read; the file is skipped in new_file
+        self.body_too_large = bool(content_length) and content_length > max_upload_size() + BODY_SLACK
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        self.active = field_name == RECEIPT_FIELD
+        if not self.active:
+            return
+        if self.body_too_large or (content_length and content_length > max_upload_size()):
+            self._reject(_too_large_message())
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.head = b''
+        self.header_checked = False
+        # the default handlers must not buffer this file as well
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if start + len(raw_data) > max_upload_size():
+            self._reject(_too_large_message())
+        if not self.header_checked:
+            self._check_head(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        return super().file_complete(file_size)
+
+    def _check_head(self, raw_data):
+        self.head += raw_data[:HEAD_BYTES - len(self.head)]
+        if len(self.head) < 12:
+            return
+        if sniff(self.head) is None:
+            self._reject('Підтримуються лише зображення JPEG, PNG або WebP.')
+        try:
+            with Image.open(io.BytesIO(self.head)) as image:
+                width, height = image.size
+        except Exception:
+            if len(self.head) >= HEAD_BYTES:
+                # the dimensions come later in the file; validate_receipt checks them
+                self.header_checked = True
+            return
+        self.header_checked = True
+        if width * height > max_pixels():
+            self._reject('Зображення має завелику роздільну здатність.')
+
+    def _reject(self, reason):
+        if self.request is not None:
+            self.request.receipt_error = reason
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+        self.active = False
+        raise SkipFile(reason)
+
+
+def validate_receipt(upload):
+    """Fully decode the header of an uploaded receipt; ValidationError if it isn't a usable image."""
+    try:
+        upload.seek(0)
+        with Image.open(upload) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ValidationError('Підтримуються лише зображення JPEG, PNG або WebP.')
+            if image.width * image.height > max_pixels():
+                raise ValidationError('Зображення має завелику роздільну здатність.')
+            image.verify()
+    except ValidationError:
+        raise
+    except Exception as exc:
+        raise ValidationError('Файл пошкоджений або не є зображенням.') from exc
+    finally:
+        upload.seek(0)
+
+
+def process_receipt(message_id):
+    """
+    Write the downscaled JPEG of a message's original receipt to
+    Message.image. True if one was written.
+    """
+    message = Message.objects.filter(pk=message_id).first()
+    if message is None or not message.original_image or message.image:
+        return False
+    max_side = getattr(settings, 'RECEIPT_MAX_SIDE', DEFAULT_MAX_SIDE)
+    with message.original_image.open('rb') as f:
+        image = Image.open(f)
+        image.draft('RGB', (max_side, max_side))  # JPEG: decode at a reduced scale
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+
+    stem = os.path.splitext(os.path.basename(message.original_image.name))[0]
+    message.image.save(stem + '.jpg', ContentFile(buffer.getvalue()), save=False)
+    if not Message.objects.filter(pk=message.pk, image='').update(image=message.image.name):
+        # a concurrent run got there first
+        message.image.delete(save=False)
+        return False
+    return True
+
+
+def unprocessed():
+    """Messages with a stored receipt but no downscaled JPEG yet."""
+    return Message.objects.exclude(original_image='').exclude(original_image__isnull=True).filter(
+        Q(image='') | Q(image__isnull=True),
+    )
@@ -0,0 +1,104 @@
+"""
+"Bought together" recommendations.
+
+`rebuild_neighbors()` counts, for every pair of products, the orders that
+contain both (a self-join of OrderItem on order, aggregated in the DB) and
+keeps the top RECOMMENDATIONS_TOP_K neighbors of each product in
+ProductNeighbor. The score is the cosine of the two products' order sets,
+co_orders / sqrt(orders(a) * orders(b)), so staples that appear in every
+order don't crowd out real pairings.
+
+Run `manage.py rebuild_recommendations` periodically (e.g. nightly). Pages
+read suggestions with one indexed lookup and never aggregate orders.
+"""
+
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .bestsellers import top_products
+from .catalog import bump_catalog_version
+from .models import OrderItem, ProductNeighbor, SeafoodProduct
+
+DEFAULT_TOP_K = 12
+
+
+def _co_purchases():
+    """{(product_id, other_id): orders containing both}, both directions."""
+    rows = (
+        OrderItem.objects
+        .filter(product__isnull=False)
+        .annotate(other=F('order__items__product'))
+        .filter(other__isnull=False)
+        .exclude(other=F('product'))
+        .values('product', 'other')
+        .annotate(orders=Count('order', distinct=True))
+    )
+    return {(r['product'], r['other']): r['orders'] for r in rows}
+
+
+def _order_counts():
+    rows = (
+        OrderItem.objects
+        .filter(product__isnull=False)
+        .values('product')
+        .annotate(orders=Count('order', distinct=True))
+    )
+    return {r['product']: r['orders'] for r in rows}
+
+
+def rebuild_neighbors(top_k=None):
+    """Recompute ProductNeighbor; returns the number of rows written."""
+    top_k = top_k or getattr(settings, 'RECOMMENDATIONS_TOP_K', DEFAULT_TOP_K)
+    min_orders = getattr(settings, 'RECOMMENDATIONS_MIN_ORDERS', 1)
+    totals = _order_counts()
+
+    candidates = defaultdict(list)
+    for (product_id, other_id), orders in _co_purchases().items():
+        if orders < min_orders:
+            continue
+        score = orders / math.sqrt(totals[product_id] * totals[other_id])
+        candidates[product_id].append((score, orders, other_id))
+
+    rows = []
+    for product_id, items in candidates.items():
+        items.sort(key=lambda x: (-x[0], -x[1], x[2]))
+        for rank, (score, orders, other_id) in enumerate(items[:top_k]):
+            rows.append(ProductNeighbor(
+                product_id=product_id, neighbor_id=other_id, orders=orders, score=score, rank=rank,
+            ))
+
+    with transaction.atomic():
+        ProductNeighbor.objects.all().delete()
+        ProductNeighbor.objects.bulk_create(rows, batch_size=500)
+        # product pages show the neighbors and are validated by the catalog version
+        transaction.on_commit(bump_catalog_version)
+    return len(rows)
+
+
+def bought_together(product_ids, limit=8, pad=False):
+    """
+    Products most often bought with `product_ids` (scores summed over the
+    given products), best first, never including the products themselves.
+    With `pad`, tops up with best sellers so the strip is never empty.
+    """
+    product_ids = [pid for pid in product_ids if pid]
+    result = []
+    if product_ids:
+        result = list(
+            SeafoodProduct.objects
+            .filter(neighbor_of__product_id__in=product_ids)
+            .exclude(id__in=product_ids)
+            .annotate(together_score=Sum('neighbor_of__score'))
+            .order_by('-together_score', 'id')[:limit]
+        )
+    if pad and len(result) < limit:
+        seen = set(product_ids) | {p.id for p in result}
+        result += [p for p in top_products(limit + len(seen)) if p.id not in seen][:limit - len(result)]
+        if len(result) < limit:
+            seen |= {p.id for p in result}
+            result += list(SeafoodProduct.objects.exclude(id__in=seen)[:limit - len(result)])
+    return result
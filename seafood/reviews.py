@@ -0,0 +1,78 @@
+"""
+Review aggregates on SeafoodProduct (review_count, rating_sum -> rating_avg).
+
+Every review create/delete adjusts the counters with a single F() UPDATE in
+the same transaction as the review row, so concurrent reviews never lose an
+increment and pages read the rating without aggregating Review.
+`reconcile_ratings()` (manage.py reconcile_ratings) repairs drift caused by
+edits that bypass these helpers, e.g. the admin.
+
+Review lists are keyset-paginated on (created_at, id), newest first.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .models import Review, SeafoodProduct
+from .pagination import keyset_page
+
+REVIEW_ORDERING = ('-created_at', '-id')
+
+
+def review_page(product_id, cursor=''):
+    """(reviews, next_cursor) for one page of a product's reviews."""
+    qs = Review.objects.filter(product_id=product_id).select_related('user')
+    return keyset_page(qs, REVIEW_ORDERING, cursor, getattr(settings, 'REVIEWS_PAGE_SIZE', 10))
+
+
+def _adjust(product_id, count, rating):
+    SeafoodProduct.objects.filter(pk=product_id).update(
+        review_count=F('review_count') + count,
+        rating_sum=F('rating_sum') + rating,
+        updated_at=timezone.now(),
+    )
+    # cards show the rating, so cached catalog pages are stale now
+    transaction.on_commit(bump_catalog_version)
+
+
+def add_review(product, user, rating, comment=''):
+    with transaction.atomic():
+        review = Review.objects.create(user=user, product=product, rating=rating, comment=comment)
+        _adjust(product.pk, 1, rating)
+    return review
+
+
+def delete_review(review):
+    with transaction.atomic():
+        # only the request that actually removes the row moves the counters
+        deleted, _ = Review.objects.filter(pk=review.pk).delete()
+        if deleted:
+            _adjust(review.product_id, -1, -review.rating)
+
+
+def reconcile_ratings():
+    """Recount every product whose counters disagree with Review; returns how many were fixed."""
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    actual_count = Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n'), output_field=IntegerField()), 0)
+    actual_sum = Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s'), output_field=IntegerField()), 0)
+
+    drifted = (
+        SeafoodProduct.objects
+        .annotate(actual_count=actual_count, actual_sum=actual_sum)
+        .filter(~Q(review_count=F('actual_count')) | ~Q(rating_sum=F('actual_sum')))
+        .values_list('pk', 'actual_count', 'actual_sum')
+    )
+    fixed = 0
+    with transaction.atomic():
+        for pk, count, total in list(drifted):
+            SeafoodProduct.objects.filter(pk=pk).update(
+                review_count=count, rating_sum=total, updated_at=timezone.now(),
+            )
+            fixed += 1
+        if fixed:
+            transaction.on_commit(bump_catalog_version)
+    return fixed
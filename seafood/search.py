@@ -0,0 +1,265 @@
+"""
+Full-text product search.
+
+Every product has a ProductSearchDocument row with a normalized `name` and
+`body` (description + category names). Normalization casefolds, drops
+apostrophes (м'ясо -> мясо) and appends a Latin transliteration, so both
+"ікра" and "ikra" hit the same product. Queries are transliterated the
+other way too ("vugor" -> "вугор").
+
+Backends:
+  - SQLite: an FTS5 virtual table `seafood_product_fts` (rowid = product id),
+    ranked with bm25 and prefix queries.
+  - PostgreSQL: to_tsvector('simple', ...) over the document table with a
+    GIN expression index, ranked with ts_rank.
+  - anything else: a casefolded substring match on the document table.
+
+The index is kept in sync from model signals (seafood.signals); run
+`manage.py rebuild_search_index` to rebuild it from scratch.
+"""
+
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'seafood_product_fts'
+DOCUMENT_TABLE = 'seafood_productsearchdocument'
+
+# Ukrainian national transliteration (2010), position-independent variant.
+# Russian-only letters are included because shoppers type them too.
+CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'h', 'ґ': 'g', 'д': 'd', 'е': 'e',
+    'є': 'ie', 'ж': 'zh', 'з': 'z', 'и': 'y', 'і': 'i', 'ї': 'i', 'й': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ь': '', 'ю': 'iu', 'я': 'ia',
+    'ы': 'y', 'э': 'e', 'ё': 'io', 'ъ': '',
+}
+
+# How people actually type Ukrainian words in Latin; longest match wins.
+LAT_TO_CYR = {
+    'shch': 'щ', 'sch': 'щ',
+    'zh': 'ж', 'kh': 'х', 'ts': 'ц', 'ch': 'ч', 'sh': 'ш',
+    'yu': 'ю', 'iu': 'ю', 'ya': 'я', 'ia': 'я', 'ye': 'є', 'ie': 'є', 'yi': 'ї',
+    'a': 'а', 'b': 'б', 'c': 'ц', 'd': 'д', 'e': 'е', 'f': 'ф', 'g': 'г',
+    'h': 'г', 'i': 'і', 'j': 'й', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н',
+    'o': 'о', 'p': 'п', 'q': 'к', 'r': 'р', 's': 'с', 't': 'т', 'u': 'у',
+    'v': 'в', 'w': 'в', 'x': 'кс', 'y': 'и', 'z': 'з',
+}
+_LAT_KEYS = sorted(LAT_TO_CYR, key=len, reverse=True)
+
+_APOSTROPHES = re.compile(r"['’ʼʹ`]")
+_WORD = re.compile(r'\w+')
+_LATIN_WORD = re.compile(r'^[a-z]+$')
+_CYRILLIC = re.compile(r'[Ѐ-ӿ]')
+
+
+def normalize(text):
+    """Casefold and strip apostrophes so м'ясо / мʼясо / МЯСО all match."""
+    return _APOSTROPHES.sub('', (text or '').casefold())
+
+
+def to_latin(word):
+    return ''.join(CYR_TO_LAT.get(ch, ch) for ch in word)
+
+
+def to_cyrillic(word):
+    out = []
+    i = 0
+    while i < len(word):
+        for key in _LAT_KEYS:
+            if word.startswith(key, i):
+                out.append(LAT_TO_CYR[key])
+                i += len(key)
+                break
+        else:
+            out.append(word[i])
+            i += 1
+    return ''.join(out)
+
+
+def tokens(text):
+    return _WORD.findall(normalize(text))
+
+
+def index_text(text):
+    """Normalized words plus the Latin spelling of every Cyrillic word."""
+    words = tokens(text)
+    extra = [to_latin(w) for w in words if _CYRILLIC.search(w)]
+    return ' '.join(dict.fromkeys(words + extra))
+
+
+def document_fields(name, description='', category_names=()):
+    """(name, body) as stored in ProductSearchDocument."""
+    body = ' '.join([description or ''] + [c for c in category_names if c])
+    return index_text(name), index_text(body)
+
+
+def query_variants(query):
+    """
+    One list of spellings per query word; a product must match every word
+    (any spelling, as a prefix).
+    """
+    result = []
+    for word in tokens(query):
+        variants = [word]
+        if _LATIN_WORD.match(word):
+            variants.append(to_cyrillic(word))
+        result.append(list(dict.fromkeys(variants)))
+    return result
+
+
+# -----------------------
+# Index maintenance
+# -----------------------
+
+def _product_fields(product):
+    names = set(product.categories.values_list('name', flat=True))
+    if product.category_id:
+        names.add(product.category.name)
+    return document_fields(product.name, product.description, sorted(names))
+
+
+def index_product(product_id):
+    from .models import SeafoodProduct, ProductSearchDocument
+
+    product = SeafoodProduct.objects.select_related('category').filter(pk=product_id).first()
+    if product is None:
+        remove_product(product_id)
+        return
+    name, body = _product_fields(product)
+    with transaction.atomic():
+        ProductSearchDocument.objects.update_or_create(product=product, defaults={'name': name, 'body': body})
+        _fts_write(product.pk, name, body)
+
+
+def remove_product(product_id):
+    from .models import ProductSearchDocument
+
+    with transaction.atomic():
+        ProductSearchDocument.objects.filter(product_id=product_id).delete()
+        _fts_write(product_id, None, None)
+
+
+def rebuild_index():
+    """Rebuild every document; returns the number of indexed products."""
+    from .models import SeafoodProduct, ProductSearchDocument
+
+    count = 0
+    with transaction.atomic():
+        ProductSearchDocument.objects.all().delete()
+        if _fts_enabled():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        docs = []
+        for product in SeafoodProduct.objects.select_related('category').prefetch_related('categories'):
+            names = {c.name for c in product.categories.all()}
+            if product.category_id:
+                names.add(product.category.name)
+            name, body = document_fields(product.name, product.description, sorted(names))
+            docs.append(ProductSearchDocument(product=product, name=name, body=body))
+            _fts_write(product.pk, name, body, replace=False)
+            count += 1
+        ProductSearchDocument.objects.bulk_create(docs)
+    return count
+
+
+_fts_seen = set()
+
+
+def _fts_enabled():
+    # Only a positive answer is remembered: the table never disappears at
+    # runtime, but it may be created by `migrate` after the process starts.
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias in _fts_seen:
+        return True
+    if FTS_TABLE in connection.introspection.table_names():
+        _fts_seen.add(connection.alias)
+        return True
+    return False
+
+
+def _fts_write(product_id, name, body, replace=True):
+    if not _fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        if replace:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+        if name is not None:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, body) VALUES (%s, %s, %s)',
+                [product_id, name, body],
+            )
+
+
+# -----------------------
+# Querying
+# -----------------------
+
+def search_product_ids(query, limit=None):
+    """Product ids matching `query`, best match first."""
+    variants = query_variants(query)
+    if not variants:
+        return []
+    limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 200)
+    try:
+        # savepoint, so a failed query doesn't poison an outer transaction
+        with transaction.atomic():
+            if _fts_enabled():
+                return _search_fts5(variants, limit)
+            if connection.vendor == 'postgresql':
+                return _search_postgres(variants, limit)
+    except DatabaseError:
+        logger.exception('Full-text search failed; falling back to substring match')
+    return _search_fallback(variants, limit)
+
+
+def _search_fts5(variants, limit):
+    # ("ікра"* OR "ikra"*) AND ("кети"* OR ...) -- words are \w+, no escaping needed
+    match = ' AND '.join(
+        '(' + ' OR '.join(f'"{v}"*' for v in group) + ')' for group in variants
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0) LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_postgres(variants, limit):
+    tsquery = ' & '.join(
+        '(' + ' | '.join(f'{v}:*' for v in group) + ')' for group in variants
+    )
+    vector = (
+        "setweight(to_tsvector('simple', name), 'A') || "
+        "setweight(to_tsvector('simple', body), 'B')"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT product_id FROM {DOCUMENT_TABLE} "
+            f"WHERE ({vector}) @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({vector}, to_tsquery('simple', %s)) DESC, product_id "
+            f"LIMIT %s",
+            [tsquery, tsquery, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_fallback(variants, limit):
+    from django.db.models import Q
+    from .models import ProductSearchDocument
+
+    qs = ProductSearchDocument.objects.all()
+    for group in variants:
+        cond = Q()
+        for v in group:
+            cond |= Q(name__contains=v) | Q(body__contains=v)
+        qs = qs.filter(cond)
+    return list(qs.order_by('product_id').values_list('product_id', flat=True)[:limit])
@@ -0,0 +1,217 @@
+"""
+Model signal handlers for the seafood app.
+Registered from SeafoodConfig.ready().
+"""
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cart, images, jobs, search, tasks
+from .catalog import bump_catalog_version
+from .conditional import bump_viewer_version
+from .models import SeafoodProduct, Category, ProductImage, Favorite, Conversation, ImageDerivative
+
+
+def _invalidate_catalog():
+    # Bump after commit so another worker can't rebuild the new version
+    # from rows that are not committed yet.
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=SeafoodProduct)
+@receiver(post_delete, sender=SeafoodProduct)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def catalog_changed(sender, **kwargs):
+    _invalidate_catalog()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_product(sender, instance, raw=False, **kwargs):
+    # the gallery is part of the product page; move its Last-Modified / ETag
+    if not raw:
+        SeafoodProduct.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=SeafoodProduct.categories.through)
+def product_categories_changed(sender, action, instance, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # the category side loses the ids on clear; remember them for post_clear
+        instance._search_product_ids = list(instance.products.values_list('id', flat=True))
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidate_catalog()
+        if not reverse:
+            SeafoodProduct.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+            search.index_product(instance.pk)
+        else:
+            ids = pk_set if action != 'post_clear' else getattr(instance, '_search_product_ids', [])
+            for product_id in ids or ():
+                search.index_product(product_id)
+
+
+# -----------------------
+# Search index sync
+# -----------------------
+# Written inside the caller's transaction so the index rolls back with it.
+
+def _category_product_ids(category):
+    return list(
+        SeafoodProduct.objects
+        .filter(Q(categories=category) | Q(category=category))
+        .values_list('id', flat=True)
+        .distinct()
+    )
+
+
+@receiver(post_save, sender=SeafoodProduct)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=SeafoodProduct)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, raw=False, **kwargs):
+    if not raw:
+        product_ids = _category_product_ids(instance)
+        for product_id in product_ids:
+            search.index_product(product_id)
+        # product pages show the category name (seafood.product_page)
+        SeafoodProduct.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._search_product_ids = _category_product_ids(instance)
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorized_products(sender, instance, **kwargs):
+    product_ids = getattr(instance, '_search_product_ids', ())
+    for product_id in product_ids:
+        search.index_product(product_id)
+    SeafoodProduct.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+
+# -----------------------
+# Per-user page versions (seafood.conditional)
+# -----------------------
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorites_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_viewer_version(instance.user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def account_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_viewer_version(instance.pk))
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def conversations_changed(sender, action, instance, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.participants.values_list('pk', flat=True))
+    else:
+        user_ids = list(pk_set or ())
+    transaction.on_commit(lambda: [bump_viewer_version(user_id) for user_id in user_ids])
+
+
+# -----------------------
+# Image derivatives (seafood.images)
+# -----------------------
+# Queued in the saving transaction, so a rolled-back upload queues nothing.
+
+@receiver(post_save, sender=SeafoodProduct)
+@receiver(post_save, sender=ProductImage)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    source = instance.image.name if instance.image else ''
+    if not source or raw or images.has_failed(source):
+        return
+    changed = source != (getattr(instance, '_previous_image', None) or '')
+    if changed or not instance.image_lqip or not ImageDerivative.objects.filter(source=source).exists():
+        jobs.enqueue(tasks.DERIVE_IMAGE, source=source)
+
+
+@receiver(post_save, sender=SeafoodProduct)
+@receiver(post_save, sender=ProductImage)
+def drop_replaced_derivatives(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_image', None) or ''
+    if previous and previous != (instance.image.name or '') and not raw:
+        transaction.on_commit(lambda: images.drop_unused_derivatives(previous))
+
+
+@receiver(post_delete, sender=SeafoodProduct)
+@receiver(post_delete, sender=ProductImage)
+def drop_deleted_derivatives(sender, instance, **kwargs):
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: images.drop_unused_derivatives(name))
+
+
+# -----------------------
+# Blob reference counts (seafood.storage)
+# -----------------------
+
+@receiver(pre_save, sender=SeafoodProduct)
+@receiver(pre_save, sender=ProductImage)
+def remember_previous_image(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._previous_image = (
+        sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+    )
+    if (instance._previous_image or '') != (instance.image.name or ''):
+        instance.image_lqip = ''  # recomputed for the new image after commit
+
+
+@receiver(post_save, sender=SeafoodProduct)
+@receiver(post_save, sender=ProductImage)
+def count_image_reference(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    storage = instance.image.storage
+    previous = getattr(instance, '_previous_image', None) or ''
+    current = instance.image.name or ''
+    if current == previous or not hasattr(storage, 'release'):
+        return
+    if current:
+        storage.retain(current)
+    if previous:
+        transaction.on_commit(lambda: storage.release(previous))
+
+
+@receiver(post_delete, sender=SeafoodProduct)
+@receiver(post_delete, sender=ProductImage)
+def release_image(sender, instance, **kwargs):
+    storage = instance.image.storage
+    name = instance.image.name
+    if name and hasattr(storage, 'release'):
+        transaction.on_commit(lambda: storage.release(name))
+
+
+# -----------------------
+# Cart (seafood.cart)
+# -----------------------
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # what the visitor put in the cart before signing in stays there
+    if request is not None and hasattr(request, 'session'):
+        cart.merge_session_cart(request, user)
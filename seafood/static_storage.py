@@ -0,0 +1,130 @@
+"""
+collectstatic storage for the site's own images.
+
+On top of WhiteNoise's CompressedManifestStaticFilesStorage (hashed names,
+gzip/brotli copies, far-future caching) this:
+
+  - writes resized WebP and AVIF copies of every raster image under
+    `images/` (widths from STATIC_IMAGE_WIDTHS, never upscaled) to
+    `images/opt/<ascii-name>-<width>.<ext>` before hashing, so they are
+    hashed and compressed like any other file, and lists them in
+    `staticfiles-variants.json` for the `{% static_picture %}` and
+    `{% static_image_set %}` tags (seafood.templatetags.image_tags);
+  - makes every hashed name ASCII-safe (`images/вугор головна.jpg` is
+    served as `images/vuhor-holovna.<hash>.jpg`), while templates keep using
+    the original names through the manifest.
+
+Without a manifest (runserver, tests) URLs fall back to the plain names.
+"""
+
+import io
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.text import slugify
+from PIL import Image, ImageOps, features
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+from .images import resize_to_width
+from .search import normalize, to_latin
+
+VARIANTS_MANIFEST = 'staticfiles-variants.json'
+VARIANTS_DIR = 'images/opt'
+DEFAULT_STATIC_IMAGE_WIDTHS = (480, 960, 1600)
+RASTER_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# format -> (Pillow format, extension, save options)
+STATIC_FORMATS = {
+    'avif': ('AVIF', 'avif', {'quality': 55}),
+    'webp': ('WEBP', 'webp', {'quality': 78, 'method': 6}),
+}
+_ASCII_SAFE = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+def ascii_segment(segment):
+    """A path segment as a URL-safe ASCII slug (transliterated from Ukrainian); ASCII-safe ones are kept."""
+    if _ASCII_SAFE.match(segment):
+        return segment
+    return slugify(to_latin(normalize(segment))) or 'file'
+
+
+def ascii_name(name):
+    """`name` with every directory and the file stem made ASCII-safe; a `.hash` before the extension is kept."""
+    *dirs, filename = name.split('/')
+    stem, ext = os.path.splitext(filename)
+    base, dot, digest = stem.rpartition('.')
+    stem = ascii_segment(base) + dot + digest if dot else ascii_segment(stem)
+    return '/'.join([ascii_segment(d) for d in dirs] + [stem + ext.lower()])
+
+
+def available_formats():
+    """STATIC_FORMATS this Pillow build can write (AVIF needs Pillow built with libavif)."""
+    return [fmt for fmt in STATIC_FORMATS if features.check(fmt)]
+
+
+class OptimizedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+
+    def hashed_name(self, name, content=None, filename=None):
+        return ascii_name(super().hashed_name(name, content, filename))
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # collectstatic has not run here (runserver, tests): serve plain names
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            self.write_image_variants(paths)
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+    def write_image_variants(self, paths):
+        """Write the resized copies of raster images in `paths` and register them for hashing."""
+        widths = sorted(getattr(settings, 'STATIC_IMAGE_WIDTHS', DEFAULT_STATIC_IMAGE_WIDTHS))
+        formats = available_formats()
+        variants = {}
+        for name in sorted(paths):
+            if not name.startswith('images/') or name.startswith(VARIANTS_DIR + '/'):
+                continue
+            if not name.lower().endswith(RASTER_EXTENSIONS):
+                continue
+            storage, path = paths[name]
+            with storage.open(path) as f:
+                image = ImageOps.exif_transpose(Image.open(f))
+                image.load()
+
+            stem = ascii_name(os.path.splitext(name)[0])[len('images/'):].replace('/', '-')
+            entry = {'width': image.width, 'height': image.height}
+            done = set()
+            for width in widths:
+                resized = resize_to_width(image, width)
+                if resized.width in done:
+                    continue
+                done.add(resized.width)
+                has_alpha = 'A' in resized.getbands() or 'transparency' in resized.info
+                converted = resized.convert('RGBA' if has_alpha else 'RGB')
+                for fmt in formats:
+                    pil_format, ext, save_options = STATIC_FORMATS[fmt]
+                    buffer = io.BytesIO()
+                    converted.save(buffer, pil_format, **save_options)
+                    variant_name = f'{VARIANTS_DIR}/{stem}-{resized.width}.{ext}'
+                    if self.exists(variant_name):
+                        self.delete(variant_name)
+                    self.save(variant_name, ContentFile(buffer.getvalue()))
+                    paths[variant_name] = (self, variant_name)
+                    entry.setdefault(fmt, []).append([variant_name, resized.width, resized.height])
+            variants[name] = entry
+
+        if self.exists(VARIANTS_MANIFEST):
+            self.delete(VARIANTS_MANIFEST)
+        self.save(VARIANTS_MANIFEST, ContentFile(json.dumps(variants, ensure_ascii=False, indent=1).encode('utf-8')))
+
+    def load_variants(self):
+        """{original name: {'width', 'height', fmt: [[name, width, height]]}}, or {} before collectstatic."""
+        try:
+            with self.open(VARIANTS_MANIFEST) as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return {}
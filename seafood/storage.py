@@ -0,0 +1,125 @@
+"""
+Content-addressed storage for product image uploads.
+
+An upload is stored once under the SHA-256 of its bytes,
+`blobs/<2 hex>/<digest><ext>`, whatever name or `upload_to` it came with,
+and the ImageField simply holds that name. StoredBlob keeps one row per
+blob with a reference count of the rows pointing at it: seafood.signals
+retains a reference when a row starts using a blob and releases it when the
+row's image is replaced or the row is deleted. The file and its derivatives
+(seafood.images) are removed when the last reference goes, so re-uploading
+the same photo costs no disk space, backup size or CDN cache.
+
+An upload takes its reference when it is stored, not when the row is saved,
+so a concurrent release of the same blob can't delete the file in between.
+The increment only matches a blob that still has references; one at zero is
+being released, and the upload replaces it with a fresh row and file
+instead. The upload's reference is also counted in StoredBlob.pending, in
+the same transaction, and the next retain() of the blob claims it instead of
+adding another. A rollback undoes both. A stored file that no row ever
+claims keeps its blob until `dedupe_media` recounts the references. Release
+deletes the row and the file in one transaction, which an upload of the
+same bytes waits for.
+
+Names outside `blobs/` (uploads from before this storage, fixtures, script
+assigned paths) behave exactly as with FileSystemStorage; the dedupe_media
+command moves them into blobs.
+"""
+
+import hashlib
+import os
+
+from django.db import transaction
+from django.db.models import F
+from django.core.files.storage import FileSystemStorage
+
+BLOB_PREFIX = 'blobs'
+
+
+def file_digest(content):
+    """SHA-256 hex digest of a File (read in chunks, rewound afterwards)."""
+    sha = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return sha.hexdigest()
+
+
+def blob_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return '{}/{}/{}{}'.format(BLOB_PREFIX, digest[:2], digest, ext)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, **kwargs):
+        # a blob name always means the same bytes, so a concurrent writer of
+        # the same upload may overwrite it instead of inventing a new name
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        digest = file_digest(content)
+        with transaction.atomic():
+            reserved = StoredBlob.objects.filter(digest=digest, refcount__gt=0).update(
+                refcount=F('refcount') + 1, pending=F('pending') + 1,
+            )
+            if reserved:
+                blob = StoredBlob.objects.get(digest=digest)
+                if not self.exists(blob.name):
+                    super()._save(blob.name, content)
+            else:
+                StoredBlob.objects.filter(digest=digest).delete()
+                blob = StoredBlob.objects.create(
+                    digest=digest, name=blob_name(digest, name), size=content.size, refcount=1, pending=1,
+                )
+                super()._save(blob.name, content)
+        return blob.name
+
+    def is_blob(self, name):
+        return bool(name) and name.startswith(BLOB_PREFIX + '/')
+
+    def retain(self, name):
+        """Add a reference to blob `name`. No-op for other names."""
+        from .models import StoredBlob
+
+        if not self.is_blob(name):
+            return
+        if StoredBlob.objects.filter(name=name, pending__gt=0).update(pending=F('pending') - 1):
+            return  # the upload's reference, counted when it was stored
+        digest = os.path.splitext(os.path.basename(name))[0]
+        StoredBlob.objects.get_or_create(digest=digest, defaults={'name': name})
+        StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    def release(self, name):
+        """
+        Drop one reference to `name`; the blob file and its derivatives go with
+        the last one. No-op for other names.
+        """
+        from .images import delete_derivatives
+        from .models import StoredBlob
+
+        if not self.is_blob(name):
+            return
+        with transaction.atomic():
+            StoredBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+            if StoredBlob.objects.filter(name=name, refcount__lte=0).delete()[0]:
+                # still inside the transaction: an upload of the same bytes waits, then writes a new file
+                self.delete(name)
+                delete_derivatives(name)
+
+
+_upload_storage = None
+
+
+def upload_storage():
+    """Storage of product image fields (a callable so migrations don't depend on MEDIA_ROOT)."""
+    global _upload_storage
+    if _upload_storage is None:
+        _upload_storage = ContentAddressedStorage()
+    return _upload_storage
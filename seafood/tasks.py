@@ -0,0 +1,87 @@
+"""
+Background jobs of the shop (queued with seafood.jobs.enqueue).
+
+Each job loads what it needs by id when it runs, so it sees the committed
+state. The email helpers report failure by returning False; the jobs turn
+that into an exception, so the queue retries them.
+
+`receipts.process` downscales a chat receipt (seafood.receipts), and
+`images.derive` writes the variants and LQIP of an uploaded image
+(seafood.images).
+
+`email.send` is a batch job: every queued plain email in a claimed batch goes
+through one seafood.brevo_email.Outbox, so copies of the same message (an
+order notification to several addresses) become one Brevo request.
+"""
+
+from django.conf import settings
+
+from . import images
+from .brevo_email import Outbox, send_callback_request_notification_email, send_verification_email
+from .catalog import bump_catalog_version
+from .jobs import task
+from .models import CallbackRequest, EmailVerification
+from .receipts import process_receipt
+
+SEND_EMAIL = 'email.send'
+VERIFICATION_EMAIL = 'email.verification'
+CALLBACK_NOTIFICATION = 'email.callback_notification'
+PROCESS_RECEIPT = 'receipts.process'
+DERIVE_IMAGE = 'images.derive'
+
+
+class EmailNotSent(Exception):
+    pass
+
+
+@task(SEND_EMAIL, batch=True)
+def send_emails(payloads):
+    """Payloads are Outbox.add() keyword arguments."""
+    outbox = Outbox()
+    for payload in payloads:
+        outbox.add(**payload)
+    return [None if sent else EmailNotSent(payload['recipient_email']) for sent, payload in zip(outbox.flush(), payloads)]
+
+
+@task(VERIFICATION_EMAIL)
+def verification_email(user_id):
+    verification = EmailVerification.objects.select_related('user').filter(user_id=user_id).first()
+    if verification is None or verification.user.is_active:
+        return  # already verified, or the account is gone
+    if not send_verification_email(verification.user.email, verification.code):
+        raise EmailNotSent(verification.user.email)
+
+
+@task(CALLBACK_NOTIFICATION)
+def callback_notification(callback_id):
+    admin_email = getattr(settings, 'ADMIN_EMAIL', None)
+    callback = CallbackRequest.objects.select_related('product').filter(pk=callback_id).first()
+    if not admin_email or callback is None:
+        return
+    if not send_callback_request_notification_email(
+        admin_email=admin_email,
+        callback_id=callback.pk,
+        caller_name=callback.name,
+        caller_phone=callback.phone,
+        product_name=str(callback.product) if callback.product else '',
+        preferred_time=callback.preferred_time or '',
+        message=callback.message,
+    ):
+        raise EmailNotSent(admin_email)
+
+
+@task(PROCESS_RECEIPT)
+def receipt(message_id):
+    process_receipt(message_id)  # a no-op when it is already done or the message is gone
+
+
+@task(DERIVE_IMAGE)
+def derive_image(source):
+    if not images.in_use(source):
+        return  # replaced or deleted before the job ran
+    generated = images.ensure_derivatives(source)
+    generated = images.ensure_lqip(source) or generated
+    if generated:
+        # cached cards and product pages were built without them
+        images.touch_products(source)
+        bump_catalog_version()
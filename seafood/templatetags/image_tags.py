@@ -0,0 +1,157 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db.models.fields.files import FieldFile
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from seafood.images import pick, variants_for
+
+register = template.Library()
+
+PLACEHOLDER_IMAGE = 'images/png/placeholder.png'
+
+# layout widths the browser picks a candidate for; see seafood.images for the variants
+DEFAULT_SIZES = {
+    'thumb': '160px',
+    'card': '(max-width: 600px) 50vw, 320px',
+    'full': '(max-width: 900px) 100vw, 800px',
+}
+
+
+def _image_url_and_variants(image):
+    """(url, variants) for a card image namespace, a gallery dict or an ImageField file."""
+    if not image:
+        return None, None
+    if isinstance(image, dict):
+        return image.get('url'), image.get('variants')
+    if isinstance(image, FieldFile):
+        try:
+            url = image.url
+        except ValueError:
+            return None, None
+        if hasattr(image, 'variants'):  # set in bulk by seafood.images.attach_variants
+            return url, image.variants
+        return url, variants_for([image.name]).get(image.name)
+    return getattr(image, 'url', None), getattr(image, 'variants', None)
+
+
+def _srcset(entries):
+    return format_html_join(', ', '{} {}w', ((e['url'], e['width']) for e in entries))
+
+
+def _lqip(image):
+    if isinstance(image, dict):
+        return image.get('lqip') or ''
+    return getattr(image, 'lqip', '') or ''
+
+
+@register.simple_tag
+def picture(image, alt='', variant='card', sizes='', css_class='', loading='lazy', img_id='', lqip=''):
+    """
+    <picture> with WebP and JPEG srcsets for an image that has derivatives,
+    or a plain <img> (the original, or the placeholder) for one that has not.
+    The LQIP preview (seafood.images), from `lqip` or the image itself, is
+    painted as the <img> background until the file arrives. The <img> falls
+    back to the placeholder if the file fails to load.
+    """
+    url, variants = _image_url_and_variants(image)
+    placeholder = static(PLACEHOLDER_IMAGE)
+    onerror = (
+        "this.onerror=null;var p=this.parentNode;"
+        "if(p.tagName==='PICTURE'){{p.querySelectorAll('source').forEach(function(s){{s.remove();}});}}"
+        "this.removeAttribute('srcset');this.src='{}';"
+    ).format(placeholder)
+    lqip = lqip or _lqip(image)
+    attrs = format_html(
+        'alt="{}" class="{}" loading="{}"{}{} onerror="{}"',
+        alt, css_class, loading,
+        format_html(' id="{}"', img_id) if img_id else '',
+        format_html(' style="background:url({}) center/cover no-repeat"', lqip) if lqip else '',
+        onerror,
+    )
+
+    fallback = pick(variants, 'jpeg', variant)
+    if not fallback:
+        return format_html('<img src="{}" {}>', url or placeholder, attrs)
+
+    sizes = sizes or DEFAULT_SIZES.get(variant, '100vw')
+    webp = variants.get('webp')
+    source = format_html('<source type="image/webp" srcset="{}" sizes="{}">', _srcset(webp), sizes) if webp else ''
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" {}></picture>',
+        source, fallback['url'], _srcset(variants['jpeg']), sizes, fallback['width'], fallback['height'], attrs,
+    )
+
+
+@register.simple_tag
+def variant_url(image, variant='thumb', fmt='webp'):
+    """URL of one derivative of `image`, or the original's URL if it has none."""
+    url, variants = _image_url_and_variants(image)
+    entry = pick(variants, fmt, variant) or pick(variants, 'jpeg', variant)
+    return entry['url'] if entry else (url or static(PLACEHOLDER_IMAGE))
+
+
+# -----------------------
+# Static images (seafood.static_storage)
+# -----------------------
+
+_static_variants = None
+
+
+def _variants_of_static(path):
+    """Variant entry of a static image from collectstatic, or None (no variants, or not collected)."""
+    global _static_variants
+    if _static_variants is None:
+        load = getattr(staticfiles_storage, 'load_variants', None)
+        _static_variants = load() if load else {}
+    return _static_variants.get(path)
+
+
+def _static_srcset(entries):
+    return format_html_join(', ', '{} {}w', ((static(name), width) for name, width, _height in entries))
+
+
+@register.simple_tag
+def static_picture(path, alt='', sizes='100vw', css_class='', loading='lazy', fetchpriority='', style=''):
+    """
+    <picture> with the AVIF / WebP copies of a static image made at
+    collectstatic time, falling back to the original; a plain <img> when the
+    image has no copies (e.g. before collectstatic).
+    """
+    entry = _variants_of_static(path)
+    attrs = format_html(
+        'alt="{}" class="{}" loading="{}"{}{}', alt, css_class, loading,
+        format_html(' fetchpriority="{}"', fetchpriority) if fetchpriority else '',
+        format_html(' style="{}"', style) if style else '',
+    )
+    if not entry:
+        return format_html('<img src="{}" {}>', static(path), attrs)
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((fmt, _static_srcset(entry[fmt]), sizes) for fmt in ('avif', 'webp') if entry.get(fmt)),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" width="{}" height="{}" {}></picture>',
+        sources, static(path), entry['width'], entry['height'], attrs,
+    )
+
+
+@register.simple_tag
+def static_image_set(path, width=1600):
+    """
+    CSS `background-image` declarations for a static image: the original,
+    then an image-set() of its AVIF / WebP copies at most `width` wide for
+    browsers that support it.
+    """
+    declarations = format_html("background-image:url('{}')", static(path))
+    entry = _variants_of_static(path) or {}
+    candidates = []
+    for fmt in ('avif', 'webp'):
+        fitting = [e for e in entry.get(fmt, []) if e[1] <= int(width)] or entry.get(fmt, [])[:1]
+        if fitting:
+            candidates.append((static(fitting[-1][0]), fmt))
+    if not candidates:
+        return declarations
+    candidates.append((static(path), 'png' if path.lower().endswith('.png') else 'jpeg'))
+    image_set = format_html_join(', ', "url('{}') type('image/{}')", candidates)
+    return format_html('{};background-image:image-set({})', declarations, image_set)
@@ -1,16 +1,21 @@
+from decimal import Decimal
 from unittest.mock import patch
 
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
-from .models import EmailVerification
+from .money import Money
+from .models import EmailVerification, Category, SeafoodProduct, Order, OrderItem, ProductSalesRank
 from django.contrib.auth.models import User
 
 
 class RegistrationVerificationFlowTests(TestCase):
     @override_settings(SECURE_SSL_REDIRECT=False)
-    @patch('seafood.views.send_verification_email', return_value=False)
-    def test_registration_redirects_to_verification_page_when_email_fails(self, mock_send_email):
+    @patch('seafood.tasks.send_verification_email', return_value=False)
+    def test_registration_redirects_to_verification_page_and_queues_the_email(self, mock_send_email):
+        from django.utils import timezone
+        from .jobs import run_due
+        from .models import Job
         response = self.client.post(
             reverse('register'),
             {
@@ -24,7 +29,1328 @@ class RegistrationVerificationFlowTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertRedirects(response, reverse('verify_email'))
-        self.assertTrue(User.objects.filter(username='newuser123').exists())
-        self.assertTrue(EmailVerification.objects.filter(user__username='newuser123').exists())
-        self.assertContains(response, 'Акаунт створено, але лист з кодом не надійшов')
-        mock_send_email.assert_called_once()
+        user = User.objects.get(username='newuser123')
+        verification = EmailVerification.objects.get(user=user)
+        mock_send_email.assert_not_called()
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('email.verification', {'user_id': user.id}))
+
+        # the worker sends it; a failed send is retried later
+        with self.assertLogs('seafood.jobs', 'WARNING'):
+            self.assertEqual(run_due('test-worker'), 1)
+        mock_send_email.assert_called_once_with('user@example.com', verification.code)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('EmailNotSent', job.last_error)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.category = Category.objects.create(name='Ікра', slug='ikra')
+        self.product = SeafoodProduct.objects.create(name='Ікра кети', price_per_100g='280.00', package_size_grams=500)
+        self.product.categories.add(self.category)
+
+    def test_warm_catalog_page_hits_no_database(self):
+        url = reverse('products') + '?category=ikra&sort=price_asc'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Ікра кети')
+        self.assertContains(response, '1400.00')
+
+    def test_product_change_invalidates_cached_page(self):
+        url = reverse('products')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            SeafoodProduct.objects.create(name='Вугор копчений', price_per_100g='250.00')
+        self.assertContains(self.client.get(url), 'Вугор копчений')
+
+    def test_price_sort_uses_effective_price(self):
+        SeafoodProduct.objects.create(name='Шпроти', sold_in_units=True, price_per_unit='95.00')
+        SeafoodProduct.objects.create(name='Раки', price_per_100g='180.00')
+        response = self.client.get(reverse('products') + '?sort=price_asc&price_max=1000')
+        names = [p.name for p in response.context['products']]
+        self.assertEqual(names, ['Шпроти', 'Раки'])
+        self.assertEqual(SeafoodProduct.objects.get(pk=self.product.pk).effective_price, Decimal('1400.00'))
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_keyset_pages_cover_catalog_without_gaps(self):
+        for i in range(4):
+            SeafoodProduct.objects.create(name=f'Товар {i}', price_per_100g='100.00')
+        response = self.client.get(reverse('products') + '?sort=price_asc')
+        seen = [p.id for p in response.context['products']]
+        next_url = response.context['next_url']
+        while next_url:
+            fragment = self.client.get(next_url)
+            self.assertContains(fragment, 'product-card')
+            seen += [p.id for p in fragment.context['products']]
+            next_url = fragment.context['next_url']
+        expected = list(SeafoodProduct.objects.order_by('effective_price', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.eel = SeafoodProduct.objects.create(name='Вугор копчений', price_per_100g='250.00')
+        self.crab = SeafoodProduct.objects.create(name="М'ясо краба", description='Камчатський краб', price_per_100g='300.00')
+        self.roe = SeafoodProduct.objects.create(name='Ікра кети', description='Смачна з вугром', price_per_100g='280.00')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('products'), {'q': q, **params})
+        return [p.id for p in response.context['products']]
+
+    def test_latin_query_is_transliterated(self):
+        self.assertEqual(self.search('vugor'), [self.eel.id])
+        self.assertEqual(self.search('ikra'), [self.roe.id])
+
+    def test_prefix_casefold_and_apostrophes(self):
+        self.assertEqual(self.search('МЯСО КРАБ'), [self.crab.id])
+        self.assertEqual(self.search('мʼясо'), [self.crab.id])
+
+    def test_name_match_ranks_before_description_match(self):
+        self.assertEqual(self.search('вуг'), [self.eel.id, self.roe.id])
+        self.assertEqual(self.search('вуг', sort='price_desc'), [self.roe.id, self.eel.id])
+
+    def test_index_follows_category_changes(self):
+        category = Category.objects.create(name='Делікатеси', slug='delic')
+        self.eel.categories.add(category)
+        self.assertEqual(self.search('делікатес'), [self.eel.id])
+        category.name = 'Копченості'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertEqual(self.search('копченост'), [self.eel.id])
+        self.assertEqual(self.search('делікатес'), [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, CATALOG_PRICE_BUCKETS=(200, 500))
+class CatalogFacetTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.roe = Category.objects.create(name='Ікра', slug='ikra')
+        self.crab = Category.objects.create(name='Краби', slug='crab')
+        p = SeafoodProduct.objects.create(name='Ікра кети', price_per_100g='280.00')
+        p.categories.add(self.roe)
+        SeafoodProduct.objects.create(name='Ікра щуки', price_per_100g='120.00', in_stock=False, category=self.roe)
+        p = SeafoodProduct.objects.create(name='Краб', price_per_100g='900.00')
+        p.categories.add(self.crab, self.roe)
+
+    def test_facet_counts_are_disjunctive(self):
+        from .facets import compute_facets
+        facets = compute_facets(selected_category='ikra')
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(facets['in_stock'], 2)
+        self.assertEqual({c['slug']: c['count'] for c in facets['categories']}, {'ikra': 3, 'crab': 1})
+        self.assertEqual([b['count'] for b in facets['price_buckets']], [1, 1, 1])
+
+        facets = compute_facets(selected_category='crab', price_max=Decimal('499.99'), in_stock=True)
+        self.assertEqual(facets['total'], 0)
+        self.assertEqual({c['slug']: c['count'] for c in facets['categories']}, {'ikra': 1, 'crab': 0})
+        self.assertEqual([b['count'] for b in facets['price_buckets']], [0, 0, 1])
+
+    def test_facets_cost_two_queries_and_are_cached(self):
+        from .catalog import get_categories
+        from .facets import get_facets
+        get_categories()
+        with self.assertNumQueries(2):
+            get_facets()
+        with self.assertNumQueries(0):
+            get_facets()
+
+    def test_catalog_page_links_facets(self):
+        response = self.client.get(reverse('products'), {'category': 'ikra', 'sort': 'price_asc'})
+        self.assertEqual(response.context['selected_category_name'], 'Ікра')
+        stock = response.context['in_stock_facet']
+        self.assertEqual(stock['count'], 2)
+        response = self.client.get(stock['url'])
+        self.assertEqual([p.name for p in response.context['products']], ['Ікра кети', 'Краб'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BestsellerTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        self.roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00')
+        self.crab = SeafoodProduct.objects.create(name='Краб', price_per_100g='100.00')
+
+    def order(self, *lines, **fields):
+        order = Order.objects.create(full_name='Тест', phone='0500000000', **fields)
+        for product, grams in lines:
+            OrderItem.objects.create(order=order, product=product, quantity_g=grams, unit_price=product.price_per_100g)
+        return order
+
+    def test_record_order_updates_ranking_incrementally(self):
+        from .bestsellers import record_order, top_products
+        record_order(self.order((self.eel, 200), (self.roe, 100)))
+        record_order(self.order((self.roe, 200)))
+        self.assertEqual(top_products(), [self.roe, self.eel])
+        rank = ProductSalesRank.objects.get(product=self.roe)
+        self.assertEqual((rank.quantity_g, rank.revenue, rank.order_count), (300, Money(90000), 2))
+
+    def test_refresh_drops_sales_outside_window(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .bestsellers import refresh_rankings, top_products
+        self.order((self.crab, 5000), created_at=timezone.now() - timedelta(days=400))
+        self.order((self.eel, 100))
+        self.assertEqual(refresh_rankings(), 1)
+        self.assertEqual(top_products(), [self.eel])
+
+    def test_homepage_and_hits_page_use_ranking(self):
+        from .bestsellers import record_order
+        record_order(self.order((self.crab, 1000)))
+        response = self.client.get(reverse('homepage'))
+        hits = response.context['hits']
+        self.assertEqual(hits[0], self.crab)
+        self.assertTrue(hits[0].is_hit)
+        self.assertFalse(getattr(hits[1], 'is_hit', False))
+        response = self.client.get(reverse('products'), {'filter': 'hits'})
+        self.assertEqual([p.id for p in response.context['products']], [self.crab.id])
+
+    def test_new_order_refreshes_cached_hits_page(self):
+        from .bestsellers import record_order
+        with self.captureOnCommitCallbacks(execute=True):
+            record_order(self.order((self.crab, 1000)))
+        response = self.client.get(reverse('products'), {'filter': 'hits'})
+        self.assertEqual([p.id for p in response.context['products']], [self.crab.id])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('products'), {'filter': 'hits'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_order(self.order((self.eel, 1000)))
+        response = self.client.get(reverse('products'), {'filter': 'hits'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p.id for p in response.context['products']], [self.eel.id, self.crab.id])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        self.roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00')
+        self.crab = SeafoodProduct.objects.create(name='Краб', price_per_100g='100.00')
+        self.shrimp = SeafoodProduct.objects.create(name='Креветки', price_per_100g='90.00')
+        for products in [(self.eel, self.roe), (self.eel, self.roe), (self.eel, self.crab), (self.shrimp,)]:
+            order = Order.objects.create(full_name='Тест', phone='0500000000')
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity_g=100, unit_price=product.price_per_100g)
+
+    def test_rebuild_stores_ranked_neighbors(self):
+        from .models import ProductNeighbor
+        from .recommendations import rebuild_neighbors
+        self.assertEqual(rebuild_neighbors(), 4)
+        rows = list(ProductNeighbor.objects.filter(product=self.eel).values_list('neighbor_id', 'orders', 'rank'))
+        self.assertEqual(rows, [(self.roe.id, 2, 0), (self.crab.id, 1, 1)])
+        self.assertEqual(rebuild_neighbors(top_k=1), 3)
+
+    def test_pages_show_bought_together(self):
+        from .recommendations import rebuild_neighbors
+        rebuild_neighbors()
+        response = self.client.get(reverse('product_details', args=[self.roe.id]))
+        self.assertEqual([p.id for p in response.context['bought_together']], [self.eel.id])
+
+        session = self.client.session
+        session['cart'] = {str(self.eel.id): {'name': 'Вугор', 'price_per_100g': '250.00', 'quantity': 1}}
+        session.save()
+        response = self.client.get(reverse('cart'))
+        recommended = response.context['products']
+        self.assertEqual(recommended[:2], [self.roe, self.crab])
+        self.assertNotIn(self.eel, recommended)
+        self.assertIn(self.shrimp, recommended)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user('buyer', password='Qwerty123!')
+        self.admin = User.objects.create_user('VugriUa', password='Qwerty123!')
+        self.eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        self.roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00')
+
+    def review(self, product, rating):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('submit_review', args=[product.id]), {'rating': rating})
+        self.assertEqual(response.status_code, 200)
+
+    def test_submit_and_delete_keep_counters_in_step(self):
+        from .models import Review
+        self.review(self.eel, 5)
+        self.review(self.eel, 4)
+        self.eel.refresh_from_db()
+        self.assertEqual((self.eel.review_count, self.eel.rating_sum, self.eel.rating_avg), (2, 9, Decimal('4.50')))
+
+        self.client.force_login(self.admin)
+        review = Review.objects.get(product=self.eel, rating=5)
+        self.client.post(reverse('delete_review', args=[review.id]))
+        self.eel.refresh_from_db()
+        self.assertEqual((self.eel.review_count, self.eel.rating_sum, self.eel.rating_avg), (1, 4, Decimal('4.00')))
+
+    def test_deleting_a_review_twice_adjusts_counters_once(self):
+        from .models import Review
+        from .reviews import delete_review
+        self.review(self.eel, 5)
+        self.review(self.eel, 4)
+        review = Review.objects.get(product=self.eel, rating=5)
+        stale = Review.objects.get(pk=review.pk)  # e.g. a second request that loaded it too
+        delete_review(review)
+        delete_review(stale)
+        self.eel.refresh_from_db()
+        self.assertEqual((self.eel.review_count, self.eel.rating_sum), (1, 4))
+
+    def test_rating_sort_and_reconcile(self):
+        from .models import Review
+        from .reviews import reconcile_ratings
+        self.review(self.roe, 3)
+        Review.objects.create(user=self.user, product=self.eel, rating=5)  # bypasses the counters
+        self.assertEqual(reconcile_ratings(), 1)
+        self.assertEqual(reconcile_ratings(), 0)
+        response = self.client.get(reverse('products'), {'sort': 'rating'})
+        self.assertEqual([p.name for p in response.context['products']], ['Вугор', 'Ікра'])
+        self.assertContains(response, 'width:100%')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, REVIEWS_PAGE_SIZE=2)
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from .models import Review
+        user = User.objects.create_user('buyer', password='Qwerty123!')
+        self.product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        now = timezone.now()
+        # two reviews share a timestamp so the id tie-breaker matters
+        self.reviews = [
+            Review.objects.create(user=user, product=self.product, rating=5, comment=f'Відгук {i}')
+            for i in range(5)
+        ]
+        for i, r in enumerate(self.reviews):
+            Review.objects.filter(pk=r.pk).update(created_at=now - timezone.timedelta(minutes=min(i, 3)))
+
+    def test_first_page_rendered_rest_lazy_loaded(self):
+        response = self.client.get(reverse('product_details', args=[self.product.id]))
+        seen = [r.id for r in response.context['reviews']]
+        self.assertEqual(len(seen), 2)
+        next_url = response.context['reviews_next_url']
+        while next_url:
+            fragment = self.client.get(next_url)
+            self.assertContains(fragment, 'review-card')
+            seen += [r.id for r in fragment.context['reviews']]
+            next_url = fragment.context['next_url']
+        # newest first; reviews 3 and 4 tie on created_at and fall back to -id
+        expected = [self.reviews[i].id for i in (0, 1, 2, 4, 3)]
+        self.assertEqual(seen, expected)
+
+    def test_no_js_link_pages_through_the_product_page(self):
+        import re
+        response = self.client.get(reverse('product_details', args=[self.product.id]))
+        seen = [r.id for r in response.context['reviews']]
+        while response.context['reviews_next_url']:
+            self.assertContains(response, 'data-next-url="{}"'.format(response.context['reviews_next_url']))
+            href = re.search(r'<a href="([^"]+)#reviews"[^>]*>Показати ще відгуки', response.content.decode()).group(1)
+            self.assertTrue(href.startswith(reverse('product_details', args=[self.product.id]) + '?cursor='))
+            response = self.client.get(href.replace('&amp;', '&'))
+            self.assertEqual(response.status_code, 200)
+            seen += [r.id for r in response.context['reviews']]
+        self.assertEqual(seen, [self.reviews[i].id for i in (0, 1, 2, 4, 3)])
+        self.assertNotContains(response, 'Показати ще відгуки')
+
+    def test_json_format(self):
+        data = self.client.get(reverse('product_reviews', args=[self.product.id]), {'format': 'json'}).json()
+        self.assertEqual([r['comment'] for r in data['reviews']], ['Відгук 0', 'Відгук 1'])
+        data = self.client.get(data['next_url']).json()
+        self.assertEqual([r['comment'] for r in data['reviews']], ['Відгук 2', 'Відгук 4'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+
+    def test_catalog_revalidates_without_queries(self):
+        response = self.client.get(reverse('products'))
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price_per_100g = Decimal('300.00')
+            self.product.save()
+        response = self.client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_page_follows_updated_at(self):
+        from .models import ProductImage
+        url = reverse('product_details', args=[self.product.id])
+        self.client.get(url)  # first visit sets the CSRF cookie, which is part of the validator
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ProductImage.objects.create(product=self.product, image='products/eel.jpg')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_viewer_gets_own_validator(self):
+        from .models import Favorite
+        anonymous = self.client.get(reverse('homepage'))['ETag']
+        user = User.objects.create_user('buyer', password='Qwerty123!')
+        self.client.force_login(user)
+        response = self.client.get(reverse('homepage'))
+        self.assertNotEqual(response['ETag'], anonymous)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=user, product=self.product)
+        response = self.client.get(reverse('homepage'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ProductPageDocumentTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.category = Category.objects.create(name='Вугор', slug='eel')
+        self.product = SeafoodProduct.objects.create(
+            name='Вугор копчений', price_per_100g='250.00', package_size_grams=500,
+            youtube_url='https://youtu.be/dQw4w9WgXcQ',
+        )
+        self.product.categories.add(self.category)
+
+    def test_document_built_once_and_rebuilt_on_change(self):
+        from .models import Favorite
+        url = reverse('product_details', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertEqual(response.context['package_price'], '1250.00')
+        self.assertEqual(response.context['product'].categories, [{'name': 'Вугор', 'slug': 'eel'}])
+        video = response.context['images'][-1]
+        self.assertTrue(video['is_video'])
+        self.assertEqual(response.context['youtube_id'], 'dQw4w9WgXcQ')
+        self.assertIn('/embed/dQw4w9WgXcQ', video['embed_url'])
+
+        user = User.objects.create_user('buyer', password='Qwerty123!')
+        Favorite.objects.create(user=user, product=self.product)
+        self.client.force_login(user)
+        self.client.get(url)
+        # session, user, the ETag's updated_at lookup and the favorite; the document comes from cache
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertTrue(response.context['is_favorited'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Вугор гарячого копчення'
+            self.product.save()
+        self.assertEqual(self.client.get(url).context['product'].name, 'Вугор гарячого копчення')
+
+    def test_document_survives_changes_to_other_products(self):
+        from unittest.mock import patch
+        from . import product_page
+        url = reverse('product_details', args=[self.product.id])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00')
+        with patch.object(product_page, 'build_document', wraps=product_page.build_document) as build:
+            self.client.get(url)
+            build.assert_not_called()
+
+            # a renamed category is part of this page
+            with self.captureOnCommitCallbacks(execute=True):
+                self.category.name = 'Вугор річковий'
+                self.category.save()
+            response = self.client.get(url)
+            self.assertEqual(build.call_count, 1)
+        self.assertEqual(response.context['product'].categories, [{'name': 'Вугор річковий', 'slug': 'eel'}])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.core.cache import cache
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _upload(self, width, height, name='eel.png'):
+        import io
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        buffer = io.BytesIO()
+        Image.new('RGBA', (width, height), (200, 80, 40, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_variants_generated_on_save_without_upscaling(self):
+        from .jobs import run_due
+        from .models import ImageDerivative, Job
+        product = SeafoodProduct.objects.create(
+            name='Вугор', price_per_100g='250.00', image=self._upload(600, 400),
+        )
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('images.derive', {'source': product.image.name}))
+        self.assertEqual(run_due('test-worker'), 1)
+        rows = ImageDerivative.objects.filter(source=product.image.name)
+        # the original is 600px wide, so `full` is kept at 600 rather than upscaled to 1200
+        self.assertEqual(
+            sorted(rows.values_list('variant', 'format', 'width')),
+            [('card', 'jpeg', 480), ('card', 'webp', 480), ('full', 'jpeg', 600), ('full', 'webp', 600),
+             ('thumb', 'jpeg', 160), ('thumb', 'webp', 160)],
+        )
+        self.assertTrue(all(row.size for row in rows))
+        product.refresh_from_db()
+        self.assertTrue(product.image_lqip.startswith('data:image/webp;base64,'))
+        self.assertLess(len(product.image_lqip), 600)
+
+        response = self.client.get(reverse('products'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '.card.jpg')
+        self.assertContains(response, 'background:url(data:image/webp;base64,')
+
+        # saving again with the same image queues nothing
+        product.save()
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_replaced_image_loses_its_derivatives(self):
+        import os
+        from django.core.files.storage import default_storage
+        from .jobs import run_due
+        from .models import ImageDerivative
+        product = SeafoodProduct.objects.create(
+            name='Вугор', price_per_100g='250.00', image=self._upload(600, 400),
+        )
+        run_due('test-worker')
+        old = product.image.name
+        old_files = list(ImageDerivative.objects.filter(source=old).values_list('name', flat=True))
+        self.assertTrue(old_files)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self._upload(300, 300, 'roe.png')
+            product.save()
+        self.assertFalse(ImageDerivative.objects.filter(source=old).exists())
+        self.assertFalse(any(os.path.exists(default_storage.path(name)) for name in old_files))
+        run_due('test-worker')
+        self.assertTrue(ImageDerivative.objects.filter(source=product.image.name).exists())
+
+    def test_undecodable_image_is_not_queued_again(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .jobs import run_due
+        from .models import Job
+        product = SeafoodProduct.objects.create(
+            name='Вугор', price_per_100g='250.00', image=SimpleUploadedFile('eel.png', b'not an image'),
+        )
+        with self.assertLogs('seafood.images', 'WARNING'):
+            run_due('test-worker')
+        product.save()
+        product.save()
+        self.assertEqual(Job.objects.count(), 1)
+
+        # a new upload is a new name and gets its own attempt
+        product.image = self._upload(300, 300, 'roe.png')
+        product.save()
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+
+    def test_picture_tag_falls_back_to_plain_img(self):
+        from django.template import Context, Template
+        from types import SimpleNamespace
+        html = Template('{% load image_tags %}{% picture image alt="Ікра" %}').render(
+            Context({'image': SimpleNamespace(url='/media/x.jpg', variants=None)})
+        )
+        self.assertTrue(html.startswith('<img src="/media/x.jpg"'))
+        self.assertNotIn('<picture>', html)
+
+
+class OptimizeMediaCommandTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.manifest = self.media_root + '-manifest.json'
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_MANIFEST=self.manifest)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _jpeg_with_exif(self):
+        import io
+        from PIL import Image
+        image = Image.effect_noise((800, 600), 60).convert('RGB')
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'  # Make
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=98, exif=exif.tobytes())
+        return buffer.getvalue()
+
+    def test_recompresses_strips_exif_and_skips_on_rerun(self):
+        import os
+        from io import StringIO
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .models import ImageDerivative
+
+        # an upload from before content-addressed storage
+        path = os.path.join(self.media_root, 'products', 'eel.jpg')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(self._jpeg_with_exif())
+        product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00', image='products/eel.jpg')
+        before = os.path.getsize(path)
+
+        out = StringIO()
+        call_command('optimize_media', workers=2, stdout=out)
+        self.assertIn('Processed 1 files', out.getvalue())
+        self.assertLess(os.path.getsize(path), before)
+        self.assertNotIn('exif', Image.open(path).info)
+        self.assertEqual(ImageDerivative.objects.filter(source=product.image.name).count(), 6)
+        product.refresh_from_db()
+        self.assertTrue(product.image_lqip)
+        self.assertTrue(os.path.exists(self.manifest))
+
+        out = StringIO()
+        call_command('optimize_media', workers=2, stdout=out)
+        self.assertIn('Processed 0 files (1 unchanged', out.getvalue())
+
+    def test_blobs_are_never_reencoded(self):
+        import hashlib
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import CommandError, call_command
+        from .models import Job, StoredBlob
+
+        product = SeafoodProduct(name='Вугор', price_per_100g='250.00')
+        product.image.save('eel.jpg', ContentFile(self._jpeg_with_exif()))
+        Job.objects.all().delete()
+        out = StringIO()
+        call_command('optimize_media', workers=1, stdout=out)
+        self.assertIn('Processed 0 files', out.getvalue())
+        with product.image.open('rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), StoredBlob.objects.get().digest)
+        # derivatives of blobs come from the job queue instead
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), [{'source': product.image.name}])
+
+        with self.assertRaises(CommandError):
+            call_command('optimize_media', exclude=['receipts'], stdout=StringIO())
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_identical_uploads_share_one_refcounted_blob(self):
+        import os
+        from django.core.files.base import ContentFile
+        from .models import ProductImage, StoredBlob
+        product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        first = ProductImage(product=product)
+        first.image.save('Вугор 1.JPG', ContentFile(b'same bytes'))
+        second = ProductImage(product=product)
+        second.image.save('copy/eel.JPG', ContentFile(b'same bytes'))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/') and first.image.name.endswith('.jpg'))
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+
+        path = first.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(StoredBlob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_last_release_removes_derivatives(self):
+        import io
+        import os
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from .jobs import run_due
+        from .models import ImageDerivative, ProductImage
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), (200, 90, 40)).save(buffer, 'JPEG')
+        product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        image = ProductImage(product=product)
+        image.image.save('eel.jpg', ContentFile(buffer.getvalue()))
+        run_due('test-worker')
+        names = list(ImageDerivative.objects.values_list('name', flat=True))
+        self.assertTrue(names)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(ImageDerivative.objects.exists())
+        self.assertFalse(any(os.path.exists(default_storage.path(name)) for name in names))
+
+    def test_upload_replaces_a_blob_being_released(self):
+        import os
+        from django.core.files.base import ContentFile
+        from .models import ProductImage, StoredBlob
+        product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        first = ProductImage(product=product)
+        first.image.save('eel.jpg', ContentFile(b'same bytes'))
+        dying = StoredBlob.objects.get()
+        # a release has taken the last reference but not deleted the blob yet
+        ProductImage.objects.filter(pk=first.pk).delete()
+        StoredBlob.objects.filter(pk=dying.pk).update(refcount=0)
+
+        second = ProductImage(product=product)
+        second.image.save('eel.jpg', ContentFile(b'same bytes'))
+        blob = StoredBlob.objects.get()
+        self.assertNotEqual(blob.pk, dying.pk)
+        self.assertEqual((blob.name, blob.refcount), (second.image.name, 1))
+        # the rest of that release only deletes rows still at zero references
+        self.assertEqual(StoredBlob.objects.filter(name=blob.name, refcount__lte=0).count(), 0)
+        self.assertTrue(os.path.exists(second.image.path))
+
+    def test_unclaimed_upload_references_never_undercount(self):
+        from django.core.files.base import ContentFile
+        from django.db import transaction
+        from .models import ProductImage, StoredBlob
+        from .storage import upload_storage
+        product = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+
+        # the row save fails after the file was stored: both the reference and its claim roll back
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            ProductImage(product=product).image.save('eel.jpg', ContentFile(b'rolled back'))
+            raise RuntimeError
+        first = ProductImage(product=product)
+        first.image.save('eel.jpg', ContentFile(b'rolled back'))
+        self.assertEqual(StoredBlob.objects.values_list('refcount', 'pending').get(), (1, 0))
+
+        # a script stores a file without a row; a row using the blob later claims that reference
+        name = upload_storage().save('eel.jpg', ContentFile(b'rolled back'))
+        self.assertEqual(StoredBlob.objects.values_list('refcount', 'pending').get(), (2, 1))
+        ProductImage.objects.create(product=product, image=name)
+        ProductImage.objects.create(product=product, image=name)
+        self.assertEqual(StoredBlob.objects.values_list('refcount', 'pending').get(), (3, 0))
+        self.assertEqual(ProductImage.objects.filter(image=name).count(), 3)
+
+    def test_dedupe_media_collapses_existing_copies(self):
+        import os
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ProductImage, StoredBlob
+        for name in ('products/images/eel.jpg', 'products/2026/01/eel.jpg'):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'legacy bytes')
+        product = SeafoodProduct.objects.create(
+            name='Вугор', price_per_100g='250.00', image='products/images/eel.jpg',
+        )
+        ProductImage.objects.create(product=product, image='products/2026/01/eel.jpg')
+
+        call_command('dedupe_media', stdout=StringIO())
+        product.refresh_from_db()
+        blob = StoredBlob.objects.get()
+        self.assertEqual(product.image.name, blob.name)
+        self.assertEqual(ProductImage.objects.get().image.name, blob.name)
+        self.assertEqual(blob.refcount, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'products/images/eel.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'products/2026/01/eel.jpg')))
+        with open(product.image.path, 'rb') as f:
+            self.assertEqual(f.read(), b'legacy bytes')
+
+
+class StaticImageVariantsTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.source = tempfile.mkdtemp()
+        self.static_root = tempfile.mkdtemp()
+        for path in (self.source, self.static_root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+
+    def test_ascii_name_keeps_hash(self):
+        from .static_storage import ascii_name
+        self.assertEqual(
+            ascii_name('images/вугор головна.5a3c2d1e0f12.jpg'), 'images/vuhor-holovna.5a3c2d1e0f12.jpg',
+        )
+        self.assertEqual(ascii_name('images/png/banner.png'), 'images/png/banner.png')
+
+    def test_collectstatic_writes_hashed_ascii_variants(self):
+        import json
+        import os
+        from io import StringIO
+        from PIL import Image
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        from django.core.management import call_command
+        from django.template import Context, Template
+        from django.utils.functional import empty
+        from .templatetags import image_tags
+
+        os.makedirs(os.path.join(self.source, 'images'))
+        Image.new('RGB', (1000, 500), (200, 80, 40)).save(os.path.join(self.source, 'images', 'вугор головна.jpg'))
+        with override_settings(
+            STATICFILES_DIRS=[self.source], STATIC_ROOT=self.static_root, STATIC_IMAGE_WIDTHS=(480, 1600),
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+            staticfiles_storage._wrapped = empty
+            image_tags._static_variants = None
+            self.addCleanup(setattr, image_tags, '_static_variants', None)
+
+            with open(os.path.join(self.static_root, 'staticfiles-variants.json'), encoding='utf-8') as f:
+                entry = json.load(f)['images/вугор головна.jpg']
+            # 1600 would upscale the 1000px original, so it is capped at the original width
+            self.assertEqual([width for _name, width, _height in entry['webp']], [480, 1000])
+            self.assertEqual(entry['webp'][0][0], 'images/opt/vuhor-holovna-480.webp')
+
+            url = staticfiles_storage.url('images/вугор головна.jpg')
+            self.assertRegex(url, r'^/static/images/vuhor-holovna\.[0-9a-f]{12}\.jpg$')
+            html = Template(
+                "{% load image_tags %}{% static_picture 'images/вугор головна.jpg' alt='Вугор' loading='eager' %}"
+            ).render(Context())
+            self.assertIn('<source type="image/webp"', html)
+            self.assertRegex(html, r'/static/images/opt/vuhor-holovna-480\.[0-9a-f]{12}\.webp 480w')
+            self.assertIn('width="1000" height="500"', html)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReceiptUploadTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from .models import Conversation
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, RECEIPT_MAX_UPLOAD_SIZE=200 * 1024)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user('buyer', password='pw12345!')
+        self.conv = Conversation.objects.create()
+        self.conv.participants.add(self.user)
+        self.client.force_login(self.user)
+
+    def _post(self, name, data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.client.post(
+            reverse('chat', args=[self.conv.id]), {'receipt': SimpleUploadedFile(name, data)},
+            headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+
+    def _image(self, size, fmt='PNG', noise=False):
+        import io
+        from PIL import Image
+        image = Image.effect_noise(size, 80).convert('RGB') if noise else Image.new('RGB', size, (240, 240, 240))
+        buffer = io.BytesIO()
+        image.save(buffer, fmt)
+        return buffer.getvalue()
+
+    def test_receipt_is_stored_aside_and_downscaled(self):
+        from PIL import Image
+        from .jobs import run_due
+        from .models import Job, Message
+
+        response = self._post('receipt.png', self._image((3200, 1200)))
+        self.assertEqual(response.json(), {'ok': True})
+        message = Message.objects.get(conversation=self.conv, sender=self.user)
+        self.assertTrue(message.original_image.name.startswith('receipts/originals/'))
+        self.assertFalse(message.image)
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('receipts.process', {'message_id': message.pk}))
+
+        self.assertEqual(run_due('test-worker'), 1)
+        message.refresh_from_db()
+        with Image.open(message.image.path) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (1600, 600)))
+
+    def test_reprocess_command_queues_receipts_without_a_jpeg(self):
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .jobs import run_due
+        from .models import Job, Message
+        lost = Message(conversation=self.conv, sender=self.user, text='[Квитанція]')
+        lost.original_image.save('lost.png', ContentFile(self._image((200, 100))))
+        Message.objects.create(conversation=self.conv, sender=self.user, text='Привіт')
+
+        call_command('reprocess_receipts', stdout=StringIO())
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), [{'message_id': lost.pk}])
+        run_due('test-worker')
+        lost.refresh_from_db()
+        self.assertTrue(lost.image.name.endswith('.jpg'))
+        call_command('reprocess_receipts', stdout=StringIO())
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_oversized_and_non_image_uploads_are_rejected_unstored(self):
+        import os
+        from .models import Message
+        response = self._post('receipt.jpg', self._image((800, 800), 'JPEG', noise=True))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('завеликий', response.json()['error'])
+
+        response = self._post('receipt.png', b'%PDF-1.4 definitely not an image' * 10)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JPEG, PNG або WebP', response.json()['error'])
+
+        with override_settings(RECEIPT_MAX_PIXELS=100 * 100):
+            response = self._post('receipt.png', self._image((200, 200)))
+        self.assertEqual(response.status_code, 400)
+
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(list(os.walk(self.media_root))[0][1:], ([], []))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MediaDeliveryTests(TestCase):
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        from .models import Conversation, Message
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL='')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = bytes(range(256)) * 4
+        for name in ('blobs/ab/abc.jpg', 'products/eel.jpg', 'receipts/2026/10/r.jpg'):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(self.data)
+        self.buyer = User.objects.create_user('buyer', password='pw12345!')
+        conv = Conversation.objects.create()
+        conv.participants.add(self.buyer)
+        Message.objects.create(conversation=conv, sender=self.buyer, text='[Квитанція]', image='receipts/2026/10/r.jpg')
+
+    def test_public_files_cache_headers_and_ranges(self):
+        response = self.client.get('/media/blobs/ab/abc.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertNotIn('immutable', self.client.get('/media/products/eel.jpg')['Cache-Control'])
+
+        response = self.client.get('/media/products/eel.jpg', headers={'range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        response = self.client.get('/media/products/eel.jpg', headers={'range': 'bytes=-4'})
+        self.assertEqual(b''.join(response.streaming_content), self.data[-4:])
+        response = self.client.get('/media/products/eel.jpg', headers={'range': 'bytes=5000-'})
+        self.assertEqual(response.status_code, 416)
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/media/products/eel.jpg', headers={'if-none-match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/media/../db.sqlite3').status_code, 404)
+
+    def test_receipts_only_for_participants_and_staff(self):
+        url = '/media/receipts/2026/10/r.jpg'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        User.objects.create_user('other', password='pw12345!')
+        self.client.login(username='other', password='pw12345!')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.buyer)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.client.force_login(User.objects.create_user('staff', password='pw12345!', is_staff=True))
+        with override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/receipts/2026/10/r.jpg')
+        self.assertEqual(response.content, b'')
+
+    def test_receipts_cannot_be_reached_through_unnormalized_paths(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import Http404
+        from django.test import RequestFactory
+        from .media_delivery import serve_media
+        for path in ('./receipts/2026/10/r.jpg', 'products/../receipts/2026/10/r.jpg', 'receipts//2026/10/r.jpg'):
+            request = RequestFactory().get('/media/' + path)
+            request.user = AnonymousUser()
+            with self.subTest(path=path), self.assertRaises(Http404):
+                serve_media(request, path)
+        request = RequestFactory().get('/media/receipts/./2026/10/r.jpg')
+        request.user = self.buyer
+        response = serve_media(request, 'receipts/./2026/10/r.jpg')
+        self.assertIn('private', response['Cache-Control'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CartTests(TestCase):
+    def setUp(self):
+        self.eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        self.roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00', package_size_grams=500)
+        self.user = User.objects.create_user('buyer', password='pw12345!')
+
+    def test_lines_are_single_rows_priced_from_products(self):
+        from .models import CartItem
+        self.client.force_login(self.user)
+        for product, quantity in ((self.eel, 2), (self.eel, 1), (self.roe, 1)):
+            response = self.client.post(reverse('add_to_cart'), {'product_id': product.id, 'quantity': quantity, 'price': 1})
+        self.assertEqual(response.json()['cart_count'], 4)
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('product_id', 'quantity')), [(self.eel.id, 3), (self.roe.id, 1)],
+        )
+
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['totals'], {'UAH': '2250.00'})  # 3 × 250 + 1 × 1500
+
+        response = self.client.post(reverse('update_cart_item'), {'product_id': self.eel.id, 'quantity': 0})
+        self.assertEqual(response.json()['totals'], {'UAH': '1500.00'})
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_anonymous_cart_merges_on_login(self):
+        from . import cart as carts
+        from .models import Cart, CartItem
+        user_cart = Cart.objects.create(user=self.user)
+        carts.add(user_cart, self.eel.id, 1)
+        anonymous = Cart.objects.create(session_key='a' * 32)
+        carts.add(anonymous, self.eel.id, 2)
+        carts.add(anonymous, self.roe.id, 1)
+        session = self.client.session
+        session[carts.CART_SESSION_KEY] = anonymous.session_key
+        session.save()
+
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'pw12345!'})
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart=user_cart).values_list('product_id', 'quantity')),
+            [(self.eel.id, 3), (self.roe.id, 1)],
+        )
+
+
+class PricingTests(TestCase):
+    def test_all_modes_priced_in_one_query(self):
+        from .pricing import PACKAGE, UNIT, WEIGHT, price_items
+        eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='250.00')
+        roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00', package_size_grams=250)
+        can = SeafoodProduct.objects.create(name='Консерва', sold_in_units=True, price_per_unit='99.90')
+        with self.assertNumQueries(1):
+            priced = price_items([(eel.id, 3), (roe.id, 2), (can.id, 1), (999999, 1), (eel.id, 0)])
+        self.assertEqual([(line.mode, line.grams) for line in priced.lines], [(WEIGHT, 300), (PACKAGE, 500), (UNIT, None)])
+        self.assertEqual([line.total for line in priced.lines], [Money(75000), Money(150000), Money(9990)])
+        self.assertEqual(priced.totals_display(), {'UAH': '2349.90'})
+        self.assertEqual(priced.count, 6)
+
+
+class MoneyTests(TestCase):
+    def test_single_rounding_point_and_integer_arithmetic(self):
+        self.assertEqual(Money.of('12.345'), Money(1235))
+        self.assertEqual(Money.of(Decimal('0.005')), Money(1))
+        self.assertEqual(Money.of('7,5'), Money(750))
+        self.assertEqual(Money(1999).scale(250, 100), Money(4998))  # 49.975 -> 49.98
+        total = sum([Money(1999) * 3, Money(1)], Money(0))
+        self.assertIsInstance(total, Money)
+        self.assertEqual((str(total), format(total, '.1f'), int(total)), ('59.98', '60.0', 5998))
+        self.assertEqual(str(Money(-5)), '-0.05')
+
+    def test_order_amounts_are_stored_in_kopiyky(self):
+        eel = SeafoodProduct.objects.create(name='Вугор', price_per_100g='199.99')
+        order = Order.objects.create(full_name='Тест', phone='0500000000')
+        OrderItem.objects.create(order=order, product=eel, quantity_g=250, unit_price=eel.price_per_100g)
+        order.recalc_totals()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Money(49998))
+        self.assertEqual(Order.objects.filter(total_price__gt='499.97').count(), 1)
+        item = OrderItem.objects.values_list('unit_price', 'total_price').get()
+        self.assertEqual(item, (Money(19999), Money(49998)))
+
+
+class MoneyMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        executor = MigrationExecutor(connection)
+        executor.migrate([('seafood', target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state([('seafood', target)]).apps
+
+    def tearDown(self):
+        from django.db.migrations.loader import MigrationLoader
+        latest = max(name for app, name in MigrationLoader(None).graph.leaf_nodes() if app == 'seafood')
+        self.migrate(latest)
+
+    def test_hryvnias_convert_to_exact_kopiyky(self):
+        old = self.migrate('0032_cart')
+        OldOrder = old.get_model('seafood', 'Order')
+        OldItem = old.get_model('seafood', 'OrderItem')
+        order = OldOrder.objects.create(full_name='Тест', phone='0500000000', total_price=Decimal('19.99'))
+        OldItem.objects.create(order=order, quantity_g=100, unit_price=Decimal('0.29'), total_price=Decimal('0.29'))
+
+        self.migrate('0033_money_minor_units')
+        self.assertEqual(Order.objects.values_list('total_price', flat=True).get(), Money(1999))
+        self.assertEqual(OrderItem.objects.values_list('unit_price', 'total_price').get(), (Money(29), Money(29)))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OrderPlacementTests(TestCase):
+    FORM = {
+        'delivery_type': 'nova_branch', 'postal': '01001', 'region': 'Київська', 'city': 'Київ',
+        'branch': '1', 'first_name': 'Ім', 'last_name': 'Пр', 'middle_name': 'По',
+        'email': 'buyer@example.com', 'phone': '0500000000', 'payment_method': 'card',
+    }
+
+    def setUp(self):
+        self.buyer = User.objects.create_user('buyer', password='pw12345!')
+        self.products = [
+            SeafoodProduct.objects.create(name='Товар {}'.format(i), price_per_100g='{}.50'.format(100 + i))
+            for i in range(5)
+        ]
+
+    def place(self, count):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .orders import OrderLine, place_order
+        lines = [OrderLine(product, 200, Money.of(product.price_per_100g)) for product in self.products[:count]]
+        with CaptureQueriesContext(connection) as queries:
+            placed = place_order(lines, user=self.buyer, full_name='Тест', phone='0500000000', payment_method='card')
+        return placed, len(queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        self.place(1)  # the seller account and the first rank rows exist from here on
+        _placed, one_line = self.place(1)
+        placed, five_lines = self.place(5)
+        self.assertEqual(one_line, five_lines)
+
+        order = Order.objects.get(pk=placed.order.pk)
+        self.assertEqual(order.quantity_g, 1000)
+        self.assertEqual(order.total_price, Money(2 * (10050 + 10150 + 10250 + 10350 + 10450)))
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(set(placed.conversation.participants.all()), {self.buyer, placed.seller})
+        texts = list(placed.conversation.messages.values_list('text', flat=True))
+        self.assertEqual(len(texts), 2)
+        self.assertIn('- Товар 4: 200 г — 209.00 грн', texts[0])
+        self.assertIn('Сума: {}'.format(order.total_price), texts[1])
+
+    def test_failed_placement_leaves_nothing_behind(self):
+        from .models import CartItem, Conversation
+        self.client.login(username='buyer', password='pw12345!')
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].id, 'quantity': 1})
+        form = self.FORM
+        with patch('seafood.orders.Message.objects.bulk_create', side_effect=RuntimeError), \
+                self.assertLogs('django.request', 'ERROR'), self.assertRaises(RuntimeError):
+            self.client.post(reverse('submit_order'), form)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Conversation.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 1)
+
+        response = self.client.post(reverse('submit_order'), form)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('order_complete', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual(order.total_price, Money(10050))
+        self.assertEqual(CartItem.objects.count(), 0)
+
+    def test_replayed_submission_returns_the_placed_order(self):
+        from .models import Conversation, Job, Message
+        self.client.login(username='buyer', password='pw12345!')
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].id, 'quantity': 2})
+        key = self.client.get(reverse('order_form', args=[self.products[0].id])).context['submission_key']
+        form = dict(self.FORM, submission_key=key, product_id=self.products[0].id)
+
+        first = self.client.post(reverse('submit_order'), form)
+        queued = Job.objects.filter(name='email.send').count()
+        with self.assertNumQueries(1):  # only the key lookup
+            second = self.client.post(reverse('submit_order'), form)
+        order = Order.objects.get()
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(order.idempotency_key, key)
+        self.assertEqual((Conversation.objects.count(), Message.objects.count()), (1, 2))
+        self.assertGreater(queued, 0)
+        self.assertEqual(Job.objects.filter(name='email.send').count(), queued)
+
+    def test_single_product_orders_are_priced_like_cart_lines(self):
+        from .models import OrderItem
+        can = SeafoodProduct.objects.create(name='Консерва', sold_in_units=True, price_per_unit='99.90')
+        roe = SeafoodProduct.objects.create(name='Ікра', price_per_100g='300.00', package_size_grams=250)
+        self.client.login(username='buyer', password='pw12345!')
+
+        self.client.post(reverse('submit_order'), dict(self.FORM, product_id=can.id, quantity=3))
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Money(29970))
+        self.assertEqual(OrderItem.objects.get(order=order).unit_price, Money(9990))
+
+        # a quantity is a number of steps (here packages), never guessed to be grams
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.test import RequestFactory
+        from .views import checkout_view
+        request = RequestFactory().post(
+            '/checkout/?product_id={}&quantity=150'.format(roe.id),
+            {'full_name': 'Тест', 'phone': '0500000000', 'agree': '1'},
+        )
+        request.user, request.session = self.buyer, SessionStore()
+        with patch('seafood.views.reverse', return_value='/done/'):  # the legacy checkout is not routed
+            self.assertEqual(checkout_view(request).status_code, 302)
+        last = request.session['last_order']
+        self.assertEqual((last['items'][0]['quantity'], last['total']), (150, str(Money(75000) * 150)))
+
+    def test_concurrent_duplicate_loses_on_the_unique_key(self):
+        self.client.login(username='buyer', password='pw12345!')
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].id, 'quantity': 1})
+        placed = Order.objects.create(full_name='Тест', phone='0500000000', idempotency_key='k' * 32)
+        with patch('seafood.orders.submitted_order', side_effect=[None, placed.pk]):
+            response = self.client.post(reverse('submit_order'), dict(self.FORM, submission_key='k' * 32))
+        self.assertRedirects(response, reverse('order_complete', args=[placed.pk]), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        from . import jobs
+        self.calls = []
+        jobs.task('test.record')(lambda **payload: self.calls.append(payload))
+        jobs.task('test.fail')(lambda **payload: 1 / 0)
+        self.addCleanup(jobs._tasks.pop, 'test.record')
+        self.addCleanup(jobs._tasks.pop, 'test.fail')
+
+    def test_a_claimed_job_is_leased_to_one_worker_until_the_lease_expires(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .jobs import claim, enqueue
+        from .models import Job
+        job = enqueue('test.record', value=1)
+        later = enqueue('test.record', run_at=timezone.now() + timedelta(hours=1), value=2)
+
+        self.assertEqual(claim('a'), [job])
+        self.assertEqual(claim('b'), [])
+        # worker "a" died: its lease runs out and the job is claimed again
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim('b')
+        self.assertEqual([(j.pk, j.locked_by, j.attempts) for j in reclaimed], [(job.pk, 'b', 2)])
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.PENDING)
+
+    @override_settings(JOBS_RETRY_BASE_SECONDS=0)
+    def test_failures_retry_with_backoff_then_stop(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .jobs import enqueue, retry_delay
+        from .models import Job
+        enqueue('test.record', value=1)
+        job = enqueue('test.fail', max_attempts=2)
+        with self.assertLogs('seafood.jobs', 'WARNING'):
+            call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(self.calls, [{'value': 1}])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('ZeroDivisionError', job.last_error)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 1)
+        with self.settings(JOBS_RETRY_BASE_SECONDS=30, JOBS_RETRY_MAX_SECONDS=100):
+            self.assertTrue(60 <= retry_delay(2) <= 66 and 100 <= retry_delay(10) <= 110)
+
+
+class BrevoOutboxTests(TestCase):
+    """Against a local stub of the Brevo API; the SMTP fallback lands in django.core.mail.outbox."""
+
+    @classmethod
+    def setUpClass(cls):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        super().setUpClass()
+        cls.received = []
+        cls.status = 201
+        stub = cls
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.received.append((self.client_address[1], body))
+                reply = json.dumps({'messageIds': ['<m@stub>'] * len(body['messageVersions'])}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from .brevo_email import breaker
+        type(self).status = 201
+        self.received.clear()
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        overrides = self.settings(
+            BREVO_API_KEY='test-key',
+            BREVO_API_URL='http://127.0.0.1:{}/v3/smtp/email'.format(self.server.server_port),
+            BREVO_SENDER_EMAIL='shop@example.com',
+            BREVO_BREAKER_THRESHOLD=2,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_same_content_is_one_request_over_one_connection(self):
+        from django.core import mail
+        from .brevo_email import Outbox
+        outbox = Outbox()
+        outbox.add('Замовлення #1', 'a@example.com', html_content='<p>1</p>', tags=['order'])
+        outbox.add('Код', 'c@example.com', text_content='123456')
+        outbox.add('Замовлення #1', 'b@example.com', html_content='<p>1</p>', tags=['order'])
+        self.assertEqual(outbox.flush(), [True, True, True])
+
+        self.assertEqual(len(self.received), 2)
+        body = self.received[0][1]
+        self.assertEqual([v['to'][0]['email'] for v in body['messageVersions']], ['a@example.com', 'b@example.com'])
+        self.assertEqual((body['subject'], body['tags']), ('Замовлення #1', ['order']))
+        self.assertEqual(len({port for port, _body in self.received}), 1)
+        self.assertEqual(mail.outbox, [])
+
+    def test_failing_brevo_trips_the_breaker_and_smtp_takes_the_batch(self):
+        from django.core import mail
+        from .brevo_email import Outbox, breaker, send_email_via_brevo
+        type(self).status = 500
+        outbox = Outbox()
+        for n in range(3):
+            outbox.add('Лист {}'.format(n), 'user{}@example.com'.format(n), text_content='...')
+        with self.assertLogs('seafood.brevo_email', 'WARNING'):
+            self.assertEqual(outbox.flush(), [True, True, True])
+        self.assertEqual(len(self.received), 2)  # the third never waited on Brevo
+        self.assertTrue(breaker.is_open)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+
+        # once the reset period is over, one trial request closes it again
+        type(self).status = 201
+        breaker.opened_at -= 3600
+        self.assertTrue(send_email_via_brevo('Знову', 'x@example.com', text_content='ok'))
+        self.assertFalse(breaker.is_open)
+        self.assertEqual((len(self.received), len(mail.outbox)), (3, 3))
+
+    def test_queued_emails_of_one_batch_share_a_request(self):
+        from .jobs import enqueue, run_due
+        from .models import Job
+        for address in ('a@example.com', 'b@example.com'):
+            enqueue('email.send', subject='Нове замовлення', recipient_email=address, html_content='<p>...</p>')
+        run_due('test-worker')
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(len(self.received[0][1]['messageVersions']), 2)
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.DONE})
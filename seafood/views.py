@@ -13,17 +13,28 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.mail import send_mail
-from django.db.models import Avg
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.decorators.http import require_POST, require_http_methods
 from django.urls import reverse
 from django.templatetags.static import static
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from .forms import CallbackRequestForm
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from .models import Order, CallbackRequest
-from .brevo_email import send_verification_email, send_email_via_brevo, send_callback_request_notification_email, send_order_notification_email
+from .catalog import SORT_ORDERING, get_catalog_page, get_categories, parse_price
+from .facets import get_facets
+from .images import attach_variants
+from .bestsellers import top_products
+from .recommendations import bought_together
+from .money import Money
+from . import cart as carts, jobs, orders, pricing, product_page, receipts, reviews, tasks
+from .conditional import (
+    catalog_etag, catalog_last_modified, conditional_page, homepage_etag, homepage_last_modified,
+    product_etag, product_last_modified, product_updated_at,
+)
 
 
 from django.contrib.admin.views.decorators import staff_member_required
@@ -45,6 +56,10 @@ from .models import (
 # Configure Stripe
 stripe.api_key = getattr(settings, "STRIPE_SECRET_KEY", None)
 
+# Homepage "Хіти продажу" carousel: cards shown / how many get the "ХІТ" badge
+HOMEPAGE_HITS = 10
+HOMEPAGE_HIT_BADGES = 6
+
 
 SAMPLES = {
     1: {
@@ -169,9 +184,16 @@ def _product_from_db_or_sample(product_id):
 # Public site views
 # -----------------------
 
+@conditional_page(homepage_etag, homepage_last_modified)
 def homepage(request):
-    # products shown on main page (DB)
-    products = SeafoodProduct.objects.all()
+    # "Хіти продажу": ranked best sellers, topped up with other products
+    # while the shop has too few sales to fill the carousel
+    hits = top_products(HOMEPAGE_HITS)
+    for p in hits[:HOMEPAGE_HIT_BADGES]:
+        p.is_hit = True
+    if len(hits) < HOMEPAGE_HITS:
+        hits += list(SeafoodProduct.objects.exclude(pk__in=[p.pk for p in hits])[:HOMEPAGE_HITS - len(hits)])
+    attach_variants([p.image for p in hits])
 
     # categories: якщо є модель Category, візьмемо всі
     try:
@@ -191,97 +213,106 @@ def homepage(request):
         chats_count = 0
 
     return render(request, 'homepage.html', {
-        'products': products,
+        'hits': hits,
         'categories': categories,
         'has_chats': has_chats,
         'chats_count': chats_count,
     })
 
 
-def products(request):
-    """
-    Catalog page with optional category filter and sorting.
-    Query params:
-      ?category=<slug>&sort=price_asc|price_desc|name_asc|name_desc|newest
-    """
-    qs = SeafoodProduct.objects.all()
-
-    # --- Попробуем загрузить категории как объекты Category (если модель есть) ---
-    categories = []
-    using_category_model = False
-    try:
-        from .models import Category
-        categories = list(Category.objects.all().order_by('ordering', 'name'))
-        using_category_model = True
-    except Exception:
-        categories = []
+def _catalog_params(request):
+    return {
+        'selected_category': request.GET.get('category', '').strip(),
+        'sort': request.GET.get('sort', '').strip(),
+        'price_min': parse_price(request.GET.get('price_min', '')),
+        'price_max': parse_price(request.GET.get('price_max', '')),
+        'cursor': request.GET.get('cursor', '').strip(),
+        'q': request.GET.get('q', '').strip(),
+        'in_stock': request.GET.get('in_stock', '') in ('1', 'true', 'on'),
+        'hits': request.GET.get('filter', '') == 'hits',
+    }
 
-    # Фоллбек — если в БД нет категорий, используем статичный список имен
-    if not categories:
-        categories = [
-            "Ікра", "Печінка тріски", "В'ялена риба та ікра",
-            "Делікатеси", "М'ясо краба", "Креветки", "Морепродукти"
-        ]
 
-    # --- Применяем фильтр по категории (ожидаем slug если Category есть) ---
-    selected_category = request.GET.get('category', '').strip()
-    if selected_category:
-        try:
-            if using_category_model:
-                # Поддерживаем и новое M2M `categories`, и временно legacy FK `category`
-                from django.db.models import Q
-                qs = qs.filter(
-                    Q(categories__slug__iexact=selected_category) |
-                    Q(category__slug__iexact=selected_category)
-                ).distinct()
-            else:
-                # fallback: фильтруем по вхождению имени в название/описание
-                qs = qs.filter(name__icontains=selected_category)
-        except Exception:
-            qs = qs.filter(name__icontains=selected_category)
-
-    # --- Сортировка ---
-    sort = request.GET.get('sort', '').strip()
-    if sort == 'price_asc':
-        qs = qs.order_by('price_per_100g')
-    elif sort == 'price_desc':
-        qs = qs.order_by('-price_per_100g')
-    elif sort == 'name_asc':
-        qs = qs.order_by('name')
-    elif sort == 'name_desc':
-        qs = qs.order_by('-name')
-    elif sort == 'newest':
-        if hasattr(SeafoodProduct, 'created_at'):
-            qs = qs.order_by('-created_at')
+def _filter_url(request, **changes):
+    """Current /products/ URL with some params replaced (None drops one); resets the page."""
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    for name, value in changes.items():
+        if value is None or value == '':
+            params.pop(name, None)
         else:
-            qs = qs.order_by('-id')
+            params[name] = value
+    query = params.urlencode()
+    return reverse('products') + ('?' + query if query else '')
 
-    # --- Подготовка списка продуктов (включая пакетную цену для шаблонов) ---
-    # Превращаем qs в список, чтобы можно было добавить временные атрибуты для шаблонов
-    products_list = list(qs.select_related('category').prefetch_related('categories'))
 
-    # вычисляем package_price_display для карточек (если product.package_size_grams задан)
-    try:
-        for p in products_list:
-            try:
-                pkg = getattr(p, 'package_size_grams', None)
-                if pkg:
-                    price100 = Decimal(str(getattr(p, 'price_per_100g', '0') or '0'))
-                    pkg_price = (price100 * (Decimal(pkg) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    p.package_price = pkg_price
-                    p.package_price_display = "{:.2f}".format(pkg_price)
-                    p.package_size = int(pkg)
-                else:
-                    p.package_price = None
-                    p.package_price_display = None
-                    p.package_size = None
-            except Exception:
-                p.package_price = None
-                p.package_price_display = None
-                p.package_size = None
-    except Exception:
-        # не ломаем страницу, если что-то пошло не так
-        pass
+def _facet_context(request, params):
+    """Facet counts (seafood.facets) with ready-made links for the template."""
+    facets = get_facets(
+        params['selected_category'], params['price_min'], params['price_max'],
+        params['q'], params['in_stock'], params['hits'],
+    )
+    selected = params['selected_category'].lower()
+    category_facets = [
+        dict(c, url=_filter_url(request, category=c['slug']), active=c['slug'].lower() == selected)
+        for c in facets['categories']
+    ]
+    price_facets = []
+    for b in facets['price_buckets']:
+        active = params['price_min'] == b['min'] and params['price_max'] == b['max']
+        price_facets.append(dict(
+            b,
+            label=('від {:.0f} ₴'.format(b['min']) if b['max'] is None
+                   else '{:.0f}–{:.0f} ₴'.format(b['min'], b['max'] + Decimal('0.01'))),
+            active=active,
+            url=(_filter_url(request, price_min=None, price_max=None) if active
+                 else _filter_url(request, price_min=b['min'], price_max=b['max'])),
+        ))
+    return {
+        'facets_total': facets['total'],
+        'category_facets': category_facets,
+        'all_categories_url': _filter_url(request, category=None),
+        'clear_search_url': _filter_url(request, q=None),
+        'selected_category_name': next(
+            (c['name'] for c in category_facets if c['active']), params['selected_category']
+        ),
+        'price_facets': price_facets,
+        'in_stock_facet': {
+            'count': facets['in_stock'],
+            'active': params['in_stock'],
+            'url': _filter_url(request, in_stock=None if params['in_stock'] else '1'),
+        },
+    }
+
+
+def _next_page_url(request, next_cursor, view_name='products_more'):
+    """URL of the page after this one (the products_more fragment by default)."""
+    if not next_cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = next_cursor
+    return reverse(view_name) + '?' + params.urlencode()
+
+
+@conditional_page(catalog_etag, catalog_last_modified)
+def products(request):
+    """
+    Catalog page with optional category filter and sorting.
+    Query params:
+      ?category=<slug>&sort=price_asc|price_desc|name_asc|name_desc|newest|rating
+      &price_min=<uah>&price_max=<uah>  (filters the stored effective_price)
+      &cursor=<opaque>                  (keyset page, see seafood.pagination)
+      &q=<text>                         (full-text search, see seafood.search;
+                                         ranked by relevance unless sort is given)
+      &in_stock=1                       (only products in stock)
+      &filter=hits                      (best sellers, ranked; see seafood.bestsellers)
+    Category / stock / price-bucket counts come from seafood.facets.
+    Only the first page of cards is rendered; the rest is appended on scroll
+    from `products_more`. Cards come from the versioned catalog cache
+    (see seafood.catalog).
+    """
+    params = _catalog_params(request)
+    page = get_catalog_page(**params)
 
     # favorites for current user
     favorited_ids = set()
@@ -291,123 +322,64 @@ def products(request):
         except Exception:
             favorited_ids = set()
 
-    return render(request, 'products.html', {
-        'products': products_list,
+    context = {
+        'products': page['products'],
+        'next_url': _next_page_url(request, page['next_cursor']),
+        'next_page_url': _next_page_url(request, page['next_cursor'], 'products'),
         'favorited_ids': favorited_ids,
-        'categories': categories,
-        'selected_category': selected_category,
-        'current_sort': sort,
+        'categories': get_categories(),
+        'selected_category': params['selected_category'],
+        'current_sort': params['sort'],
+        'q': params['q'],
+    }
+    context['sort_urls'] = {key: _filter_url(request, sort=key) for key in SORT_ORDERING}
+    context.update(_facet_context(request, params))
+    return render(request, 'products.html', context)
+
+
+@conditional_page(catalog_etag, catalog_last_modified)
+def products_more(request):
+    """
+    HTML fragment with the next page of product cards (infinite scroll).
+    Takes the same query params as `products`, `cursor` included.
+    """
+    params = _catalog_params(request)
+    page = get_catalog_page(**params)
+    return render(request, '_product_cards.html', {
+        'products': page['products'],
+        'next_url': _next_page_url(request, page['next_cursor']),
     })
 
+@conditional_page(product_etag, product_last_modified)
 def product_details(request, product_id):
     """
     Show product page. Uses DB product if exists; otherwise falls back to SAMPLES.
 
+    Everything but `is_favorited` comes from the precomputed detail document
+    and the cached "bought together" strip (see seafood.product_page), so a
+    warm page is two cache reads plus the product's updated_at and the
+    visitor's favorite lookup.
+
     Context:
-      - product: lightweight object for templates (id, name, description, price_per_100g, image.url, in_stock, (optional) youtube_url)
-      - images: list of dicts { url, alt, is_main(bool), is_video(bool), thumb_url(optional) }
+      - product: lightweight object for templates (card fields, price_per_100g, image.url, youtube_url, youtube_id, categories)
+      - images: list of dicts { url, alt, is_main(bool), is_video(bool), thumb_url, embed_url(video only) }
       - is_favorited: bool
-      - reviews, average_rating
+      - reviews (first page, or the page at ?cursor=), reviews_next_url (the
+        product_reviews fragment), reviews_next_page_url (this page at the next
+        cursor, the no-JS link), review_count, average_rating
+      - bought_together: product cards
       - package_size: (int) grams if product sold in packages (e.g. 500)
       - package_price: (string) formatted price for one package (e.g. "2800.00")
     """
-    product_obj, _db_prod = _product_from_db_or_sample(product_id)
-    if not product_obj:
+    document = product_page.get_document(product_id, product_updated_at(request, product_id))
+    if document is not None:
+        # other products: cached under the catalog version, not with the document
+        document = dict(document, bought_together=product_page.get_bought_together(product_id))
+    else:
+        document = _sample_document(product_id)
+    if document is None:
         return render(request, '404.html', status=404)
 
-    images = []
-    try:
-        # If we have a DB product, prefer ProductImage rows
-        if _db_prod:
-            try:
-                imgs_qs = _db_prod.images.all()  # model ordering already prefers is_main
-            except Exception:
-                imgs_qs = []
-
-            for im in imgs_qs:
-                try:
-                    url = im.image.url
-                except Exception:
-                    url = static('images/png/placeholder.png')
-                images.append({
-                    'url': url,
-                    'alt': (getattr(im, 'alt', '') or _db_prod.name),
-                    'is_main': bool(getattr(im, 'is_main', False)),
-                    'is_video': False,
-                    'thumb_url': url,  # can be replaced with a true thumbnail generator
-                })
-
-            # Fallback to product.image if no ProductImage entries were found
-            if not images:
-                try:
-                    main_img_url = _db_prod.image.url
-                except Exception:
-                    main_img_url = static('images/png/placeholder.png')
-                images.append({
-                    'url': main_img_url,
-                    'alt': _db_prod.name,
-                    'is_main': True,
-                    'is_video': False,
-                    'thumb_url': main_img_url,
-                })
-        else:
-            # Non-DB sample product: use the product_obj.image.url provided by _product_from_db_or_sample
-            try:
-                main_img_url = product_obj.image.url
-            except Exception:
-                main_img_url = static('images/png/placeholder.png')
-            images.append({
-                'url': main_img_url,
-                'alt': getattr(product_obj, 'name', ''),
-                'is_main': True,
-                'is_video': False,
-                'thumb_url': main_img_url,
-            })
-    except Exception:
-        # On any unexpected error, ensure at least one placeholder image
-        images = [{
-            'url': static('images/png/placeholder.png'),
-            'alt': getattr(product_obj, 'name', ''),
-            'is_main': True,
-            'is_video': False,
-            'thumb_url': static('images/png/placeholder.png'),
-        }]
-
-    # If the DB product has a YouTube URL (or product_obj provided one), append a video thumb
-    # Video item is appended at the end unless no other images exist.
-    youtube_url = None
-    try:
-        if _db_prod and getattr(_db_prod, 'youtube_url', None):
-            youtube_url = _db_prod.youtube_url
-        elif hasattr(product_obj, 'youtube_url') and product_obj.youtube_url:
-            youtube_url = product_obj.youtube_url
-    except Exception:
-        youtube_url = None
-
-    if youtube_url:
-        # Use a small placeholder thumb for video; front-end JS will extract video id and render embed when clicked
-        video_thumb = static('images/thumbs/video_placeholder.png')
-        # If there are no real images, mark video as is_main
-        is_main_for_video = not any(item.get('is_main') for item in images)
-        images.append({
-            'url': youtube_url,
-            'alt': 'video',
-            'is_main': bool(is_main_for_video),
-            'is_video': True,
-            'thumb_url': video_thumb,
-        })
-
-    # Reorder images so that the first is the one with is_main=True (stable)
-    try:
-        main_index = next((i for i, it in enumerate(images) if it.get('is_main')), None)
-        if main_index is not None and main_index != 0:
-            main_item = images.pop(main_index)
-            images.insert(0, main_item)
-    except Exception:
-        # ignore reorder errors
-        pass
-
-    # is_favorited
     is_favorited = False
     if request.user.is_authenticated:
         try:
@@ -415,176 +387,82 @@ def product_details(request, product_id):
         except Exception:
             is_favorited = False
 
-    # reviews & average rating
-    reviews = []
-    average_rating = None
-    try:
-        if _db_prod:
-            qs = Review.objects.filter(product=_db_prod).select_related('user')
-            reviews = qs.order_by('-created_at')
-            avg = qs.aggregate(avg=Avg('rating'))['avg']
-            if avg is not None:
-                average_rating = round(float(avg), 2)
-    except Exception:
-        reviews = []
-        average_rating = None
-
-    # NEW: compute package price if product stored in DB has package_size_grams
-    package_size = None
-    package_price_display = None
-    try:
-        if _db_prod and getattr(_db_prod, 'package_size_grams', None):
-            package_size = int(_db_prod.package_size_grams)
-            # price_per_100g may be Decimal or None
-            try:
-                price_per_100g = Decimal(str(_db_prod.price_per_100g or '0'))
-            except Exception:
-                price_per_100g = Decimal('0')
-            package_price = (price_per_100g * (Decimal(package_size) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            # formatted string for template (e.g. "2800.00")
-            package_price_display = "{:.2f}".format(package_price)
-    except Exception:
-        package_size = None
-        package_price_display = None
+    context = dict(document, is_favorited=is_favorited)
+    cursor = request.GET.get('cursor', '').strip()
+    if cursor:
+        # "more reviews" without JS: the same page with a later page of reviews
+        page, next_cursor = reviews.review_page(product_id, cursor)
+        context.update(
+            reviews=list(page),
+            reviews_next_url=product_page.reviews_page_url(product_id, next_cursor),
+            reviews_next_page_url=product_page.reviews_page_url(product_id, next_cursor, 'product_details'),
+        )
+    return render(request, 'product_details.html', context)
 
-        display_currency = 'UAH'
-# приклад: якщо хочеш, щоб конкретний продукт був у USD (поки без зміни моделі)
-        if product_obj and 'Ікра чорна' in product_obj.name:
-         display_currency = 'USD'
 
-    return render(request, 'product_details.html', {
+def _sample_document(product_id):
+    """Detail document for a SAMPLES product that is not in the DB, or None."""
+    product_obj, _db_prod = _product_from_db_or_sample(product_id)
+    if not product_obj:
+        return None
+    return {
         'product': product_obj,
-        'images': images,
-        'is_favorited': is_favorited,
-        'reviews': reviews,
-        'average_rating': average_rating,
-        'youtube_url': youtube_url,
-        'package_size': package_size,
-        'package_price': package_price_display,
-    })
-
-
-def cart_view(request):
-    session_cart = request.session.get('cart', {}) or {}
-    cart_for_template = {}
-    totals_decimal = {}  # currency -> Decimal
-    cart_count_total = 0
-    first_pid = None
-
-    for pid, it in session_cart.items():
-        try:
-            qty = int(it.get('quantity', 0))
-        except Exception:
-            qty = 0
-
-        cart_count_total += qty
-
-        # compute line total (Decimal)
-        line_total = Decimal('0.00')
-        currency = (it.get('currency') or 'UAH')
+        'images': product_page.gallery(product_obj.name, [(product_obj.image.url, product_obj.name, True, None, '')]),
+        'youtube_url': None,
+        'youtube_id': None,
+        'package_size': None,
+        'package_price': None,
+        'review_count': 0,
+        'average_rating': None,
+        'reviews': [],
+        'reviews_next_url': None,
+        'reviews_next_page_url': None,
+        'bought_together': [],
+    }
 
-        try:
-            if it.get('unit') == 'package':
-                tp = it.get('total_price')
-                if tp is not None and tp != '':
-                    line_total = Decimal(str(tp)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                else:
-                    price100 = Decimal(str(it.get('unit_price_per_100g', '0')))
-                    pkg = int(it.get('package_size_grams') or 0)
-                    line_total = (price100 * (Decimal(pkg) * Decimal(qty)) / Decimal(100)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                # unit price per single package:
-                try:
-                    pkg = int(it.get('package_size_grams') or 0)
-                    if tp is not None and tp != '':
-                        unit_price = Decimal(str(tp))
-                    else:
-                        unit_price = (Decimal(str(it.get('unit_price_per_100g', '0'))) * (Decimal(pkg) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                except Exception:
-                    unit_price = Decimal('0.00')
-                unit_label = '1 шт'
-                package_size = it.get('package_size_grams')
-            else:
-                # unit items
-                if it.get('price_per_100g') is not None or it.get('unit_price_per_100g') is not None:
-                    price100 = Decimal(str(it.get('price_per_100g') or it.get('unit_price_per_100g') or '0'))
-                    line_total = (price100 * Decimal(qty)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    unit_price = price100
-                    unit_label = '100г'
-                    package_size = None
-                elif it.get('price') is not None:
-                    unit_price = Decimal(str(it.get('price')))
-                    line_total = (unit_price * Decimal(qty)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    unit_label = 'шт'
-                    package_size = None
-                else:
-                    unit_price = Decimal('0.00')
-                    line_total = Decimal('0.00')
-                    unit_label = ''
-                    package_size = None
-        except Exception:
-            line_total = Decimal('0.00')
-            unit_price = Decimal('0.00')
-            unit_label = ''
-            package_size = None
-
-        totals_decimal.setdefault(currency, Decimal('0.00'))
-        totals_decimal[currency] += line_total
-
-        cart_for_template[str(pid)] = {
-            'name': it.get('name', ''),
-            'image': it.get('image', ''),
-            'price': "{:.2f}".format(line_total),   # line total formatted as string
-            'currency': currency,
-            'quantity': qty,
-            'unit': it.get('unit', 'unit'),
-            'package_size_grams': package_size,
-            'unit_price_display': "{:.2f}".format(unit_price) if unit_price is not None else None,
-            'unit_label': unit_label,
-        }
 
-        if first_pid is None:
-            first_pid = pid
+def product_reviews(request, product_id):
+    """
+    One keyset page of a product's reviews, newest first (see seafood.reviews).
+    Returns the `_review_list.html` fragment, or JSON with ?format=json:
+      {reviews: [{id, user, rating, comment, created_at}], next_url}
+    """
+    product = get_object_or_404(SeafoodProduct, pk=product_id)
+    page, next_cursor = reviews.review_page(product.id, request.GET.get('cursor', '').strip())
+    next_url = product_page.reviews_page_url(product.id, next_cursor)
 
-    totals_str = {cur: "{:.2f}".format(amount) for cur, amount in totals_decimal.items()}
+    if request.GET.get('format') == 'json':
+        if next_url:
+            next_url += '&format=json'
+        return JsonResponse({
+            'reviews': [{
+                'id': r.id,
+                'user': r.user.username,
+                'rating': r.rating,
+                'comment': r.comment,
+                'created_at': r.created_at.isoformat(),
+            } for r in page],
+            'next_url': next_url,
+        })
+    return render(request, '_review_list.html', {'reviews': page, 'next_url': next_url})
 
-    # recommended products
-    try:
-        recommended = list(SeafoodProduct.objects.all()[:8])
-        for p in recommended:
-            try:
-                pkg = getattr(p, 'package_size_grams', None)
-                if pkg:
-                    p.package_size = int(pkg)
-                    price100 = Decimal(str(getattr(p, 'price_per_100g', '0') or '0'))
-                    pkg_price = (price100 * (Decimal(p.package_size) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    p.package_price = pkg_price
-                    p.package_price_display = "{:.2f}".format(pkg_price)
-                else:
-                    p.package_size = None
-                    p.package_price = None
-                    p.package_price_display = None
-            except Exception:
-                p.package_size = None
-                p.package_price = None
-                p.package_price_display = None
-    except Exception:
-        recommended = []
 
-    context = {
-        'cart': cart_for_template,
-        'totals': totals_str,
-        'first_pid': first_pid,
-        'cart_count': cart_count_total,
-        'products': recommended,
-    }
-    return render(request, 'cart.html', context)
+def _cart_recommendations(product_ids, limit=8):
+    recommended = bought_together(product_ids, limit=limit, pad=True)
+    # package_price / package_price_display come from the stored column
+    for p in recommended:
+        p.package_size = p.package_size_grams if p.package_price is not None else None
+    return recommended
 
 
 def order_form(request, product_id):
     product_obj, _db_prod = _product_from_db_or_sample(product_id)
     if not product_obj:
         return render(request, '404.html', status=404)
-    return render(request, 'order_form.html', {'product': product_obj})
+    return render(request, 'order_form.html', {
+        'product': product_obj,
+        'submission_key': orders.new_submission_key(),
+    })
 
 def payment(request, order_id):
     order = get_object_or_404(Order, id=order_id)
@@ -648,13 +526,8 @@ def register(request):
 
             request.session['verify_user_id'] = user.id
 
-            # Send verification email via Brevo/SMTP, but do not block registration if mail fails.
-            email_sent = send_verification_email(email, code)
-            if not email_sent:
-                request.session['verify_message'] = (
-                    'Акаунт створено, але лист з кодом не надійшов. '
-                    'Ви можете ввести код вручну на наступній сторінці або спробувати ще раз.'
-                )
+            # The email goes out from the job queue (retried if Brevo/SMTP fails), not from this request.
+            jobs.enqueue(tasks.VERIFICATION_EMAIL, user_id=user.id)
 
             return redirect('verify_email')
 
@@ -719,223 +592,51 @@ def contacts(request):
 
 
 # -----------------------
-# Session-based cart API
+# Cart (seafood.cart)
 # -----------------------
 
-def _get_cart(request):
-    return request.session.setdefault('cart', {})
-
-
 def cart_count(request):
-    return sum(int(item.get('quantity', 0)) for item in _get_cart(request).values())
-
-
-@require_POST
-def add_to_cart(request):
-    if not request.user.is_authenticated:
-        return JsonResponse({
-            'ok': False,
-            'error': 'login required',
-            'login_url': reverse('login') + '?next=' + request.path
-        }, status=401)
-
-    product_id = request.POST.get('product_id')
-    if not product_id:
-        return JsonResponse({'ok': False, 'error': 'product_id required'}, status=400)
-
-    # validate product exists and is available
-    try:
-        product = get_object_or_404(SeafoodProduct, pk=int(product_id))
-    except Exception:
-        return JsonResponse({'ok': False, 'error': 'Продукт не знайдено'}, status=404)
-
-    if not product.in_stock:
-        return JsonResponse({'ok': False, 'error': 'Товар тимчасово відсутній', 'in_stock': False}, status=400)
-
-    # basic metadata
-    name = request.POST.get('name', product.name or 'Товар')
-    currency = request.POST.get('currency', 'UAH')
-    image = request.POST.get('image', '')
-
-    # get or create cart (keeps existing helper)
-    cart = _get_cart(request)
-
-    # If product is sold in units (шт, банка etc.) — use units logic
-    if getattr(product, 'sold_in_units', False):
-        # quantity (units) — try 'quantity' then 'quantity_units'
-        raw_qty = request.POST.get('quantity', request.POST.get('quantity_units', '1'))
-        try:
-            qty = int(float(raw_qty))
-        except (TypeError, ValueError):
-            qty = 1
-        qty = max(1, qty)
-
-        # price per unit must exist (validation), fallback to 0.00 if not
-        price_per_unit = getattr(product, 'price_per_unit', None) or Decimal('0.00')
-        if not isinstance(price_per_unit, Decimal):
-            price_per_unit = Decimal(str(price_per_unit))
-
-        total_price = (price_per_unit * Decimal(qty)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-        # use unit-specific session key to avoid colliding with gram-based items
-        pid_key = f"u:{product.id}"
-        if pid_key in cart:
-            # accumulate quantity and total
-            existing = cart[pid_key]
-            existing_qty = int(existing.get('quantity', 0))
-            new_qty = existing_qty + qty
-            existing['quantity'] = new_qty
-            existing_total = Decimal(str(existing.get('total_price', '0') or '0'))
-            existing_total += (price_per_unit * Decimal(qty))
-            existing['total_price'] = str(existing_total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        else:
-            cart[pid_key] = {
-                'product_id': product.id,
-                'name': name,
-                'type': 'unit',
-                'quantity': qty,
-                'unit_label': getattr(product, 'unit_label', 'шт') or 'шт',
-                'price_per_unit': str(price_per_unit.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)),
-                'total_price': str(total_price),
-                'currency': currency,
-                'image': image,
-            }
-
-    else:
-        # Weight-based logic (backwards-compatible with previous behavior)
-        # Accept either 'quantity_g' (grams) or 'quantity' (legacy which might be grams or 100g units)
-        raw_q = request.POST.get('quantity_g', request.POST.get('quantity', '1'))
-        try:
-            q = int(float(raw_q))
-        except (TypeError, ValueError):
-            q = 1
-
-        # previous logic interpreted values >=10 and divisible by 100 as grams,
-        # then converted to number of 100g units. Preserve that behavior:
-        if q >= 10 and q % 100 == 0:
-            # treat q as grams, convert to number of 100g units
-            num_100g_units = max(1, q // 100)
-        else:
-            # treat q as already number of 100g units
-            num_100g_units = max(1, q)
-
-        # price per 100g (fallback to 0.00)
-        price_per_100g = getattr(product, 'price_per_100g', None) or Decimal('0.00')
-        if not isinstance(price_per_100g, Decimal):
-            price_per_100g = Decimal(str(price_per_100g))
-
-        # compute total: price_per_100g * number_of_100g_units
-        total_price = (price_per_100g * Decimal(num_100g_units)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-        # create key includes grams info to differentiate different package sizes if needed
-        pid_key = f"g:{product.id}:{num_100g_units}"
-        if pid_key in cart:
-            existing = cart[pid_key]
-            existing_qty = int(existing.get('quantity', 0))
-            new_qty = existing_qty + num_100g_units
-            existing['quantity'] = new_qty
-            existing_total = Decimal(str(existing.get('total_price', '0') or '0'))
-            existing_total += (price_per_100g * Decimal(num_100g_units))
-            existing['total_price'] = str(existing_total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
-        else:
-            cart[pid_key] = {
-                'product_id': product.id,
-                'name': name,
-                'type': 'weight',
-                'quantity': num_100g_units,  # number of 100g units
-                'grams_per_unit': 100,
-                'price_per_100g': str(price_per_100g.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)),
-                'total_price': str(total_price),
-                'currency': currency,
-                'image': image,
-            }
+    return carts.count(carts.get_cart(request))
 
-    request.session.modified = True
-
-    return JsonResponse({'ok': True, 'cart_count': cart_count(request)})
 
 def cart_view(request):
     """
     Рендерить сторінку кошика. Повертає:
-      - 'cart' : dict { pid: { name, image, price (line total), currency, quantity } }
+      - 'cart' : dict { pid: { name, image, type, price (line total), currency, quantity, ... } }
       - 'totals': dict { currency: "1234.56" } (рядки для шаблону)
       - 'first_pid': перший product id або None (для checkout link)
       - 'cart_count': сумарна кількість одиниць
-    Підтримує обидві структури сесійних item-ів:
-      - package items: {'unit': 'package', 'total_price' (string) , 'unit_price_per_100g', 'package_size_grams', 'quantity'}
-      - unit items: {'price_per_100g' або 'price', 'quantity'}
+    Ціни рахуються з товарів (seafood.cart.price), а не зберігаються в кошику.
     """
-    session_cart = request.session.get('cart', {}) or {}
+    priced = carts.price(carts.get_cart(request))
     cart_for_template = {}
-    totals_decimal = {}  # currency -> Decimal
-    cart_count_total = 0
-    first_pid = None
-
-    for pid, it in session_cart.items():
-        # normalize quantity
-        try:
-            qty = int(it.get('quantity', 0))
-        except Exception:
-            qty = 0
-
-        cart_count_total += qty
-
-        # compute line total (Decimal)
-        line_total = Decimal('0.00')
-        currency = (it.get('currency') or 'UAH')
-
-        try:
-            if it.get('unit') == 'package':
-                # prefer stored total_price (string), otherwise compute from unit_price_per_100g * pkg * qty
-                tp = it.get('total_price')
-                if tp is not None and tp != '':
-                    line_total = Decimal(str(tp)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                else:
-                    price100 = Decimal(str(it.get('unit_price_per_100g', '0')))
-                    pkg = int(it.get('package_size_grams') or 0)
-                    line_total = (price100 * (Decimal(pkg) * Decimal(qty)) / Decimal(100)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            else:
-                # unit items: prefer price_per_100g * qty, fallback to price * qty
-                if it.get('price_per_100g') is not None:
-                    price100 = Decimal(str(it.get('price_per_100g')))
-                    line_total = (price100 * Decimal(qty)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                elif it.get('price') is not None:
-                    line_total = (Decimal(str(it.get('price'))) * Decimal(qty)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                else:
-                    line_total = Decimal('0.00')
-        except Exception:
-            line_total = Decimal('0.00')
-
-        # accumulate totals by currency
-        totals_decimal.setdefault(currency, Decimal('0.00'))
-        totals_decimal[currency] += line_total
-
-        # prepare cart item for template: price shown is line total
-        cart_for_template[str(pid)] = {
-            'name': it.get('name', ''),
-            'image': it.get('image', ''),
-            'price': "{:.2f}".format(line_total),   # line total formatted as string
-            'currency': currency,
-            'quantity': qty,
+    for line in priced.lines:
+        product = line.product
+        cart_for_template[str(line.product_id)] = {
+            'name': product.name,
+            'image': product.image.url if product.image else '',
+            'type': line.mode,
+            'price': str(line.total),   # line total formatted as string
+            'total_price': str(line.total),
+            'currency': line.currency,
+            'quantity': line.quantity,
+            'unit_label': line.unit_label,
+            'price_per_unit': line.step_price if line.mode == pricing.UNIT else None,
+            'price_per_100g': line.step_price if line.mode == pricing.WEIGHT else None,
+            'package_size_grams': product.package_size_grams if line.mode == pricing.PACKAGE else None,
         }
 
-        if first_pid is None:
-            first_pid = pid
-
-    # format totals for template
-    totals_str = {cur: "{:.2f}".format(amount) for cur, amount in totals_decimal.items()}
-
-    # recommended products for bottom section (simple sample — choose some DB products)
+    # recommended products: bought together with what is in the cart
     try:
-        recommended = list(SeafoodProduct.objects.all()[:8])
+        recommended = _cart_recommendations([line.product_id for line in priced.lines])
     except Exception:
         recommended = []
 
     context = {
         'cart': cart_for_template,
-        'totals': totals_str,
-        'first_pid': first_pid,
-        'cart_count': cart_count_total,
+        'totals': priced.totals_display(),
+        'first_pid': priced.lines[0].product_id if priced.lines else None,
+        'cart_count': priced.count,
         'products': recommended,
     }
     return render(request, 'cart.html', context)
@@ -958,26 +659,19 @@ def update_cart_item(request):
     except (TypeError, ValueError):
         quantity = 0
 
-    cart = _get_cart(request)
-    if product_id not in cart:
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
         return JsonResponse({'ok': False, 'error': 'product not found'}, status=404)
+    if quantity >= 10 and quantity % 100 == 0:
+        quantity = max(1, quantity // 100)
 
-    if quantity <= 0:
-        del cart[product_id]
-    else:
-        if quantity >= 10 and quantity % 100 == 0:
-            quantity = max(1, quantity // 100)
-        cart[product_id]['quantity'] = quantity
-
-    request.session.modified = True
-
-    totals = {}
-    for pid, item in cart.items():
-        cur = item.get('currency', 'UAH')
-        totals.setdefault(cur, 0)
-        totals[cur] += int(item.get('price', 0)) * int(item.get('quantity', 0))
+    cart = carts.get_cart(request)
+    if cart is None or not carts.set_quantity(cart, product_id, quantity):
+        return JsonResponse({'ok': False, 'error': 'product not found'}, status=404)
 
-    return JsonResponse({'ok': True, 'cart_count': cart_count(request), 'totals': totals})
+    priced = carts.price(cart)
+    return JsonResponse({'ok': True, 'cart_count': priced.count, 'totals': priced.totals_display()})
 
 
 @require_POST
@@ -989,11 +683,11 @@ def checkout_session(request):
             'login_url': reverse('login') + '?next=' + request.path
         }, status=401)
 
-    cart = _get_cart(request)
-    if not cart:
+    priced = carts.price(carts.get_cart(request))
+    if not priced.lines:
         return JsonResponse({'ok': False, 'error': 'cart empty'}, status=400)
 
-    currencies = {item.get('currency', 'UAH') for item in cart.values()}
+    currencies = set(priced.totals)
     if len(currencies) > 1:
         return JsonResponse({'ok': False, 'error': 'cart has multiple currencies; checkout one currency at a time'}, status=400)
     currency = currencies.pop()
@@ -1002,17 +696,18 @@ def checkout_session(request):
         return JsonResponse({'ok': False, 'error': 'stripe not configured on server'}, status=500)
 
     line_items = []
-    for pid, item in cart.items():
-        unit_amount = int(item.get('price', 0)) * 100
+    for line in priced.lines:
+        # Stripe takes the price of one step in minor units (kopiyky)
+        unit_amount = int(line.step_price)
         line_items.append({
             'price_data': {
                 'currency': currency.lower(),
                 'product_data': {
-                    'name': item.get('name'),
+                    'name': line.product.name,
                 },
                 'unit_amount': unit_amount,
             },
-            'quantity': int(item.get('quantity', 1)),
+            'quantity': line.quantity,
         })
 
     success_url = request.build_absolute_uri('/payment-success/')
@@ -1031,8 +726,7 @@ def checkout_session(request):
 
 @require_http_methods(["GET"])
 def clear_cart(request):
-    request.session.pop('cart', None)
-    request.session.modified = True
+    carts.clear(carts.get_cart(request))
     return redirect('cart')
 
 
@@ -1136,13 +830,8 @@ def submit_review(request, product_id):
                 price_per_100g=price_per_100g,
             )
 
-        # create review
-        Review.objects.create(
-            user=request.user,
-            product=db_prod,
-            rating=rating,
-            comment=comment,
-        )
+        # create review and bump the product's rating counters atomically
+        reviews.add_review(db_prod, request.user, rating, comment)
 
         return JsonResponse({'ok': True, 'message': 'Дякуємо за відгук.'})
 
@@ -1197,80 +886,38 @@ def checkout_view(request):
     """
     Показує форму оформлення і підготовлює дані для оформлення.
     Підтримує дві ситуації:
-      - session['cart'] існує і це dict {pid: {name, price, currency, quantity, image}}
+      - кошик (seafood.cart) не порожній
       - fallback: GET product_id (одиночний товар)
     При POST валідовано — зберігає в сесії last_order і редіректить на success.
     """
-    from decimal import Decimal
-
-    cart = request.session.get('cart', {})  # dict pid -> item
+    priced = carts.price(carts.get_cart(request))
     product = None
+    pid = request.GET.get('product_id', '')
+    if not priced.lines and pid.isdigit():
+        # fallback single product via GET product_id, priced like a cart line
+        priced = pricing.price_items([(pid, pricing.parse_quantity(request.GET.get('quantity')))])
+        if priced.lines:
+            line = priced.lines[0]
+            product = {
+                'id': line.product_id, 'name': line.product.name, 'price': str(line.step_price), 'quantity': line.quantity,
+            }
 
-    total_price = Decimal('0.00')
-    totals = {}   # totals by currency as Decimal
-    items_list = []  # list of normalized items for template/last_order
-
-    # If cart is a mapping (standard case)
-    if cart and isinstance(cart, dict):
-        for pid, it in cart.items():
-            try:
-                price = Decimal(str(it.get('price', 0)))          # price per 100g (as stored)
-                qty = int(it.get('quantity', 1))                  # number of 100g units as stored
-            except Exception:
-                # skip malformed entry
-                continue
-            line_total = price * Decimal(qty)                    # price * qty (both in same unit)
-            cur = it.get('currency', 'UAH') or 'UAH'
-            totals.setdefault(cur, Decimal('0.00'))
-            totals[cur] += line_total
-            total_price += line_total
-
-            items_list.append({
-                'product_id': str(pid),
-                'name': it.get('name', ''),
-                'price': "{:.2f}".format(price),
-                'quantity': qty,
-                'currency': cur,
-                'image': it.get('image', ''),
-                'line_total': "{:.2f}".format(line_total),
-            })
-    else:
-        # fallback single product via GET product_id
-        pid = request.GET.get('product_id')
-        if pid:
-            try:
-                prod = SeafoodProduct.objects.filter(id=pid).first()
-                if prod:
-                    price = Decimal(str(getattr(prod, 'price_per_100g', 0)))
-                    # allow GET quantity param (in grams) but default to 100
-                    q_raw = request.GET.get('quantity', '100')
-                    try:
-                        q_val = int(q_raw)
-                    except Exception:
-                        q_val = 100
-                    # convert grams -> number of 100g units if caller passed grams that are multiples of 100
-                    if q_val >= 10 and q_val % 100 == 0:
-                        qty_unit = max(1, q_val // 100)
-                    else:
-                        qty_unit = max(1, q_val)
-                    line_total = price * Decimal(qty_unit)
-                    total_price = line_total
-                    totals = {'UAH': line_total}
-                    items_list.append({
-                        'product_id': str(prod.id),
-                        'name': prod.name,
-                        'price': "{:.2f}".format(price),
-                        'quantity': qty_unit,
-                        'currency': 'UAH',
-                        'image': getattr(prod.image, 'url', ''),
-                        'line_total': "{:.2f}".format(line_total),
-                    })
-                    product = {'id': prod.id, 'name': prod.name, 'price': "{:.2f}".format(price), 'quantity': qty_unit}
-            except Exception:
-                product = None
+    total_price = sum(priced.totals.values(), Money(0))
+    totals = dict(priced.totals)   # totals by currency as Money
+    # list of normalized items for template/last_order
+    items_list = [{
+        'product_id': str(line.product_id),
+        'name': line.product.name,
+        'price': str(line.step_price),
+        'quantity': line.quantity,
+        'currency': line.currency,
+        'image': line.product.image.url if line.product.image else '',
+        'line_total': str(line.total),
+    } for line in priced.lines]
+    cart = {item['product_id']: item for item in items_list} if product is None else {}
 
     # format totals for template (strings)
-    totals_str = {cur: "{:.2f}".format(amount) for cur, amount in totals.items()}
+    totals_str = {cur: str(amount) for cur, amount in totals.items()}
 
     errors = []
     posted = {}
@@ -1307,19 +954,19 @@ def checkout_view(request):
                 'address': posted['address'],
                 'payment_method': posted['payment_method'],
                 'comment': posted['comment'],
-                'total': "{:.2f}".format(total_price),
+                'total': str(total_price),
                 'totals': totals_str,
                 'items': items_list,
             }
             # Optionally clear the cart after successful checkout:
-            # request.session.pop('cart', None)
+            # carts.clear(carts.get_cart(request))
             request.session.modified = True
             return redirect(reverse('checkout_success'))
 
     context = {
         'cart': cart,
         'product': product,
-        'total_price': "{:.2f}".format(total_price),
+        'total_price': str(total_price),
         'totals': totals_str,
         'items': items_list,
         'errors': errors,
@@ -1360,7 +1007,16 @@ def order_complete(request, order_id):
 
 
 @require_http_methods(["GET", "POST"])
+@csrf_exempt
 def chat_view(request, conv_id):
+    # receipts stream through ReceiptUploadHandler, which has to be installed
+    # before CSRF middleware reads request.POST; CSRF is checked in _chat_view
+    request.upload_handlers.insert(0, receipts.ReceiptUploadHandler(request))
+    return _chat_view(request, conv_id)
+
+
+@csrf_protect
+def _chat_view(request, conv_id):
     conv = get_object_or_404(Conversation, id=conv_id)
     if not request.user.is_authenticated:
         return redirect('login')
@@ -1387,9 +1043,27 @@ def chat_view(request, conv_id):
         receipt = request.FILES.get('receipt')
         text = request.POST.get('text', '').strip()
 
+        receipt_error = getattr(request, 'receipt_error', None)
+        if receipt and not receipt_error:
+            try:
+                receipts.validate_receipt(receipt)
+            except ValidationError as e:
+                receipt_error = e.messages[0]
+        if receipt_error:
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'ok': False, 'error': receipt_error}, status=400)
+            messages = conv.messages.select_related('sender').all()
+            return render(request, 'chat.html', {
+                'conversation': conv, 'messages': messages, 'order_closed': order_closed, 'receipt_error': receipt_error,
+            }, status=400)
+
         if receipt:
-            # optional: validate file size/type here
-            msg = Message.objects.create(conversation=conv, sender=request.user, text='[Квитанція]', image=receipt)
+            with transaction.atomic():
+                msg = Message.objects.create(
+                    conversation=conv, sender=request.user, text='[Квитанція]', original_image=receipt,
+                )
+                # downscaled by the job queue (seafood.receipts), retried if it fails
+                jobs.enqueue(tasks.PROCESS_RECEIPT, message_id=msg.pk)
             if conv.order:
                 conv.order.payment_status = 'processing'
                 conv.order.save()
@@ -1412,20 +1086,56 @@ def chat_view(request, conv_id):
 
     messages = conv.messages.select_related('sender').all()
     return render(request, 'chat.html', {'conversation': conv, 'messages': messages, 'order_closed': order_closed})
+def _enqueue_order_notifications(request, placed, email):
+    """Queue the staff emails about a new order (seafood.jobs), one job per recipient."""
+    order, conv, seller = placed.order, placed.conversation, placed.seller
+    items_lines = placed.item_lines()
+    items_text = "\n".join(items_lines)
+
+    subject = f"Нове замовлення #{order.id} — VugriUkraine"
+    chat_url = request.build_absolute_uri(reverse('chat', args=[conv.id]))
+    message_body = (
+        f"Нове замовлення #{order.id}\n\n"
+        f"Позиції:\n{items_text}\n\n"
+        f"Дані замовника:\nІм'я: {order.full_name}\nТелефон: {order.phone}\nEmail: {email}\nМісто: {order.city}\nАдреса: {order.branch}\n\n"
+        f"Посилання на чат: {chat_url}\n"
+    )
+    html_message = f"<p>Нове замовлення #{order.id}</p><p>Позиції:<br/>{'<br/>'.join([line for line in items_lines])}</p><p>Клієнт: {order.full_name}<br>Телефон: {order.phone}<br>Email: {email}</p><p>Чат: <a href='{chat_url}'>{chat_url}</a></p>"
+
+    recipients = []
+    if getattr(settings, 'ORDER_NOTIFICATION_EMAIL', None):
+        recipients.append(settings.ORDER_NOTIFICATION_EMAIL)
+    if seller and seller.email:
+        recipients.append(seller.email)
+    recipients = list(dict.fromkeys([r for r in recipients if r]))
+
+    for recipient_email in recipients:
+        jobs.enqueue(
+            tasks.SEND_EMAIL,
+            subject=subject,
+            recipient_email=recipient_email,
+            html_content=html_message,
+            text_content=message_body,
+            tags=['order', 'admin-notification'],
+        )
+
+
 @require_POST
 def submit_order(request):
     """
-    Створює замовлення. Підтримує багатопозиційний кошик у session['cart'].
-    Коректно обробляє кілька форматів збереження елементів корзини:
-      - package items: {'unit':'package', 'total_price', 'unit_price_per_100g', 'package_size_grams', 'quantity'}
-      - unit items: {'price_per_100g' or 'price', 'quantity'}
+    Створює замовлення з кошика (seafood.cart); якщо кошик порожній —
+    з одного товару product_id з форми (старий сценарій).
+    Повторний POST з тим самим submission_key (подвійне натискання, повтор
+    проксі) веде на вже створене замовлення, нічого не створюючи вдруге.
     """
-    from django.contrib.auth import get_user_model
-    from decimal import Decimal, ROUND_HALF_UP
-    import traceback
-
-    # Read cart from session
-    cart = request.session.get('cart', {}) or {}
+    key = orders.submission_key(request)
+    existing_id = orders.submitted_order(key)
+    if existing_id:
+        return redirect('order_complete', order_id=existing_id)
+
+    # Read the cart (prices come from the products)
+    cart = carts.get_cart(request)
+    priced = carts.price(cart)
     # Parse common form fields (delivery/contact)
     delivery_type = request.POST.get('delivery_type', '').strip()
     postal = request.POST.get('postal', '').strip()
@@ -1451,6 +1161,7 @@ def submit_order(request):
         product_obj, _ = _product_from_db_or_sample(product_id) if product_id else (None, None)
         return render(request, 'order_form.html', {
             'product': product_obj,
+            'submission_key': key or orders.new_submission_key(),
             'error': "Заповніть всі поля (служба доставки, дані доставки, контактні дані)."
         })
 
@@ -1458,269 +1169,54 @@ def submit_order(request):
     if payment_method == 'cash' and delivery_type != 'nova_branch':
         payment_method = 'card'
 
-    # Build items list either from cart or from POST product_id (fallback to single product)
-    items_data = []  # each item: dict with keys product_obj (db), name, unit_price (Decimal per 100g), qty_units (int number of 100g units), line_total (Decimal), pid
-    total_price = Decimal('0.00')
-    total_qty_grams = 0
-
-    # Case: multi-item cart from session
-    if isinstance(cart, dict) and cart:
-        for pid_str, it in cart.items():
-            try:
-                pid = int(pid_str)
-            except Exception:
-                continue
-
-            # Try to use DB product if exists
-            db_prod = SeafoodProduct.objects.filter(pk=pid).first()
-
-            # Normalize quantity and compute line total depending on structure
-            try:
-                qty = int(it.get('quantity', 1))
-            except Exception:
-                qty = 1
-
-            # Default values
-            unit_price_per_100g = Decimal('0.00')  # price per 100g
-            line_total = Decimal('0.00')
-            qty_units = 0
-            try:
-                if it.get('unit') == 'package':
-                    # package: quantity = number of packages
-                    pkg_size = int(it.get('package_size_grams') or 0)
-                    # If total_price stored, prefer it
-                    tp = it.get('total_price')
-                    if tp:
-                        # total_price likely string
-                        line_total = Decimal(str(tp))
-                        # compute unit_price_per_100g for record (if present)
-                        try:
-                            unit_price_per_100g = Decimal(str(it.get('unit_price_per_100g', '0')))
-                        except Exception:
-                            unit_price_per_100g = Decimal('0.00')
-                    else:
-                        # compute from unit_price_per_100g and pkg_size
-                        unit_price_per_100g = Decimal(str(it.get('unit_price_per_100g', '0')))
-                        total_grams = pkg_size * qty
-                        line_total = (unit_price_per_100g * (Decimal(total_grams) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    # qty_units = total number of 100g units represented by these packages
-                    qty_units = (pkg_size * qty) // 100 if pkg_size else qty
-                    total_qty_grams += pkg_size * qty if pkg_size else qty_units * 100
-                else:
-                    # unit items: assume quantity counts 100g-units or simple units depending on stored fields
-                    # prefer explicit price_per_100g
-                    if it.get('price_per_100g') is not None:
-                        unit_price_per_100g = Decimal(str(it.get('price_per_100g')))
-                        qty_units = qty
-                        line_total = (unit_price_per_100g * Decimal(qty_units)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        total_qty_grams += qty_units * 100
-                    elif it.get('unit_price_per_100g') is not None:
-                        unit_price_per_100g = Decimal(str(it.get('unit_price_per_100g')))
-                        qty_units = qty
-                        line_total = (unit_price_per_100g * Decimal(qty_units)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        total_qty_grams += qty_units * 100
-                    elif it.get('price') is not None:
-                        # legacy: price field may be price per 100g or per unit — assume per 100g to keep compatibility
-                        unit_price_per_100g = Decimal(str(it.get('price')))
-                        qty_units = qty
-                        line_total = (unit_price_per_100g * Decimal(qty_units)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                        total_qty_grams += qty_units * 100
-                    else:
-                        # unknown structure -> skip
-                        unit_price_per_100g = Decimal('0.00')
-                        qty_units = qty
-                        line_total = Decimal('0.00')
-                        total_qty_grams += qty_units * 100
-            except Exception:
-                # fallback defaults if any conversion fails
-                line_total = Decimal('0.00')
-
-            total_price += line_total
-
-            items_data.append({
-                'product_obj': db_prod,
-                'name': it.get('name') or (db_prod.name if db_prod else 'Товар'),
-                'unit_price': unit_price_per_100g,
-                'qty_units': qty_units or qty,
-                'line_total': line_total,
-                'pid': pid,
-            })
+    # Build the order lines either from the cart or from POST product_id (fallback to single product)
+    if priced.lines:
+        lines = orders.lines_from_cart(priced)
     else:
         # Fallback: single product_id from POST (old behaviour)
         product_id = int(request.POST.get('product_id') or 0)
         product_obj, db_prod = _product_from_db_or_sample(product_id) if product_id else (None, None)
         if not product_obj:
             return render(request, '404.html', status=404)
-        try:
-            qty = int(request.POST.get('quantity', 100))
-        except Exception:
-            qty = 100
-        # We expect qty as grams in older form; convert to 100g units
-        if qty >= 10 and qty % 100 == 0:
-            qty_units = max(1, qty // 100)
-        else:
-            qty_units = max(1, qty)
-        unit_price = Decimal(str(product_obj.price_per_100g))
-        line_total = (Decimal(qty) / Decimal(100) * unit_price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if qty >= 10 else (unit_price * Decimal(qty_units)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        total_price = line_total
-        total_qty_grams = qty if isinstance(qty, int) else qty_units * 100
         # Ensure db_prod exists
         if db_prod is None:
             db_prod = SeafoodProduct.objects.create(
                 name=product_obj.name,
                 description=product_obj.description,
-                price_per_100g=unit_price,
+                price_per_100g=product_obj.price_per_100g,
             )
-        items_data.append({
-            'product_obj': db_prod,
-            'name': product_obj.name,
-            'unit_price': unit_price,
-            'qty_units': qty_units,
-            'line_total': line_total,
-            'pid': product_id,
-        })
-
-    # Create Order (product kept nullable — set first product for convenience)
-    first_product = items_data[0]['product_obj'] if items_data and items_data[0].get('product_obj') else None
-    order = Order.objects.create(
-        product=first_product,
-        user=request.user if request.user.is_authenticated else None,
-        full_name=full_name,
-        phone=phone,
-        region=region,
-        city=city,
-        postal=postal,
-        branch=branch,
-        quantity_g=total_qty_grams or (items_data[0]['qty_units'] * 100 if items_data else 100),
-        total_price=total_price,
-        status='created',
-        payment_method=payment_method or 'card',
-        payment_status='not_paid',
-    )
-
-    # Create OrderItem records
-    for it in items_data:
-        prod_obj = it.get('product_obj')
-        # if product not in DB, create a DB record
-        if prod_obj is None:
-            try:
-                prod_obj = SeafoodProduct.objects.create(
-                    name=it.get('name') or 'Товар',
-                    description='',
-                    price_per_100g=it.get('unit_price') or Decimal('0.00'),
-                )
-            except Exception:
-                prod_obj = None
-        # quantity in grams
-        qty_g = int(it.get('qty_units', 1)) * 100
-        OrderItem.objects.create(
-            order=order,
-            product=prod_obj,
-            quantity_g=qty_g,
-            unit_price=it.get('unit_price', Decimal('0.00')),
-            # total_price will be set by OrderItem.save() / order.recalc_totals()
-        )
-
-    # Recalculate totals to ensure consistency
-    try:
-        order.recalc_totals()
-    except Exception:
-        # fallback: ensure total_price set
-        order.total_price = total_price
-        order.quantity_g = total_qty_grams
-        order.save(update_fields=['total_price', 'quantity_g'])
-
-    # create seller user and conversation, messages, etc (keeps your existing logic)
-    try:
-        User = get_user_model()
-        seller = User.objects.filter(username='VugriUa').first()
-        if not seller:
-            seller = User.objects.create(username='VugriUa', email='vugriua@example.com', is_active=True)
-            seller.set_unusable_password()
-            seller.save()
-    except Exception:
-        seller = None
+        # the same steps and prices as a cart line (seafood.pricing)
+        single = pricing.price_items([(db_prod.pk, pricing.parse_quantity(request.POST.get('quantity')))])
+        lines = orders.lines_from_cart(single)
 
-    conv, _ = Conversation.objects.get_or_create(order=order)
-    if order.user:
-        conv.participants.add(order.user)
-    if seller:
-        conv.participants.add(seller)
-    conv.save()
-
-    # Build initial chat message listing all items
-    items_lines = []
-    for oi in order.items.all():
-        prod_name = oi.product.name if oi.product else '(товар)'
-        items_lines.append(f"- {prod_name}: {oi.quantity_g} г — {oi.total_price} грн")
-    items_text = "\n".join(items_lines)
-
-    initial_msg_text = (
-        f"Нове замовлення #{order.id}\n"
-        f"Позиції:\n{items_text}\n\n"
-        f"Клієнт: {order.full_name}\n"
-        f"Телефон: {order.phone}\n"
-        f"Місто: {order.city}\n"
-        f"Адреса/Відділення: {order.branch}\n"
-        f"Email: {email}\n"
-        f"Оплата: {order.get_payment_method_display() if order.payment_method else 'не вказано'}\n"
-    )
-
-    sender = seller if seller else conv.participants.first()
-    if sender:
-        Message.objects.create(conversation=conv, sender=sender, text=initial_msg_text)
-
-    # payment instruction if card
-    if order.payment_method == 'card' and sender:
-        instruction_text = (
-            f"Вітаю!\n\n"
-            f"1) Зайдіть у свій банк або мобільний додаток.\n"
-            f"2) Перекажіть кошти на ФОП Шовка Юрій Васильович: IBAN UA733220010000026009350109011\n"
-            f"   Сума: {order.total_price}\n"
-            f"3) Зробіть фото квитанції та натисніть «Оплачено» в чаті або прикріпіть файл у повідомленні.\n\n"
-            f"Після отримання квитанції ми перевіримо оплату та підтвердимо."
-        )
-        Message.objects.create(conversation=conv, sender=sender, text=instruction_text)
-
-    # Optionally clear cart after successful order creation
+    # Order, items, best-seller ranking, the order chat, emptying the cart and
+    # queueing the staff emails: all or nothing
     try:
-        request.session.pop('cart', None)
-        request.session.modified = True
-    except Exception:
-        pass
-
-    # Send notification email (existing behavior)
-    subject = f"Нове замовлення #{order.id} — VugriUkraine"
-    chat_url = request.build_absolute_uri(reverse('chat', args=[conv.id]))
-    message_body = (
-        f"Нове замовлення #{order.id}\n\n"
-        f"Позиції:\n{items_text}\n\n"
-        f"Дані замовника:\nІм'я: {order.full_name}\nТелефон: {order.phone}\nEmail: {email}\nМісто: {order.city}\nАдреса: {order.branch}\n\n"
-        f"Посилання на чат: {chat_url}\n"
-    )
-    html_message = f"<p>Нове замовлення #{order.id}</p><p>Позиції:<br/>{'<br/>'.join([line for line in items_lines])}</p><p>Клієнт: {order.full_name}<br>Телефон: {order.phone}<br>Email: {email}</p><p>Чат: <a href='{chat_url}'>{chat_url}</a></p>"
-
-    recipients = []
-    if getattr(settings, 'ORDER_NOTIFICATION_EMAIL', None):
-        recipients.append(settings.ORDER_NOTIFICATION_EMAIL)
-    if seller and seller.email:
-        recipients.append(seller.email)
-    recipients = list(dict.fromkeys([r for r in recipients if r]))
-
-    if recipients:
-        try:
-            for recipient_email in recipients:
-                send_email_via_brevo(
-                    subject=subject,
-                    recipient_email=recipient_email,
-                    html_content=html_message,
-                    text_content=message_body,
-                    tags=['order', 'admin-notification']
-                )
-        except Exception:
-            pass
-
-    return redirect('order_complete', order_id=order.id)
+        with transaction.atomic():
+            placed = orders.place_order(
+                lines,
+                email=email,
+                user=request.user if request.user.is_authenticated else None,
+                full_name=full_name,
+                phone=phone,
+                region=region,
+                city=city,
+                postal=postal,
+                branch=branch,
+                status='created',
+                payment_method=payment_method or 'card',
+                payment_status='not_paid',
+                idempotency_key=key,
+            )
+            carts.clear(cart)
+            _enqueue_order_notifications(request, placed, email)
+    except IntegrityError:
+        # the same submission was placed concurrently
+        existing_id = orders.submitted_order(key)
+        if not existing_id:
+            raise
+        return redirect('order_complete', order_id=existing_id)
+    return redirect('order_complete', order_id=placed.order.id)
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
@@ -1839,77 +1335,13 @@ def add_to_cart(request):
         if not product.in_stock:
             return JsonResponse({'ok': False, 'error': 'Товар тимчасово відсутній', 'in_stock': False}, status=400)
 
-        # name (client may send, but fallback to DB)
-        name = request.POST.get('name', product.name or 'Товар')
+        # quantity: packages for packaged products, units for products sold
+        # in units, 100 g portions otherwise; the price always comes from the DB
+        quantity = pricing.parse_quantity(request.POST.get('quantity'))
 
-        # price_per_100g as Decimal (use product DB value; do not trust client price)
-        try:
-            price_per_100g = Decimal(str(product.price_per_100g)) if product.price_per_100g is not None else Decimal('0.00')
-        except Exception:
-            price_per_100g = Decimal('0.00')
-
-        currency = request.POST.get('currency', 'UAH')
-
-        try:
-            q = int(float(request.POST.get('quantity', '1')))
-        except Exception:
-            q = 1
-        quantity = max(1, q)
-
-        image = request.POST.get('image', '')
-
-        cart = _get_cart(request)  # ваш хелпер для сесійної корзини
-        pid = str(product.id)
-
-        # If product sold in packages
-        if getattr(product, 'package_size_grams', None):
-            package_size = int(product.package_size_grams)
-            total_grams = package_size * quantity
-            total_price = (price_per_100g * (Decimal(total_grams) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-            item = {
-                'name': name,
-                'currency': currency,
-                'unit': 'package',
-                'package_size_grams': package_size,
-                'quantity': quantity,               # number of packages
-                'total_grams': total_grams,
-                'unit_price_per_100g': str(price_per_100g),
-                'total_price': str(total_price),
-                'image': image,
-            }
-
-            if pid in cart:
-                existing = cart[pid]
-                existing_qty = int(existing.get('quantity', 0)) + quantity
-                existing_total_grams = package_size * existing_qty
-                existing_total_price = (price_per_100g * (Decimal(existing_total_grams) / Decimal(100))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                existing.update({
-                    'quantity': existing_qty,
-                    'total_grams': existing_total_grams,
-                    'total_price': str(existing_total_price),
-                })
-                cart[pid] = existing
-            else:
-                cart[pid] = item
-
-        else:
-            # standard item (quantity = units)
-            unit_price = price_per_100g.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            if pid in cart:
-                cart[pid]['quantity'] = int(cart[pid].get('quantity', 0)) + quantity
-            else:
-                cart[pid] = {
-                    'name': name,
-                    'price_per_100g': str(unit_price),
-                    'currency': currency,
-                    'unit': 'unit',
-                    'quantity': quantity,
-                    'image': image
-                }
-
-        request.session.modified = True
-        return JsonResponse({'ok': True, 'cart_count': cart_count(request)})
+        cart = carts.get_cart(request, create=True)
+        carts.add(cart, product.pk, quantity)
+        return JsonResponse({'ok': True, 'cart_count': carts.count(cart)})
 
     except Exception as e:
         # Лог у консоль/термінал для діагностики
@@ -1985,7 +1417,7 @@ def delete_review(request, review_id):
 
     review = get_object_or_404(Review, pk=review_id)
     product_id = review.product_id
-    review.delete()
+    reviews.delete_review(review)
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({'ok': True, 'review_id': review_id})
@@ -2001,7 +1433,7 @@ def debug_session_cart(request):
     data = {k: request.session.get(k) for k in request.session.keys()}
     return JsonResponse({
         'session_keys': list(request.session.keys()),
-        'cart': request.session.get('cart'),
+        'cart': [(line.product_id, line.quantity) for line in carts.price(carts.get_cart(request)).lines],
         'full': data
     }, json_dumps_params={'ensure_ascii': False})
 
@@ -2011,22 +1443,9 @@ def request_callback(request):
     form = CallbackRequestForm(request.POST)
     if form.is_valid():
         cb = form.save()
-        # опціонально: відправити email адміну
-        try:
-            admin_email = getattr(settings, 'ADMIN_EMAIL', None)
-            if admin_email:
-                send_callback_request_notification_email(
-                    admin_email=admin_email,
-                    callback_id=cb.pk,
-                    caller_name=cb.name,
-                    caller_phone=cb.phone,
-                    product_name=str(cb.product) if cb.product else '',
-                    preferred_time=cb.preferred_time or '',
-                    message=cb.message
-                )
-        except Exception:
-            # не впаде при помилці відправки пошти
-            pass
+        # опціонально: email адміну (ADMIN_EMAIL) — через чергу завдань
+        if getattr(settings, 'ADMIN_EMAIL', None):
+            jobs.enqueue(tasks.CALLBACK_NOTIFICATION, callback_id=cb.pk)
         return JsonResponse({'ok': True, 'message': 'Дякуємо! Ми вам зателефонуємо.'})
     else:
         # повертаємо помилки в JSON
@@ -100,17 +100,65 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Your local development static files location(s)
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
-# Whitenoise storage - Manifest storage provides cache-busting file names.
+# Storages. Static files go through WhiteNoise's manifest storage (hashed,
+# compressed, cache-busting names) extended by seafood.static_storage, which
+# also writes resized WebP/AVIF copies of static/images and ASCII-safe names.
 # If you hit ManifestStaticFilesStorage errors during collectstatic, you can
-# temporarily switch to CompressedStaticFilesStorage while fixing missing references.
-STATICFILES_STORAGE = os.environ.get(
-    'DJANGO_STATICFILES_STORAGE',
-    'whitenoise.storage.CompressedManifestStaticFilesStorage'
-)
+# temporarily set DJANGO_STATICFILES_STORAGE to
+# whitenoise.storage.CompressedStaticFilesStorage while fixing missing references.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': os.environ.get('DJANGO_STATICFILES_STORAGE', 'seafood.static_storage.OptimizedStaticFilesStorage'),
+    },
+}
+# Widths (px) of the WebP/AVIF copies made of static/images at collectstatic time.
+STATIC_IMAGE_WIDTHS = (480, 960, 1600)
 
 # Media (user-uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Who sends media bytes once seafood.media_delivery has authorized a request:
+# 'nginx' (X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an `internal` location
+# aliased to MEDIA_ROOT), 'sendfile' (X-Sendfile for Apache/lighttpd), or ''
+# to stream from Python.
+MEDIA_ACCEL = os.environ.get('DJANGO_MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = os.environ.get('DJANGO_MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Payment receipts uploaded in the order chat (seafood.receipts): upload limits
+# enforced while the file streams in, and the longest side of the copy shown in chat.
+RECEIPT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+RECEIPT_MAX_PIXELS = 40_000_000
+RECEIPT_MAX_SIDE = 1600
+
+# Cache. Point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache + redis://...) in production
+# so every gunicorn worker sees the same catalog version; local memory is the
+# dev default.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'vugri-default'),
+    }
+}
+# Lifetime of prepared catalog pages; entries are invalidated by version bumps anyway.
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 3600))
+# Upper bound on ?q= matches fed into the catalog (see seafood.search).
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 200))
+# Sliding window for "Хіти продажу"; rebuild with `manage.py refresh_bestsellers`.
+BESTSELLERS_WINDOW_DAYS = int(os.environ.get('BESTSELLERS_WINDOW_DAYS', 90))
+# "Bought together" neighbors kept per product; rebuild with `manage.py rebuild_recommendations`.
+RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', 12))
+# Background jobs (seafood.jobs), run by `manage.py run_jobs`: how long a worker
+# holds a claimed job, how often a failing job is tried, the retry backoff
+# (doubling from the base, capped) and how long finished jobs are kept.
+JOBS_LEASE_SECONDS = int(os.environ.get('JOBS_LEASE_SECONDS', 300))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_RETRY_BASE_SECONDS = 30
+JOBS_RETRY_MAX_SECONDS = 60 * 60
+JOBS_KEEP_DAYS = 7
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -139,6 +187,12 @@ DEFAULT_FROM_EMAIL = (
 BREVO_API_KEY = os.getenv('BREVO_API_KEY', '')
 BREVO_SENDER_EMAIL = os.getenv('BREVO_SENDER_EMAIL', DEFAULT_FROM_EMAIL)
 BREVO_SENDER_NAME = os.getenv('BREVO_SENDER_NAME', 'VugriUkraine')
+# Recipients per Brevo request (one messageVersion each; seafood.brevo_email.Outbox),
+# and the circuit breaker: after this many failed Brevo calls in a row, mail goes
+# straight to SMTP for BREVO_BREAKER_RESET_SECONDS before Brevo is tried again.
+BREVO_BATCH_SIZE = 100
+BREVO_BREAKER_THRESHOLD = 5
+BREVO_BREAKER_RESET_SECONDS = 60
 
 # App-specific settings
 ORDER_NOTIFICATION_EMAIL = os.getenv('ORDER_NOTIFICATION_EMAIL', DEFAULT_FROM_EMAIL)
@@ -1,13 +1,9 @@
 from django.contrib import admin
 from django.urls import include, re_path, path, reverse_lazy
 from django.contrib.auth import views as auth_views
-from django.views.static import serve
 
-from seafood import views as seafood_views
+from seafood import media_delivery, views as seafood_views
 
-from django.conf import settings
-from django.conf.urls.static import static
-import os
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -15,8 +11,10 @@ urlpatterns = [
 
     # Site / products
     path('products/', seafood_views.products, name='products'),
+    path('products/more/', seafood_views.products_more, name='products_more'),
     path('product/<int:product_id>/', seafood_views.product_details, name='product_details'),
     path('product/<int:product_id>/review/', seafood_views.submit_review, name='submit_review'),
+    path('product/<int:product_id>/reviews/', seafood_views.product_reviews, name='product_reviews'),
     path('order/<int:product_id>/', seafood_views.order_form, name='order_form'),
     path('submit_order/', seafood_views.submit_order, name='submit_order'),
     path('fetch_branches/', seafood_views.fetch_postal_branches, name='fetch_branches'),
@@ -126,12 +124,11 @@ urlpatterns += [
     ),
 ]
 
-# TEMPORARY: serve media only when explicitly enabled or in DEBUG
-# NOTE: do NOT rely on Django to serve media in production long-term.
-# Enable with env var SERVE_MEDIA=1 (or use DEBUG=True for local development).
-if os.environ.get('SERVE_MEDIA', '').lower() in ('1', 'true', 'yes'):
-    urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    ]
-elif settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Media goes through seafood.media_delivery: it checks receipt permissions and
+# sets cache headers, then hands the transfer to the front proxy
+# (X-Accel-Redirect / X-Sendfile, see MEDIA_ACCEL) or, without one, streams the
+# file itself with Range support. A proxy serving public folders directly
+# should still send /media/receipts/ here.
+urlpatterns += [
+    re_path(r'^media/(?P<path>.+)$', media_delivery.serve_media, name='media'),
+]